@@ -0,0 +1,82 @@
+import time
+import numpy as np
+import pandas as pd
+
+import data.addresses as addresses
+
+"""
+Benchmark for the normalization of street names on a synthetic address set
+with the size of the national BD TOPO address registry. It compares the former
+cleaning of data.bdtopo.cleaned, which applies one str.replace per rule to all
+addresses, with the single pass over the unique street names in
+data.addresses. The rules of both differ slightly (hyphens and apostrophes are
+now replaced before numbers are written out, and PTE is expanded as in
+SIRENE), so the number of differing street names is reported.
+
+Run from the repository root:
+
+    python -m benchmarks.addresses
+"""
+
+ADDRESSES = 2200000
+STREETS = 400000
+
+TYPES = ["R", "AV", "BD", "PL", "CHE", "IMP", "ALL", "QU", "RTE", "PLACE"]
+WORDS = [
+    "DE LA", "DU", "DES", "ST", "STE", "SAINT", "GENERAL", "MARECHAL", "VICTOR", "HUGO", "JEAN",
+    "JAURES", "PASTEUR", "REPUBLIQUE", "GARE", "EGLISE", "MOULIN", "CHATEAU", "PARIS", "PTE",
+    "LILAS", "FOCH", "GAULLE", "L'EGLISE", "D'ARC", "8 MAI", "11 NOVEMBRE", "2 EGLISES",
+    "3 COMMUNES", "4 VENTS", "JEAN-JAURES", "ST-MARTIN", "PIERRE-ET-MARIE"
+]
+
+def create_addresses(random, addresses, streets):
+    lengths = 1 + random.randint(4, size = streets)
+    words = np.array(WORDS, dtype = object)[random.randint(len(WORDS), size = np.sum(lengths))]
+    offsets = np.hstack([[0], np.cumsum(lengths)])
+
+    names = [
+        " ".join([TYPES[street_type]] + list(words[offsets[index]:offsets[index + 1]]))
+        for index, street_type in enumerate(random.randint(len(TYPES), size = streets))
+    ]
+
+    return pd.Series(np.array(names, dtype = object)[random.randint(streets, size = addresses)])
+
+def reference_normalize(df):
+    df = df.str.replace("2 ", "DEUX ")
+    df = df.str.replace("4 ", "QUATRE ")
+    df = df.str.replace("3 ", "TROIS ")
+    df = df.str.replace("-", " ")
+    df = df.str.replace("'", " ")
+    df = df.str.replace(" ST ", " SAINT ")
+    df = df.str.replace(r"^ST ", "SAINT ")
+    df = df.str.replace(" STE ", " SAINTE ")
+    df = df.str.replace(r"^STE ", "SAINTE ")
+    df = df.str.replace(r"^PLACE ", "PL ")
+    return df
+
+def measure(label, function, df):
+    start = time.time()
+    result = function(df)
+    runtime = time.time() - start
+
+    print("%-30s %8.2fs" % (label, runtime))
+    return result, runtime
+
+def run(addresses_count = ADDRESSES, streets = STREETS, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+    df = create_addresses(random, addresses_count, streets)
+
+    print("Normalizing %d addresses with %d unique street names" % (len(df), df.nunique()))
+
+    reference, reference_runtime = measure("One pass per rule", reference_normalize, df)
+    normalized, normalized_runtime = measure("Single pass, unique names", addresses.normalize_streets, df)
+
+    differences = reference != normalized
+    print("Differing street names: %d unique (%.2f%% of addresses)" % (
+        df[differences].nunique(), 100 * np.count_nonzero(differences) / len(df)
+    ))
+
+    print("Speed-up: %.1fx" % (reference_runtime / normalized_runtime,))
+
+if __name__ == "__main__":
+    run()
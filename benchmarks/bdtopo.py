@@ -0,0 +1,131 @@
+import os
+import time
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely.geometry as geo
+import fiona
+
+import data.dbf as dbf
+import data.shapefile as shapefile
+
+"""
+Benchmark for reading the BD TOPO address registry (ADRESSE.shp). A synthetic
+point shapefile with the attributes of the registry is written, and the
+addresses of a few departements are read feature by feature with fiona (the
+former implementation) and with data.dbf and data.shapefile, in one process and
+with ranges of records in parallel. The results are checked to be identical.
+
+Run from the repository root:
+
+    python -m benchmarks.bdtopo
+"""
+
+ADDRESSES = 500000
+DEPARTEMENTS = ["75", "77", "78", "91", "92", "93", "94", "95", "971"]
+CHUNK_SIZE = 100000
+
+def write_addresses(path, addresses, random):
+    departements = np.array(["%02d" % index for index in range(1, 96)] + ["971", "972", "2A", "2B"], dtype = object)
+    communes = departements[random.randint(len(departements), size = addresses)] + pd.Series(random.randint(100, size = addresses)).map("{:03d}".format).values
+    communes = np.array([commune[:5] for commune in communes], dtype = object)
+
+    df = gpd.GeoDataFrame(dict(
+        CODE_INSEE = communes,
+        NUMERO = random.randint(1, 200, size = addresses),
+        NOM_1 = np.array(["R DE LA GARE", "AV JEAN JAURES", "PL DE L'ÉGLISE", "CHE DU MOULIN"], dtype = object)[random.randint(4, size = addresses)]
+    ), geometry = gpd.points_from_xy(random.random_sample(size = addresses) * 1e6, random.random_sample(size = addresses) * 1e6), crs = "EPSG:2154")
+
+    df.to_file(path)
+
+def read_fiona(path, departements):
+    df_bdtopo = []
+
+    with fiona.open(path) as archive:
+        for item in archive:
+            code = item["properties"]["CODE_INSEE"]
+
+            if code[:2] in departements or code[:3] in departements:
+                df_bdtopo.append(dict(
+                    geometry = geo.Point(*item["geometry"]["coordinates"]),
+                    commune_id = item["properties"]["CODE_INSEE"],
+                    raw_number = pd.to_numeric(item["properties"]["NUMERO"]),
+                    raw_street = item["properties"]["NOM_1"]
+                ))
+
+    return gpd.GeoDataFrame(pd.DataFrame.from_records(df_bdtopo), crs = "EPSG:2154")
+
+def to_frame(path, df):
+    x, y = shapefile.read_points(path, df.index.values)
+
+    return gpd.GeoDataFrame(dict(
+        commune_id = df["CODE_INSEE"].values,
+        raw_number = pd.to_numeric(df["NUMERO"], errors = "coerce").values,
+        raw_street = df["NOM_1"].values
+    ), geometry = gpd.points_from_xy(x, y), crs = "EPSG:2154")
+
+def read_range(arguments):
+    return dbf.read_records(*arguments)
+
+def read_serial(path, departements):
+    dbf_path = "%s.dbf" % os.path.splitext(path)[0]
+    header = dbf.read_header(dbf_path)
+
+    df = dbf.read_records(dbf_path, header, 0, header[0], ["CODE_INSEE", "NUMERO", "NOM_1"],
+        [], shapefile.read_codec(path), [(["CODE_INSEE"], departements)])
+
+    return to_frame(path, df)
+
+def read_parallel(path, departements):
+    dbf_path = "%s.dbf" % os.path.splitext(path)[0]
+    header = dbf.read_header(dbf_path)
+
+    ranges = [
+        (dbf_path, header, start, min(start + CHUNK_SIZE, header[0]), ["CODE_INSEE", "NUMERO", "NOM_1"],
+            [], shapefile.read_codec(path), [(["CODE_INSEE"], departements)])
+        for start in range(0, header[0], CHUNK_SIZE)
+    ]
+
+    with mp.Pool() as pool:
+        return to_frame(path, pd.concat(pool.map(read_range, ranges)))
+
+def measure(label, function, *arguments):
+    start = time.time()
+    result = function(*arguments)
+    runtime = time.time() - start
+
+    print("%-30s %8.2fs" % (label, runtime))
+    return result, runtime
+
+def check(df_reference, df):
+    assert len(df_reference) == len(df)
+
+    for column in ("commune_id", "raw_number", "raw_street"):
+        assert np.all(df_reference[column].values == df[column].values)
+
+    assert np.all(df_reference.geometry.x.values == df.geometry.x.values)
+    assert np.all(df_reference.geometry.y.values == df.geometry.y.values)
+
+def run(addresses = ADDRESSES, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = "%s/ADRESSE.shp" % directory
+        write_addresses(path, addresses, random)
+
+        print("Reading %d addresses (%.0f MB)" % (addresses, (os.path.getsize(path) + os.path.getsize("%s/ADRESSE.dbf" % directory)) * 1e-6))
+
+        df_reference, reference_runtime = measure("fiona", read_fiona, path, set(DEPARTEMENTS))
+        df_serial, serial_runtime = measure("Columnar", read_serial, path, DEPARTEMENTS)
+        df_parallel, parallel_runtime = measure("Columnar (parallel)", read_parallel, path, DEPARTEMENTS)
+
+    check(df_reference, df_serial)
+    check(df_reference, df_parallel)
+
+    print("Speed-up (serial):   %.1fx" % (reference_runtime / serial_runtime,))
+    print("Speed-up (parallel): %.1fx" % (reference_runtime / parallel_runtime,))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,175 @@
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+import data.census.cleaned as cleaned
+
+"""
+Benchmark for the cleaning of the raw census attributes on a synthetic census
+extract. By default, it has half the size of the census of Île-de-France
+(FD_INDCVIZA, 4.3M records), because the former implementation needs several
+gigabytes of memory for the full extract. It compares the former
+implementation, which decodes the attributes row by row and constructs household
+IDs by concatenating strings (with the IDs of persons outside of households
+starting after the last household, as in data.census.cleaned), with the
+decoding based on code tables in data.census.cleaned. For each, the runtime and the peak memory (as traced by
+tracemalloc) are reported, and the results are checked to be identical.
+
+Run from the repository root:
+
+    python -m benchmarks.census
+"""
+
+PERSONS = 2000000
+COMMUNES = 1300
+
+def choice(random, values, size):
+    return np.array(values, dtype = object)[random.randint(len(values), size = size)]
+
+def create_census(random, persons, communes):
+    # Households of one to six persons, and persons outside of households
+    household_sizes = random.randint(1, 7, size = persons // 2)
+    household_sizes = household_sizes[np.cumsum(household_sizes) <= persons]
+    household_persons = np.sum(household_sizes)
+
+    nummi = np.repeat(np.array(["%07d" % index for index in range(len(household_sizes))], dtype = object), household_sizes)
+    nummi = np.hstack([nummi, np.array(["Z"] * (persons - household_persons), dtype = object)])
+
+    cantville = np.repeat(choice(random, ["%04d" % index for index in range(3000)], len(household_sizes)), household_sizes)
+    cantville = np.hstack([cantville, choice(random, ["%04d" % index for index in range(3000)], persons - household_persons)])
+
+    # Zones, of which some are not covered by IRIS or not known
+    commune_ids = ["%02d%03d" % (75 + index % 20, index) for index in range(communes)]
+
+    iris_ids = ["%s%04d" % (commune_id, index) for commune_id in commune_ids[:communes // 2] for index in range(20)]
+    iris_ids += ["%sXXXX" % commune_id for commune_id in commune_ids[communes // 2:]]
+    iris_ids += ["ZZZZZZZZZ"]
+
+    iris = choice(random, iris_ids, persons)
+    departements = np.array([value[:2] if value[0] != "Z" else "75" for value in iris_ids], dtype = object)[
+        pd.Index(iris_ids).get_indexer(iris)]
+
+    return pd.DataFrame(dict(
+        CANTVILLE = cantville, NUMMI = nummi,
+        AGED = choice(random, ["%03d" % age for age in range(100)], persons),
+        COUPLE = choice(random, ["1", "2"], persons),
+        CS1 = choice(random, [str(value) for value in range(1, 9)], persons),
+        DEPT = departements,
+        ETUD = choice(random, ["1", "2"], persons),
+        ILETUD = choice(random, ["1", "2", "3", "4", "5", "6", "Z"], persons),
+        ILT = choice(random, ["1", "2", "3", "4", "5", "6", "Z"], persons),
+        IPONDI = random.random_sample(size = persons) * 5.0,
+        IRIS = iris,
+        REGION = choice(random, ["11"], persons),
+        SEXE = choice(random, ["1", "2"], persons),
+        TACT = choice(random, ["11", "12", "21", "22", "24", "25"], persons),
+        TRANS = choice(random, ["1", "2", "3", "4", "5", "Z"], persons),
+        VOIT = choice(random, ["0", "1", "2", "3", "X", "Z"], persons),
+        DEROU = choice(random, ["0", "1", "2", "U", "X", "Z"], persons)
+    ))
+
+def reference_clean_attributes(df):
+    # Construct household IDs for persons with NUMMI != Z
+    df_household_ids = df[["CANTVILLE", "NUMMI"]]
+    df_household_ids = df_household_ids[df_household_ids["NUMMI"] != "Z"]
+    df_household_ids["temporary"] = df_household_ids["CANTVILLE"] + df_household_ids["NUMMI"]
+    df_household_ids = df_household_ids.drop_duplicates("temporary")
+    df_household_ids["household_id"] = np.arange(len(df_household_ids))
+    df = pd.merge(df, df_household_ids, on = ["CANTVILLE", "NUMMI"], how = "left")
+
+    # Fill up undefined household ids (those where NUMMI == Z)
+    f = np.isnan(df["household_id"])
+    df.loc[f, "household_id"] = np.arange(np.count_nonzero(f)) + df["household_id"].max() + 1
+    df["household_id"] = df["household_id"].astype(np.int)
+
+    df["person_id"] = np.arange(len(df))
+    df = df.sort_values(by = ["household_id", "person_id"])
+
+    df["departement_id"] = df["DEPT"].astype("category")
+
+    df["commune_id"] = df["IRIS"].str[:5]
+    f_undefined = df["commune_id"].str.contains("Z")
+    df.loc[f_undefined, "commune_id"] = "undefined"
+    df["commune_id"] = df["commune_id"].astype("category")
+
+    df["iris_id"] = df["IRIS"]
+    f_undefined = df["iris_id"].str.contains("Z") | df["iris_id"].str.contains("X")
+    df.loc[f_undefined, "iris_id"] = "undefined"
+    df["iris_id"] = df["iris_id"].astype("category")
+
+    df["age"] = df["AGED"].apply(lambda x: "0" if x == "000" else x.lstrip("0")).astype(np.int)
+    df["couple"] = df["COUPLE"] == "1"
+
+    df.loc[df["TRANS"] == "1", "commute_mode"] = np.nan
+    df.loc[df["TRANS"] == "2", "commute_mode"] = "walk"
+    df.loc[df["TRANS"] == "3", "commute_mode"] = "bike"
+    df.loc[df["TRANS"] == "4", "commute_mode"] = "car"
+    df.loc[df["TRANS"] == "5", "commute_mode"] = "pt"
+    df.loc[df["TRANS"] == "Z", "commute_mode"] = np.nan
+    df["commute_mode"] = df["commute_mode"].astype("category")
+
+    df["weight"] = df["IPONDI"].astype(np.float)
+
+    df.loc[df["SEXE"] == "1", "sex"] = "male"
+    df.loc[df["SEXE"] == "2", "sex"] = "female"
+    df["sex"] = df["sex"].astype("category")
+
+    df["employed"] = df["TACT"] == "11"
+    df["studies"] = df["ETUD"] == "1"
+
+    df["number_of_vehicles"] = df["VOIT"].apply(
+        lambda x: str(x).replace("Z", "0").replace("X", "0")
+    ).astype(np.int)
+
+    df["number_of_vehicles"] += df["DEROU"].apply(
+        lambda x: str(x).replace("U", "0").replace("Z", "0").replace("X", "0")
+    ).astype(np.int)
+
+    df_size = df[["household_id"]].groupby("household_id").size().reset_index(name = "household_size")
+    df = pd.merge(df, df_size)
+
+    df["socioprofessional_class"] = df["CS1"].astype(np.int)
+
+    df["work_outside_region"] = df["ILT"].isin(("4", "5", "6"))
+    df["education_outside_region"] = df["ILETUD"].isin(("4", "5", "6"))
+
+    return df
+
+def measure(label, function, df):
+    start = time.time()
+    result = function(df)
+    runtime = time.time() - start
+
+    # Measure memory in a second run, because tracing slows down the first
+    tracemalloc.start()
+    function(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("%-30s %8.2fs, peak memory %8.0f MB" % (label, runtime, peak * 1e-6))
+    return result, runtime
+
+def run(persons = PERSONS, communes = COMMUNES, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+    df_raw = create_census(random, persons, communes)
+
+    # The raw stage stores strings as categorical (see data.columnar)
+    df_categorical = df_raw.copy()
+
+    for column in df_categorical.columns:
+        if df_categorical[column].dtype == object:
+            df_categorical[column] = df_categorical[column].astype("category")
+
+    print("Cleaning census with %d persons" % persons)
+
+    df_reference, reference_runtime = measure("Row by row", reference_clean_attributes, df_raw)
+    df_cleaned, cleaned_runtime = measure("Code tables", cleaned.clean_attributes, df_categorical)
+
+    columns = list(df_cleaned.columns)
+    pd.testing.assert_frame_equal(df_reference[columns].reset_index(drop = True), df_cleaned.reset_index(drop = True))
+
+    print("Speed-up: %.1fx" % (reference_runtime / cleaned_runtime,))
+
+if __name__ == "__main__":
+    run()
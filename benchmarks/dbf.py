@@ -0,0 +1,126 @@
+import os
+import time
+import struct
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import simpledbf
+
+import data.dbf as dbf
+import data.census.raw as raw
+
+"""
+Benchmark for reading the census (FD_INDCVIZA) from DBF. A synthetic table with
+the layout of the census (88 fields, of which data.census.raw requests 17) is
+written, and the census of a few departements is read with simpledbf in chunks
+(the former implementation) and with data.dbf, in one process and with ranges
+of records in parallel. The results are checked to be identical.
+
+Run from the repository root:
+
+    python -m benchmarks.dbf
+"""
+
+RECORDS = 200000
+FIELDS = 88
+DEPARTEMENTS = ["75", "77", "78", "91", "92", "93", "94", "95"]
+CHUNK_SIZE = 100000
+
+def write_table(path, records, random):
+    names = list(raw.COLUMNS) + ["F%02d" % index for index in range(FIELDS - len(raw.COLUMNS))]
+    values = {}
+
+    for name in names:
+        if name == "IPONDI":
+            values[name] = np.char.rjust(np.char.mod("%.7f", random.random_sample(size = records) * 10.0).astype("S10"), 10)
+        elif name == "DEPT":
+            values[name] = np.char.ljust(np.array(["%02d" % value for value in random.randint(1, 96, size = 100)], dtype = "S3")[random.randint(100, size = records)], 3)
+        else:
+            values[name] = np.char.ljust(np.char.mod("%d", random.randint(100000, size = records)).astype("S6"), 6)
+
+    sizes = [values[name].dtype.itemsize for name in names]
+    types = [b"N" if name == "IPONDI" else b"C" for name in names]
+
+    header_length = 32 + 32 * len(names) + 1
+    record_length = 1 + sum(sizes)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<B3xLHH20x", 3, records, header_length, record_length))
+
+        for name, type, size in zip(names, types, sizes):
+            f.write(struct.pack("<11sc4xBB14x", name.encode(), type, size, 7 if name == "IPONDI" else 0))
+
+        f.write(b"\r")
+
+        table = np.zeros((records, record_length), dtype = np.uint8)
+        table[:, 0] = ord(" ")
+        offset = 1
+
+        for name, size in zip(names, sizes):
+            table[:, offset:offset + size] = values[name].view(np.uint8).reshape((records, size))
+            offset += size
+
+        f.write(table.tobytes())
+        f.write(b"\x1a")
+
+def read_simpledbf(path, departements):
+    records = []
+
+    for df_chunk in simpledbf.Dbf5(path).to_dataframe(chunksize = 10240):
+        df_chunk = df_chunk[df_chunk["DEPT"].isin(departements)]
+        df_chunk = df_chunk[raw.COLUMNS]
+
+        if len(df_chunk) > 0:
+            records.append(df_chunk)
+
+    return pd.concat(records)
+
+def read_range(arguments):
+    return dbf.read_records(*arguments)
+
+def read_serial(path, departements):
+    header = dbf.read_header(path)
+    return dbf.read_records(path, header, 0, header[0], raw.COLUMNS, [(["DEPT"], departements)])
+
+def read_parallel(path, departements):
+    header = dbf.read_header(path)
+    filters = [(["DEPT"], departements)]
+
+    ranges = [
+        (path, header, start, min(start + CHUNK_SIZE, header[0]), raw.COLUMNS, filters)
+        for start in range(0, header[0], CHUNK_SIZE)
+    ]
+
+    with mp.Pool() as pool:
+        return pd.concat(pool.map(read_range, ranges))
+
+def measure(label, function, *arguments):
+    start = time.time()
+    result = function(*arguments)
+    runtime = time.time() - start
+
+    print("%-30s %8.2fs" % (label, runtime))
+    return result, runtime
+
+def run(records = RECORDS, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = "%s/census.dbf" % directory
+        write_table(path, records, random)
+
+        print("Reading %d records with %d fields (%.0f MB)" % (records, FIELDS, os.path.getsize(path) * 1e-6))
+
+        df_reference, reference_runtime = measure("simpledbf", read_simpledbf, path, DEPARTEMENTS)
+        df_serial, serial_runtime = measure("Columnar", read_serial, path, DEPARTEMENTS)
+        df_parallel, parallel_runtime = measure("Columnar (parallel)", read_parallel, path, DEPARTEMENTS)
+
+    pd.testing.assert_frame_equal(df_reference, df_serial, check_index_type = False)
+    pd.testing.assert_frame_equal(df_reference, df_parallel, check_index_type = False)
+
+    print("Speed-up (serial):   %.1fx" % (reference_runtime / serial_runtime,))
+    print("Speed-up (parallel): %.1fx" % (reference_runtime / parallel_runtime,))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,82 @@
+import time
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely.geometry as geo
+
+import synthesis.population.spatial.primary.locations as locations
+
+"""
+Benchmark for the assignment of commute destinations to the persons of one
+origin municipality. It compares the greedy ordering by distance, which visits
+all remaining candidates for every person, with the ordering based on a KD-tree
+and with the global assignment (see 'primary_location_ordering'). For each, the
+runtime and the mean deviation between the distance from home and the commute
+distance are reported, and the first two are checked to yield the same result.
+
+Run from the repository root:
+
+    python -m benchmarks.ordering
+"""
+
+SIZES = [1000, 4000, 16000]
+EXTENT = 20000.0
+
+class Progress:
+    def update(self, count = 1):
+        pass
+
+def create_municipality(size, random):
+    home_coordinates = random.normal(loc = 0.5 * EXTENT, scale = 0.05 * EXTENT, size = (size, 2))
+    commute_coordinates = random.random_sample(size = (size, 2)) * EXTENT
+
+    df_persons = pd.DataFrame(dict(
+        home_location = [geo.Point(*coordinate) for coordinate in home_coordinates],
+        commute_distance = random.lognormal(mean = 8.0, sigma = 0.8, size = size)
+    ))
+
+    df_candidates = gpd.GeoDataFrame(dict(
+        geometry = [geo.Point(*coordinate) for coordinate in commute_coordinates]
+    ))
+
+    return df_persons, df_candidates
+
+def measure(ordering, df_persons, df_candidates):
+    start = time.time()
+    indices = locations.ORDERINGS[ordering](df_persons, df_candidates, Progress())
+    runtime = time.time() - start
+
+    home_coordinates = np.array([point.coords[0] for point in df_persons["home_location"]])
+    commute_coordinates = np.array([point.coords[0] for point in df_candidates["geometry"]])[indices]
+
+    distances = np.sqrt(np.sum((commute_coordinates - home_coordinates)**2, axis = 1))
+    deviation = np.mean(np.abs(distances - df_persons["commute_distance"].values))
+
+    return np.array(indices), runtime, deviation
+
+def run(sizes = SIZES, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+
+    # Warm-up for JIT compilation
+    measure("indexed", *create_municipality(100, random))
+    measure("assignment", *create_municipality(100, random))
+
+    print("Ordering commute destinations")
+
+    for size in sizes:
+        df_persons, df_candidates = create_municipality(size, random)
+        distance_indices = None
+
+        for ordering in ("distance", "indexed", "assignment"):
+            indices, runtime, deviation = measure(ordering, df_persons, df_candidates)
+            label = "%d persons, %s" % (size, ordering)
+
+            if distance_indices is None:
+                distance_indices = indices
+
+            print("%-30s %8.2fs, mean deviation %8.2f m, identical to distance: %s" % (
+                label, runtime, deviation, np.all(indices == distance_indices)
+            ))
+
+if __name__ == "__main__":
+    run()
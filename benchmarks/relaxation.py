@@ -0,0 +1,55 @@
+import time
+import numpy as np
+
+import synthesis.population.spatial.secondary.rda as rda
+
+"""
+Micro-benchmark for the gravity relaxation of secondary location chains. It
+compares solving the chains one by one with solving them as one batch, in
+which chains of the same size are relaxed together.
+
+Run from the repository root:
+
+    python -m benchmarks.relaxation
+"""
+
+CHAINS = 2000
+
+def create_chains(chains, random):
+    problems, distances = [], []
+
+    for index in range(chains):
+        size = random.randint(2, 5)
+        origin = random.random_sample((1, 2)) * 5000.0
+        destination = random.random_sample((1, 2)) * 5000.0
+
+        problems.append(dict(origin = origin, destination = destination, size = size))
+        distances.append(random.random_sample(size + 1) * 4000.0)
+
+    return problems, distances
+
+def run(chains = CHAINS, random_seed = 0):
+    problems, distances = create_chains(chains, np.random.RandomState(random_seed))
+
+    print("Relaxing %d chains" % chains)
+
+    start = time.time()
+    solver = rda.GravityChainSolver(np.random.RandomState(random_seed))
+    reference = [solver.solve(problem, problem_distances) for problem, problem_distances in zip(problems, distances)]
+    sequential_runtime = time.time() - start
+
+    start = time.time()
+    solver = rda.GravityChainSolver(np.random.RandomState(random_seed))
+    results = solver.solve_batch(problems, distances)
+    batch_runtime = time.time() - start
+
+    for reference_result, result in zip(reference, results):
+        assert np.all(reference_result["locations"] == result["locations"])
+        assert reference_result["valid"] == result["valid"]
+
+    print("%-30s %8.3fs" % ("Sequential", sequential_runtime))
+    print("%-30s %8.3fs" % ("Batch", batch_runtime))
+    print("Speed-up: %.1fx" % (sequential_runtime / batch_runtime,))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,60 @@
+import time
+import numpy as np
+import numba
+
+import data.sampling as sampling
+
+"""
+Micro-benchmark for the index sampling kernel that is used in statistical
+matching and for distance sampling. It compares the former linear scan
+(np.count_nonzero(cdf < u) per draw) with the binary search variants.
+
+Run from the repository root:
+
+    python -m benchmarks.sampling
+"""
+
+TARGETS = 1000000
+OBSERVATIONS = 10000
+
+@numba.jit(nopython = True)
+def linear_sample_indices(uniform, cdf):
+    indices = np.empty((len(uniform),), dtype = np.int64)
+
+    for i in range(len(uniform)):
+        indices[i] = np.count_nonzero(cdf < uniform[i])
+
+    return indices
+
+def measure(label, function, uniform, cdf):
+    function(uniform[:10], cdf) # Warm-up for JIT compilation
+
+    start = time.time()
+    result = function(uniform, cdf)
+    runtime = time.time() - start
+
+    print("%-30s %8.3fs" % (label, runtime))
+    return result, runtime
+
+def run(targets = TARGETS, observations = OBSERVATIONS, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+
+    cdf = np.cumsum(random.random_sample(size = observations))
+    cdf /= cdf[-1]
+
+    uniform = random.random_sample(size = targets)
+
+    print("Sampling %d targets from %d observations" % (targets, observations))
+
+    reference, linear_runtime = measure("Linear scan", linear_sample_indices, uniform, cdf)
+    serial, serial_runtime = measure("Binary search", sampling.sample_indices, uniform, cdf)
+    parallel, parallel_runtime = measure("Binary search (parallel)", lambda u, c: sampling.sample_indices(u, c, parallel = True), uniform, cdf)
+
+    assert np.all(reference == serial)
+    assert np.all(reference == parallel)
+
+    print("Speed-up (serial):   %.1fx" % (linear_runtime / serial_runtime,))
+    print("Speed-up (parallel): %.1fx" % (linear_runtime / parallel_runtime,))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,96 @@
+import time
+import numpy as np
+
+import synthesis.population.spatial.secondary.locations as locations
+from synthesis.population.spatial.secondary.components import CandidateIndex
+
+"""
+Benchmark for the secondary location assignment on synthetic persons. Every
+person performs a chain of one to three secondary activities between two fixed
+locations. The throughput in persons per second is reported for the Python and
+the numba engine (see 'secloc_engine') and for different batch sizes (see
+'secloc_batch_size').
+
+Run from the repository root:
+
+    python -m benchmarks.secondary
+"""
+
+PERSONS = 200
+FACILITIES = 100000
+EXTENT = 50000.0
+
+MODES = ["car", "car_passenger", "pt", "bike", "walk"]
+PURPOSES = ["shop", "leisure", "other"]
+
+def create_distributions(random):
+    distributions = {}
+
+    for mode in MODES:
+        values = np.sort(random.lognormal(mean = 7.5, sigma = 0.8, size = 1000))
+        cdf = np.cumsum(random.random_sample(size = len(values)))
+        cdf /= cdf[-1]
+
+        distributions[mode] = dict(bounds = np.array([np.inf]), distributions = [dict(cdf = cdf, values = values)])
+
+    return distributions
+
+def create_destinations(random, facilities):
+    identifiers = np.array(["loc_%d" % index for index in range(facilities)])
+    coordinates = random.random_sample(size = (facilities, 2)) * EXTENT
+
+    return {
+        purpose: dict(identifiers = identifiers, locations = coordinates)
+        for purpose in PURPOSES
+    }
+
+def create_problems(random, persons):
+    problems = []
+
+    for person_id in range(persons):
+        size = random.randint(1, 4)
+        origin = random.random_sample(size = (1, 2)) * EXTENT
+
+        problems.append(dict(
+            person_id = person_id, activity_index = 1, size = size,
+            purposes = list(random.choice(PURPOSES, size = size)),
+            modes = list(random.choice(MODES, size = size + 1)),
+            travel_times = list(random.randint(300, 3600, size = size + 1)),
+            origin = origin, destination = origin + random.normal(scale = 3000.0, size = (1, 2))
+        ))
+
+    return problems
+
+def measure(engine, batch_size, distance_draws, problems, distributions, candidate_index, random_seed):
+    solver = locations.create_assignment_solver(
+        np.random.RandomState(random_seed), distributions, candidate_index, np.inf, engine, distance_draws)
+
+    start = time.time()
+
+    for offset in range(0, len(problems), batch_size):
+        solver.solve_batch(problems[offset:offset + batch_size])
+
+    return len(problems) / (time.time() - start)
+
+def run(persons = PERSONS, facilities = FACILITIES, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+
+    distributions = create_distributions(random)
+    candidate_index = CandidateIndex(create_destinations(random, facilities))
+    problems = create_problems(random, persons)
+
+    # Warm-up for JIT compilation
+    measure("numba", 1, 1, problems[:10], distributions, candidate_index, random_seed)
+    measure("numba", 1, 16, problems[:10], distributions, candidate_index, random_seed)
+
+    print("Assigning secondary locations for %d persons" % persons)
+
+    for engine in ("python", "numba"):
+        for batch_size in (1, 100):
+            for distance_draws in (1, 16):
+                throughput = measure(engine, batch_size, distance_draws, problems, distributions, candidate_index, random_seed)
+                label = "%s (batch size %d, draws %d)" % (engine, batch_size, distance_draws)
+                print("%-40s %10.1f persons/s" % (label, throughput))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,114 @@
+import time
+import numpy as np
+import Levenshtein
+
+import data.addresses as addresses
+
+"""
+Benchmark for the fuzzy matching of street names within a commune, as used in
+data.sirene.localized. It compares the former exhaustive search, which computes
+the Levenshtein distance of every missing street to every candidate street of
+the commune, with the search in a BK-tree from data.addresses. Both are checked
+to find the same matches.
+
+Run from the repository root:
+
+    python -m benchmarks.streets
+"""
+
+COMMUNES = 200
+MISSING = 0.25
+THRESHOLD = 5
+
+TYPES = ["R", "AV", "BD", "PL", "CHE", "IMP", "ALL", "QU", "RTE"]
+WORDS = [
+    "DE LA", "DU", "DES", "SAINT", "GENERAL", "MARECHAL", "VICTOR", "HUGO", "JEAN", "JAURES",
+    "PASTEUR", "REPUBLIQUE", "GARE", "EGLISE", "MOULIN", "CHATEAU", "PARIS", "LILAS", "ROSES",
+    "FOCH", "GAULLE", "CHARLES", "LIBERATION", "ECOLES", "PONT", "FONTAINE", "BOIS", "CHAMPS"
+]
+
+def create_streets(random, count):
+    streets = set()
+
+    while len(streets) < count:
+        words = [WORDS[index] for index in random.randint(len(WORDS), size = 1 + random.randint(4))]
+        streets.add(" ".join([TYPES[random.randint(len(TYPES))]] + words))
+
+    return sorted(streets)
+
+def perturb(random, street):
+    characters = list(street)
+
+    for k in range(random.randint(1, 4)):
+        index = random.randint(len(characters))
+
+        if random.random_sample() < 0.5:
+            characters[index] = chr(ord("A") + random.randint(26))
+        else:
+            del characters[index]
+
+    return "".join(characters)
+
+def create_communes(random, communes):
+    result = []
+
+    for k in range(communes):
+        # Few large communes, many small ones
+        candidates = create_streets(random, int(min(5000, 10 + random.lognormal(mean = 5.0, sigma = 1.0))))
+        missing = sorted(set([perturb(random, street) for street in np.array(candidates)[
+            random.randint(len(candidates), size = max(1, int(MISSING * len(candidates))))
+        ]]))
+
+        result.append((candidates, missing))
+
+    return result
+
+def reference_match(candidates, missing):
+    matches = {}
+
+    for missing_street in missing:
+        distances = np.array([Levenshtein.distance(missing_street, c) for c in candidates])
+        index = np.argmin(distances)
+
+        if distances[index] <= THRESHOLD:
+            matches[missing_street] = candidates[index]
+
+    return matches
+
+def tree_match(candidates, missing):
+    tree = addresses.build_tree(candidates)
+    matches = {}
+
+    for missing_street in missing:
+        match = addresses.find_closest(tree, missing_street, THRESHOLD)
+
+        if not match is None:
+            matches[missing_street] = match
+
+    return matches
+
+def measure(label, function, communes):
+    start = time.time()
+    result = [function(candidates, missing) for candidates, missing in communes]
+    runtime = time.time() - start
+
+    print("%-30s %8.2fs" % (label, runtime))
+    return result, runtime
+
+def run(communes = COMMUNES, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+    data = create_communes(random, communes)
+
+    print("Matching %d missing streets against %d streets in %d communes" % (
+        sum([len(item[1]) for item in data]), sum([len(item[0]) for item in data]), communes
+    ))
+
+    reference, reference_runtime = measure("Exhaustive search", reference_match, data)
+    matched, tree_runtime = measure("BK-tree", tree_match, data)
+
+    assert reference == matched
+    print("Matched %d streets" % sum([len(item) for item in matched]))
+    print("Speed-up: %.1fx" % (reference_runtime / tree_runtime,))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,169 @@
+import time
+import numpy as np
+import pandas as pd
+
+import synthesis.population.spatial.home.zones as zones
+
+"""
+Benchmark for the repair of missing home zones on a synthetic national census
+in which a large share of the communes is not covered by IRIS. It compares the
+former implementation, which loops over departements and communes and draws
+one multinomial sample per zone, with the grouped sampling that is used in
+synthesis.population.spatial.home.zones. Both are checked to assign only valid
+candidates and to reproduce the expected share per zone.
+
+Run from the repository root:
+
+    python -m benchmarks.zones
+"""
+
+DEPARTEMENTS = 100
+COMMUNES = 35000
+HOUSEHOLDS = 500000
+
+def create_census(random, departements, communes, households):
+    # Communes, of which the larger ones are covered by IRIS
+    commune_ids = np.array(["%05d" % index for index in range(communes)])
+    departement_ids = np.array(["%02d" % index for index in random.randint(departements, size = communes)])
+
+    df_municipalities = pd.DataFrame(dict(
+        commune_id = commune_ids,
+        departement_id = pd.Categorical(departement_ids),
+        population = np.floor(random.lognormal(mean = 6.0, sigma = 1.5, size = communes))
+    )).set_index("commune_id")
+
+    df_municipalities["has_iris"] = df_municipalities["population"] > 5000
+
+    # IRIS of the covered communes, some of them with less than 200 inhabitants
+    df_covered = df_municipalities[df_municipalities["has_iris"]]
+    iris_counts = 1 + random.randint(8, size = len(df_covered))
+
+    df_iris = pd.DataFrame(dict(
+        commune_id = pd.Categorical(np.repeat(df_covered.index.values, iris_counts)),
+        population = np.floor(random.lognormal(mean = 6.0, sigma = 1.5, size = np.sum(iris_counts)))
+    ))
+
+    df_iris["iris_id"] = df_iris["commune_id"].astype(str) + pd.Series(np.hstack([
+        np.arange(count) for count in iris_counts
+    ])).map("{:04d}".format)
+    df_iris = df_iris.set_index("iris_id")
+
+    # Households, of which some only know their departement or commune
+    departements_without_iris = df_municipalities[~df_municipalities["has_iris"]]["departement_id"].astype(str).unique()
+    communes_with_small_iris = df_iris[df_iris["population"] <= 200]["commune_id"].astype(str).unique()
+
+    kind = random.randint(3, size = households)
+
+    household_departements = departement_ids[random.randint(communes, size = households)].astype(object)
+    household_departements[kind == 0] = departements_without_iris[random.randint(len(departements_without_iris), size = np.count_nonzero(kind == 0))]
+
+    household_communes = np.array(["known"] * households, dtype = object)
+    household_communes[kind == 0] = "undefined"
+    household_communes[kind == 1] = communes_with_small_iris[random.randint(len(communes_with_small_iris), size = np.count_nonzero(kind == 1))]
+    household_departements[kind == 1] = df_municipalities.loc[household_communes[kind == 1], "departement_id"].astype(str).values
+
+    household_iris = np.array(["known"] * households, dtype = object)
+    household_iris[kind != 2] = "undefined"
+
+    df_households = pd.DataFrame(dict(
+        household_id = np.arange(households),
+        departement_id = household_departements,
+        commune_id = pd.Categorical(household_communes, categories = np.hstack([["known", "undefined"], df_municipalities.index.values])),
+        iris_id = pd.Categorical(household_iris, categories = np.hstack([["known", "undefined"], df_iris.index.values]))
+    )).set_index("household_id")
+
+    return df_households, df_municipalities, df_iris
+
+def reference_fix(random, df_households, df_municipalities, df_iris, f_has_commune, f_has_iris):
+    f_has_commune = pd.Series(f_has_commune, index = df_households.index)
+    f_has_iris = pd.Series(f_has_iris, index = df_households.index)
+
+    for departement_id in df_households[~f_has_commune]["departement_id"].unique():
+        df_candidates = df_municipalities[
+            ~df_municipalities["has_iris"] &
+            (df_municipalities["departement_id"].astype(str) == departement_id)]
+
+        df_target = df_households[
+            ~f_has_commune &
+            (df_households["departement_id"] == departement_id)].copy()
+
+        weights = df_candidates["population"].values.astype(float)
+        weights /= np.sum(weights)
+
+        indices = np.repeat(np.arange(weights.shape[0]), random.multinomial(len(df_target), weights))
+        df_target["commune_id"] = df_candidates.reset_index()["commune_id"].iloc[indices].values
+
+        df_households.loc[df_target.index, "commune_id"] = df_target["commune_id"]
+
+    for commune_id in df_households[~f_has_iris & f_has_commune]["commune_id"].unique():
+        df_candidates = df_iris[
+            (df_iris["population"] <= 200) &
+            (df_iris["commune_id"].astype(str) == commune_id)]
+
+        df_target = df_households[
+            f_has_commune & ~f_has_iris &
+            (df_households["commune_id"] == commune_id)].copy()
+
+        weights = df_candidates["population"].values.astype(float)
+        if (weights == 0.0).all(): weights += 1.0
+        weights /= np.sum(weights)
+
+        indices = np.repeat(np.arange(weights.shape[0]), random.multinomial(len(df_target), weights))
+        df_target["iris_id"] = df_candidates.reset_index()["iris_id"].iloc[indices].values
+
+        df_households.loc[df_target.index, "iris_id"] = df_target["iris_id"]
+
+def grouped_fix(random, df_households, df_municipalities, df_iris, f_has_commune, f_has_iris):
+    zones.fix_missing_communes(random, df_households, df_municipalities, f_has_commune)
+    zones.fix_missing_iris(random, df_households, df_iris, f_has_commune, f_has_iris)
+
+def measure(label, function, random, df_households, df_municipalities, df_iris):
+    df_households = df_households.copy()
+
+    f_has_commune = (df_households["commune_id"] != "undefined").values
+    f_has_iris = (df_households["iris_id"] != "undefined").values
+
+    start = time.time()
+    function(random, df_households, df_municipalities, df_iris, f_has_commune, f_has_iris)
+    runtime = time.time() - start
+
+    print("%-30s %8.2fs" % (label, runtime))
+    return df_households, runtime
+
+def check(df_households, df_municipalities, df_iris):
+    df_communes = df_households[df_households["commune_id"] != "known"]
+    assert np.count_nonzero(df_communes["commune_id"] == "undefined") == 0
+    assert np.all(df_municipalities.loc[df_communes["commune_id"].astype(str), "departement_id"].astype(str).values == df_communes["departement_id"].values)
+
+    df_fixed = df_households[df_households["iris_id"] != "known"]
+    df_fixed = df_fixed[df_fixed["iris_id"] != "undefined"]
+    assert np.all(df_iris.loc[df_fixed["iris_id"].astype(str), "population"].values <= 200)
+    assert np.all(df_iris.loc[df_fixed["iris_id"].astype(str), "commune_id"].astype(str).values == df_fixed["commune_id"].astype(str).values)
+
+def shares(df_households, column):
+    counts = df_households[column].astype(str).value_counts()
+    return counts.drop(["known", "undefined"], errors = "ignore") / len(df_households)
+
+def run(departements = DEPARTEMENTS, communes = COMMUNES, households = HOUSEHOLDS, random_seed = 0):
+    random = np.random.RandomState(random_seed)
+    df_households, df_municipalities, df_iris = create_census(random, departements, communes, households)
+
+    print("Fixing zones of %d households in %d communes (%d without IRIS) and %d IRIS" % (
+        households, communes, np.count_nonzero(~df_municipalities["has_iris"]), len(df_iris)
+    ))
+
+    df_reference, reference_runtime = measure("Loop per zone", reference_fix, np.random.RandomState(random_seed), df_households, df_municipalities, df_iris)
+    df_grouped, grouped_runtime = measure("Grouped sampling", grouped_fix, np.random.RandomState(random_seed), df_households, df_municipalities, df_iris)
+
+    check(df_reference, df_municipalities, df_iris)
+    check(df_grouped, df_municipalities, df_iris)
+
+    for column in ("commune_id", "iris_id"):
+        reference_shares, grouped_shares = shares(df_reference, column), shares(df_grouped, column)
+        difference = np.max(np.abs(reference_shares.sub(grouped_shares, fill_value = 0.0)))
+        print("Maximum difference in share per %s: %.2e" % (column, difference))
+
+    print("Speed-up: %.1fx" % (reference_runtime / grouped_runtime,))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,145 @@
+import re
+import numpy as np
+import pandas as pd
+import Levenshtein
+
+"""
+Helpers to match street names between address data sets.
+
+Before matching, the street names of both data sets are normalized with the
+same rules: apostrophes and hyphens become spaces, some numbers are written out
+and common abbreviations are expanded (or contracted, for PLACE). All rules are
+applied in one pass by a combined regular expression, and only once per unique
+street name.
+
+Street names that cannot be matched exactly are matched to the closest street
+of the same commune by Levenshtein distance. To avoid computing the distance to
+every candidate street, the candidates are stored in a BK-tree: every node
+holds a street and its children are keyed by their distance to that street.
+Because the Levenshtein distance is a metric, a subtree with key k can only
+contain a street within distance r of the query if |d - k| <= r, where d is the
+distance of the query to the node. The search radius starts at the threshold
+and shrinks to the best distance found so far.
+"""
+
+CHARACTERS = str.maketrans("'-", "  ")
+
+REPLACEMENTS = {
+    "2": "DEUX", "3": "TROIS", "4": "QUATRE",
+    "ST": "SAINT", "STE": "SAINTE", "PTE": "PORTE",
+    "PLACE": "PL"
+}
+
+PATTERN = re.compile(r"[234](?= )|(?<![^ ])(?:STE|ST|PTE)(?= )|^PLACE(?= )")
+
+STREET_TYPES = { "RUE": "R", "QUAI": "QU", "PLACE": "PL" }
+
+def normalize_street(value):
+    return PATTERN.sub(lambda match: REPLACEMENTS[match.group(0)], value.translate(CHARACTERS))
+
+def _map_unique(values, function):
+    codes, uniques = pd.factorize(values)
+    mapped = np.array([function(value) for value in uniques] + [np.nan], dtype = object)
+
+    return pd.Series(mapped[codes], index = values.index)
+
+def normalize_streets(values):
+    """
+        Normalizes a series of street names. Missing values are kept.
+    """
+    return _map_unique(values, normalize_street)
+
+def normalize_street_types(values):
+    """
+        Abbreviates the street types of a series as in the street names.
+    """
+    return _map_unique(values, lambda value: STREET_TYPES.get(value, value))
+
+def build_tree(values):
+    """
+        Builds a BK-tree from a list of unique strings. A node is a tuple of the
+        string and a dictionary of children by distance.
+    """
+    tree = None
+
+    for value in values:
+        if tree is None:
+            tree = (value, {})
+            continue
+
+        node = tree
+
+        while True:
+            distance = Levenshtein.distance(value, node[0])
+
+            if distance == 0:
+                break
+
+            if distance in node[1]:
+                node = node[1][distance]
+            else:
+                node[1][distance] = (value, {})
+                break
+
+    return tree
+
+def find_closest(tree, value, threshold):
+    """
+        Finds the string in the tree with the smallest distance to value, as
+        long as it is not larger than threshold. Among strings with the same
+        distance, the smallest one is returned, such that the result is the
+        same as for an exhaustive search over the sorted strings. Returns None
+        if no string is close enough.
+    """
+    best_value, best_distance = None, threshold
+    pending = [] if tree is None else [(0, tree)]
+
+    while len(pending) > 0:
+        bound, (node_value, children) = pending.pop()
+
+        # The radius may have shrunk since the node has been added
+        if bound > best_distance:
+            continue
+
+        distance = Levenshtein.distance(value, node_value)
+
+        if distance < best_distance or (distance == best_distance and (best_value is None or node_value < best_value)):
+            best_value, best_distance = node_value, distance
+
+        # Children are visited closest first (last on the stack), which
+        # shrinks the search radius early
+        for child_distance in sorted(children, key = lambda k: -abs(k - distance)):
+            if abs(child_distance - distance) <= best_distance:
+                pending.append((abs(child_distance - distance), children[child_distance]))
+
+    return best_value
+
+def find_first(keys, candidate_keys):
+    """
+        Returns for every key the index of the first candidate with the same
+        key, or -1 if there is none.
+    """
+    unique_keys, first = np.unique(candidate_keys, return_index = True)
+
+    if len(unique_keys) == 0:
+        return np.full((len(keys),), -1, dtype = np.int64)
+
+    indices = np.minimum(np.searchsorted(unique_keys, keys), len(unique_keys) - 1)
+    return np.where(unique_keys[indices] == keys, first[indices], -1)
+
+def encode_addresses(df_left, df_right, columns):
+    """
+        Encodes the values of the given columns of both data frames as one
+        integer key per row, such that rows with the same values have the same
+        key.
+    """
+    keys = np.zeros((len(df_left) + len(df_right),), dtype = np.int64)
+
+    for column in columns:
+        codes, uniques = pd.factorize(np.concatenate([
+            np.asarray(df_left[column], dtype = object), np.asarray(df_right[column], dtype = object)
+        ]))
+
+        keys = keys * (len(uniques) + 1) + codes + 1
+
+    return keys[:len(df_left)], keys[len(df_left):]
@@ -1,5 +1,6 @@
 import fiona
 import pandas as pd
+import data.addresses as addresses
 
 """
 Clean up address data.
@@ -21,18 +22,8 @@ def execute(context):
     if len(excess_communes) > 0:
         raise RuntimeError("Excess municipalities in BDTOPO")
 
-    # Clean up street information
-    df_bdtopo["street"] = df_bdtopo["raw_street"]
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace("2 ", "DEUX ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace("4 ", "QUATRE ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace("3 ", "TROIS ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace("-", " ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace("'", " ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace(" ST ", " SAINT ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace(r"^ST ", "SAINT ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace(" STE ", " SAINTE ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace(r"^STE ", "SAINTE ")
-    df_bdtopo["street"] = df_bdtopo["street"].str.replace(r"^PLACE ", "PL ")
+    # Clean up street information (with the same rules as SIRENE, see data.addresses)
+    df_bdtopo["street"] = addresses.normalize_streets(df_bdtopo["raw_street"])
 
     df_bdtopo["number"] = pd.to_numeric(df_bdtopo["raw_number"], errors = "coerce")
     df_bdtopo = df_bdtopo[["commune_id", "street", "number", "geometry"]]
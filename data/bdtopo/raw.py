@@ -1,11 +1,14 @@
-import fiona
 import pandas as pd
 import os
-import shapely.geometry as geo
 import geopandas as gpd
+import data.dbf as dbf
+import data.shapefile as shapefile
 
 """
-This stage loads the raw data from the French address registry.
+This stage loads the raw data from the French address registry. Only the
+commune, number and street name are read from the attribute table, and only for
+the addresses with a commune in the requested departements (see data.dbf). The
+coordinates of these addresses are then read in bulk (see data.shapefile).
 """
 
 def configure(context):
@@ -18,25 +21,21 @@ def execute(context):
     df_codes = context.stage("data.spatial.codes")
     requested_departements = set(df_codes["departement_id"].unique())
 
-    df_bdtopo = []
+    path = "%s/%s" % (context.config("data_path"), context.config("bdtopo_path"))
 
-    with context.progress(total = 2135942, label = "Loading BD TOPO address registry ...") as progress:
-        with fiona.open("%s/%s" % (context.config("data_path"), context.config("bdtopo_path"))) as archive:
-            for item in archive:
-                code = item["properties"]["CODE_INSEE"]
+    df_bdtopo = dbf.read_dbf(
+        context, "%s.dbf" % os.path.splitext(path)[0], ["CODE_INSEE", "NUMERO", "NOM_1"],
+        prefixes = [(["CODE_INSEE"], requested_departements)],
+        codec = shapefile.read_codec(path), label = "Loading BD TOPO address registry ..."
+    )
 
-                if code[:2] in requested_departements or code[:3] in requested_departements:
-                    df_bdtopo.append(dict(
-                        geometry = geo.Point(*item["geometry"]["coordinates"]),
-                        commune_id = item["properties"]["CODE_INSEE"],
-                        raw_number = pd.to_numeric(item["properties"]["NUMERO"]),
-                        raw_street = item["properties"]["NOM_1"]
-                    ))
+    x, y = shapefile.read_points(path, df_bdtopo.index.values)
 
-                progress.update()
-
-    df_bdtopo = pd.DataFrame.from_records(df_bdtopo)
-    df_bdtopo = gpd.GeoDataFrame(df_bdtopo, crs = "EPSG:2154")
+    df_bdtopo = gpd.GeoDataFrame(dict(
+        commune_id = df_bdtopo["CODE_INSEE"].values,
+        raw_number = pd.to_numeric(df_bdtopo["NUMERO"], errors = "coerce").values,
+        raw_street = df_bdtopo["NOM_1"].values
+    ), geometry = gpd.points_from_xy(x, y), crs = "EPSG:2154")
 
     return df_bdtopo
 
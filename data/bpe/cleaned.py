@@ -3,6 +3,7 @@ import numpy as np
 
 import shapely.geometry as geo
 import data.spatial.utils as spatial_utils
+import data.shared as shared
 
 """
 This stage cleans the enterprise census:
@@ -34,11 +35,10 @@ def find_outside(context, commune_id):
     df_municipalities = context.data("df_municipalities")
     df = context.data("df")
 
-    df = df[df["commune_id"] == commune_id]
     zone = df_municipalities[df_municipalities["commune_id"] == commune_id]["geometry"].values[0]
 
     indices = [
-        index for index, x, y in df[["x", "y"]].itertuples()
+        index for index, x, y in zip(df.array("index", commune_id), df.array("x", commune_id), df.array("y", commune_id))
         if not zone.contains(geo.Point(x, y))
     ]
 
@@ -112,10 +112,14 @@ def execute(context):
     # the respective municipality. Find them and move them back in.
     outside_indices = []
 
+    df_coordinates = df[["commune_id", "x", "y"]].copy()
+    df_coordinates["index"] = df.index.values
+
     with context.progress(label = "Finding outside observations ...", total = len(df["commune_id"].unique())):
-        with context.parallel(dict(df = df, df_municipalities = df_municipalities)) as parallel:
-            for partial in parallel.imap(find_outside, df["commune_id"].unique()):
-                outside_indices += partial
+        with shared.SharedFrame(df_coordinates, ["index", "x", "y"], key = "commune_id", directory = context.path()) as df_shared:
+            with context.parallel(dict(df = df_shared, df_municipalities = df_municipalities)) as parallel:
+                for partial in parallel.imap(find_outside, df["commune_id"].unique()):
+                    outside_indices += partial
 
     if len(outside_indices) > 0:
         df.loc[outside_indices, "x"] = np.nan
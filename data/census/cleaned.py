@@ -2,111 +2,154 @@ from tqdm import tqdm
 import pandas as pd
 import numpy as np
 import data.hts.hts as hts
+import data.census.raw as raw
+import data.columnar as columnar
 
 """
 This stage cleans the French population census:
   - Assign new unique integer IDs to households and persons
   - Clean up spatial information and sociodemographic attributes
+
+The raw columns are read as categorical. Every attribute is decoded once per
+category into a code table, which is then indexed by the category codes of the
+rows, instead of processing the values of all rows one by one.
 """
 
 def configure(context):
     context.stage("data.census.raw")
     context.stage("data.spatial.codes")
 
-def execute(context):
-    df = pd.read_hdf("%s/census.hdf" % context.path("data.census.raw"))
+def _categorical(column):
+    values = column.values
 
-    # Construct household IDs for persons with NUMMI != Z
-    df_household_ids = df[["CANTVILLE", "NUMMI"]]
-    df_household_ids = df_household_ids[df_household_ids["NUMMI"] != "Z"]
-    df_household_ids["temporary"] = df_household_ids["CANTVILLE"] + df_household_ids["NUMMI"]
-    df_household_ids = df_household_ids.drop_duplicates("temporary")
-    df_household_ids["household_id"] = np.arange(len(df_household_ids))
-    df = pd.merge(df, df_household_ids, on = ["CANTVILLE", "NUMMI"], how = "left")
+    if not isinstance(values, pd.Categorical):
+        values = pd.Categorical(values)
 
-    # Fill up undefined household ids (those where NUMMI == Z)
-    f = np.isnan(df["household_id"])
-    df.loc[f, "household_id"] = np.arange(np.count_nonzero(f)) + df["household_id"].max()
-    df["household_id"] = df["household_id"].astype(np.int)
+    return values
 
-    # Put person IDs
-    df["person_id"] = np.arange(len(df))
+def decode(column, function, missing = None):
+    """
+        Applies function to every category of the column and returns the
+        results per row. Rows without value obtain missing.
+    """
+    values = _categorical(column)
+    table = [function(category) for category in values.categories]
 
-    # Sorting
-    df = df.sort_values(by = ["household_id", "person_id"])
+    if missing is None:
+        if np.any(values.codes < 0):
+            raise RuntimeError("Found missing values in column %s" % column.name)
 
-    # Spatial information
-    df["departement_id"] = df["DEPT"].astype("category")
+        return np.array(table)[values.codes]
 
-    df["commune_id"] = df["IRIS"].str[:5]
-    f_undefined = df["commune_id"].str.contains("Z")
-    df.loc[f_undefined, "commune_id"] = "undefined"
-    df["commune_id"] = df["commune_id"].astype("category")
+    # The code -1 of missing values selects the last entry
+    return np.array(table + [missing])[values.codes]
 
-    df["iris_id"] = df["IRIS"]
-    f_undefined = df["iris_id"].str.contains("Z") | df["iris_id"].str.contains("X")
-    df.loc[f_undefined, "iris_id"] = "undefined"
-    df["iris_id"] = df["iris_id"].astype("category")
+def decode_categorical(column, function):
+    """
+        Applies function to every category of the column and returns a
+        categorical of the results per row, with the observed results as
+        (sorted) categories. Results and rows without value are missing.
+    """
+    values = _categorical(column)
 
-    # Verify with requested codes
-    df_codes = context.stage("data.spatial.codes")
+    results = pd.Series([function(category) for category in values.categories] + [np.nan], dtype = object)
+    codes, categories = pd.factorize(results, sort = True)
 
-    excess_communes = set(df["commune_id"].unique()) - set(df_codes["commune_id"].unique())
-    if not excess_communes == {"undefined"}:
-        raise RuntimeError("Found additional communes: %s" % excess_communes)
+    return pd.Categorical.from_codes(codes[values.codes], categories).remove_unused_categories()
 
-    excess_iris = set(df["iris_id"].unique()) - set(df_codes["iris_id"].unique())
-    if not excess_iris == {"undefined"}:
-        raise RuntimeError("Found additional IRIS: %s" % excess_iris)
+COMMUTE_MODES = { "2": "walk", "3": "bike", "4": "car", "5": "pt" }
+SEXES = { "1": "male", "2": "female" }
+
+def clean_attributes(df):
+    """
+        Constructs household and person IDs and decodes the attributes of the
+        raw census.
+    """
+    df_cleaned = pd.DataFrame(index = pd.RangeIndex(len(df)))
+
+    # Construct household IDs for persons with NUMMI != Z, in order of appearance
+    cantville, nummi = _categorical(df["CANTVILLE"]), _categorical(df["NUMMI"])
+    keys = (cantville.codes.astype(np.int64) + 1) * (len(nummi.categories) + 1) + nummi.codes + 1
+
+    f_defined = ~decode(df["NUMMI"], lambda x: x == "Z", False)
+    household_ids = np.zeros((len(df),), dtype = np.int64)
+    household_ids[f_defined] = pd.factorize(keys[f_defined])[0]
+
+    # Fill up undefined household ids (those where NUMMI == Z) after the defined ones
+    household_ids[~f_defined] = np.arange(np.count_nonzero(~f_defined)) + np.max(household_ids[f_defined], initial = -1) + 1
+
+    df_cleaned["household_id"] = household_ids
+
+    # Put person IDs
+    df_cleaned["person_id"] = np.arange(len(df))
+
+    # Spatial information
+    df_cleaned["departement_id"] = _categorical(df["DEPT"]).remove_unused_categories()
+
+    df_cleaned["commune_id"] = decode_categorical(df["IRIS"],
+        lambda x: "undefined" if "Z" in x[:5] else x[:5])
+
+    df_cleaned["iris_id"] = decode_categorical(df["IRIS"],
+        lambda x: "undefined" if "Z" in x or "X" in x else x)
 
     # Age
-    df["age"] = df["AGED"].apply(lambda x: "0" if x == "000" else x.lstrip("0")).astype(np.int)
+    df_cleaned["age"] = decode(df["AGED"], int)
 
     # Clean COUPLE
-    df["couple"] = df["COUPLE"] == "1"
+    df_cleaned["couple"] = decode(df["COUPLE"], lambda x: x == "1", False)
 
     # Clean TRANS
-    df.loc[df["TRANS"] == "1", "commute_mode"] = np.nan
-    df.loc[df["TRANS"] == "2", "commute_mode"] = "walk"
-    df.loc[df["TRANS"] == "3", "commute_mode"] = "bike"
-    df.loc[df["TRANS"] == "4", "commute_mode"] = "car"
-    df.loc[df["TRANS"] == "5", "commute_mode"] = "pt"
-    df.loc[df["TRANS"] == "Z", "commute_mode"] = np.nan
-    df["commute_mode"] = df["commute_mode"].astype("category")
+    df_cleaned["commute_mode"] = decode_categorical(df["TRANS"], lambda x: COMMUTE_MODES.get(x, np.nan))
 
     # Weight
-    df["weight"] = df["IPONDI"].astype(np.float)
+    df_cleaned["weight"] = df["IPONDI"].values.astype(np.float)
 
     # Clean SEXE
-    df.loc[df["SEXE"] == "1", "sex"] = "male"
-    df.loc[df["SEXE"] == "2", "sex"] = "female"
-    df["sex"] = df["sex"].astype("category")
+    df_cleaned["sex"] = decode_categorical(df["SEXE"], lambda x: SEXES.get(x, np.nan))
 
     # Clean employment
-    df["employed"] = df["TACT"] == "11"
+    df_cleaned["employed"] = decode(df["TACT"], lambda x: x == "11", False)
 
     # Studies
-    df["studies"] = df["ETUD"] == "1"
+    df_cleaned["studies"] = decode(df["ETUD"], lambda x: x == "1", False)
 
     # Number of vehicles
-    df["number_of_vehicles"] = df["VOIT"].apply(
-        lambda x: str(x).replace("Z", "0").replace("X", "0")
-    ).astype(np.int)
+    df_cleaned["number_of_vehicles"] = decode(df["VOIT"],
+        lambda x: int(x.replace("Z", "0").replace("X", "0")))
 
-    df["number_of_vehicles"] += df["DEROU"].apply(
-        lambda x: str(x).replace("U", "0").replace("Z", "0").replace("X", "0")
-    ).astype(np.int)
+    df_cleaned["number_of_vehicles"] += decode(df["DEROU"],
+        lambda x: int(x.replace("U", "0").replace("Z", "0").replace("X", "0")))
 
     # Household size
-    df_size = df[["household_id"]].groupby("household_id").size().reset_index(name = "household_size")
-    df = pd.merge(df, df_size)
+    df_cleaned["household_size"] = np.bincount(household_ids)[household_ids]
 
     # Socioprofessional category
-    df["socioprofessional_class"] = df["CS1"].astype(np.int)
+    df_cleaned["socioprofessional_class"] = decode(df["CS1"], int)
 
     # Place of work or education
-    df["work_outside_region"] = df["ILT"].isin(("4", "5", "6"))
-    df["education_outside_region"] = df["ILETUD"].isin(("4", "5", "6"))
+    df_cleaned["work_outside_region"] = decode(df["ILT"], lambda x: x in ("4", "5", "6"), False)
+    df_cleaned["education_outside_region"] = decode(df["ILETUD"], lambda x: x in ("4", "5", "6"), False)
+
+    # Sorting
+    return df_cleaned.sort_values(by = ["household_id", "person_id"])
+
+def execute(context):
+    df_codes = context.stage("data.spatial.codes")
+    requested_departements = df_codes["departement_id"].unique()
+
+    df = columnar.read_table("%s/census.hdf" % context.path("data.census.raw"),
+        raw.COLUMNS, filters = [(["DEPT"], requested_departements)], categorical = True)
+
+    df = clean_attributes(df)
+
+    # Verify with requested codes
+    excess_communes = set(df["commune_id"].unique()) - set(df_codes["commune_id"].unique())
+    if not excess_communes == {"undefined"}:
+        raise RuntimeError("Found additional communes: %s" % excess_communes)
+
+    excess_iris = set(df["iris_id"].unique()) - set(df_codes["iris_id"].unique())
+    if not excess_iris == {"undefined"}:
+        raise RuntimeError("Found additional IRIS: %s" % excess_iris)
 
     # Consumption units
     df = pd.merge(df, hts.calculate_consumption_units(df), on = "household_id")
@@ -1,15 +1,15 @@
-import simpledbf
-from tqdm import tqdm
+import data.dbf as dbf
+import data.columnar as columnar
 import pandas as pd
 import os
 
 """
-This stage loads the raw data from the French population census.
+This stage loads the raw data from the French population census. The records
+of all departements are stored, such that the requested regions are only
+selected downstream (see data.columnar).
 """
 
 def configure(context):
-    context.stage("data.spatial.codes")
-
     context.config("data_path")
     context.config("census_path", "rp_2015/FD_INDCVIZA_2015.dbf")
 
@@ -24,23 +24,10 @@ COLUMNS = [
 ]
 
 def execute(context):
-    df_codes = context.stage("data.spatial.codes")
-    requested_departements = df_codes["departement_id"].unique()
-
-    table = simpledbf.Dbf5("%s/%s" % (context.config("data_path"), context.config("census_path")))
-    records = []
-
-    with context.progress(total = 4320619, label = "Reading census ...") as progress:
-        for df_chunk in table.to_dataframe(chunksize = 10240):
-            progress.update(len(df_chunk))
-
-            df_chunk = df_chunk[df_chunk["DEPT"].isin(requested_departements)]
-            df_chunk = df_chunk[COLUMNS]
-
-            if len(df_chunk) > 0:
-                records.append(df_chunk)
+    df_census = dbf.read_dbf(context, "%s/%s" % (context.config("data_path"), context.config("census_path")),
+        COLUMNS, label = "Reading census ...")
 
-    pd.concat(records).to_hdf("%s/census.hdf" % context.path(), "census")
+    columnar.write_table("%s/census.hdf" % context.path(), df_census, data_columns = ["DEPT"])
 
 def validate(context):
     if not os.path.exists("%s/%s" % (context.config("data_path"), context.config("census_path"))):
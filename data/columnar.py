@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+"""
+Storage of raw tables for the ingestion stages. The raw stages read their source
+for all of France, independently of the requested regions, and store it as a
+table with typed columns (strings become categorical). Downstream stages read
+only the columns they need and apply the spatial filter while reading, such
+that a change of the requested regions reuses the cached raw stages instead of
+reading the source again.
+
+The tables are written in the table format of HDF5 (PyTables), which allows to
+read a subset of the columns and of the rows. The columns that are used for
+filtering are written as data columns, which can be read on their own. They are
+read first to find the coordinates of the selected rows, and only these rows
+are read from the remaining columns. A where expression would not help here:
+pandas evaluates lists of more than a few values (such as the communes of a
+region) only after loading the whole table.
+"""
+
+KEY = "data"
+
+def write_table(path, df, data_columns = []):
+    """
+        Writes a raw table. String columns are stored as categorical. The
+        columns that are used in filters must be given as data columns.
+    """
+    df = df.copy()
+
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype("category")
+
+    df.to_hdf(path, KEY, mode = "w", format = "table", data_columns = data_columns)
+
+def read_table(path, columns = None, filters = [], categorical = False):
+    """
+        Reads the requested columns (or all) of a raw table. The filters are a
+        list of (columns, values), and a row is only kept if, for every filter,
+        one of the columns has one of the values (see data.dbf.read_records).
+        The filter columns must have been written as data columns.
+        Categorical columns are returned as plain values, because the raw
+        tables are mostly processed with string operations downstream, unless
+        categorical is set.
+    """
+    with pd.HDFStore(path, mode = "r") as store:
+        where = None
+
+        if len(filters) > 0:
+            selection = None
+
+            for filter_columns, values in filters:
+                matches = None
+
+                for column in filter_columns:
+                    column_matches = store.select_column(KEY, column).isin(values).values
+                    matches = column_matches if matches is None else matches | column_matches
+
+                selection = matches if selection is None else selection & matches
+
+            where = np.flatnonzero(selection)
+
+        if not where is None and len(where) == 0:
+            # An empty list of coordinates would select all rows
+            df = store.select(KEY, columns = columns, start = 0, stop = 0)
+        else:
+            df = store.select(KEY, where = where, columns = columns)
+
+    if categorical:
+        return df
+
+    return pd.DataFrame({
+        column: np.asarray(df[column]) if df[column].dtype.name == "category" else df[column].values
+        for column in df.columns
+    }, index = df.index, columns = df.columns)
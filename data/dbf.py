@@ -0,0 +1,188 @@
+import struct
+import numpy as np
+import pandas as pd
+
+"""
+Reader for tables in DBF (dBase) format, in which INSEE distributes the census
+and the commuting flows. All records have the same width, such that the file
+can be memory-mapped and every field can be sliced as a fixed-width byte matrix.
+Rows are selected by comparing the raw bytes (or their prefixes) of the filter
+fields, and only the selected rows of the requested columns are decoded. Ranges of records are read
+in parallel.
+
+Fields are decoded like simpledbf does: character fields are stripped and empty
+values become NaN, numeric fields become integers if none of the values has a
+decimal point and floats otherwise, and logical fields become booleans.
+"""
+
+SPACE = ord(" ")
+DECIMAL_POINT = ord(".")
+
+def read_header(path, codec = "utf-8"):
+    """
+        Reads the header of a DBF file. Returns the number of records, the
+        length of the header and of a record (in bytes) and the fields as a
+        dictionary of name -> (type, offset in the record, size).
+    """
+    with open(path, "rb") as f:
+        record_count, header_length, record_length = struct.unpack("<4xLHH20x", f.read(32))
+
+        fields = {}
+        offset = 1 # The first byte of each record is the deletion flag
+
+        while True:
+            descriptor = f.read(32)
+
+            if len(descriptor) < 32 or descriptor[:1] == b"\r":
+                break
+
+            name, type, size = struct.unpack("<11sc4xB15x", descriptor)
+            fields[name.strip(b"\x00").decode(codec)] = (type.decode(codec), offset, size)
+            offset += size
+
+    if offset != record_length:
+        raise RuntimeError("Invalid DBF header in %s" % path)
+
+    return record_count, header_length, record_length, fields
+
+def _strip(matrix):
+    """
+        Converts a fixed-width byte matrix into an array of bytes values without
+        surrounding spaces.
+    """
+    matrix = np.array(matrix, dtype = np.uint8)
+
+    # Trailing spaces become NUL bytes, which NumPy drops from bytes values
+    trailing = np.flip(np.cumprod(np.flip(matrix == SPACE, axis = 1), axis = 1), axis = 1) > 0
+    matrix[trailing] = 0
+
+    values = matrix.view("S%d" % matrix.shape[1]).ravel()
+
+    # Leading spaces (e.g. right-aligned numbers) are only removed where they exist
+    leading = matrix[:, 0] == SPACE
+
+    if np.any(leading):
+        values[leading] = np.char.lstrip(values[leading])
+
+    return values
+
+def _decode(matrix, type, codec):
+    values = _strip(matrix)
+    empty = values == b""
+
+    if type == "C":
+        decoded = np.char.decode(values, codec).astype(object)
+        decoded[empty] = np.nan
+        return decoded
+
+    if type in ("N", "F"):
+        try:
+            numbers = values.astype(np.float64)
+        except ValueError: # Empty or invalid values
+            numbers = pd.to_numeric(np.char.decode(values, "ascii"), errors = "coerce").astype(np.float64)
+
+        if type == "N" and not np.any(matrix == DECIMAL_POINT) and not np.any(np.isnan(numbers)):
+            return numbers.astype(np.int64)
+
+        return numbers
+
+    if type == "L":
+        decoded = np.full((len(values),), np.nan, dtype = object)
+        decoded[np.isin(values, [b"T", b"t", b"Y", b"y"])] = True
+        decoded[np.isin(values, [b"N", b"n", b"F", b"f"])] = False
+        return decoded
+
+    raise RuntimeError("DBF field type '%s' is not supported" % type)
+
+def read_records(path, header, start, end, columns, filters = [], codec = "utf-8", prefixes = []):
+    """
+        Reads the records from start to end (exclusive) of a DBF file with the
+        given header (see read_header). Deleted records are skipped. The
+        filters are a list of (columns, values), and a record is only kept if,
+        for every filter, one of the columns has one of the values. Likewise,
+        prefixes is a list of (columns, prefixes), and a record is only kept if,
+        for every entry, one of the columns starts with one of the prefixes.
+        Returns a data frame of the requested columns, indexed by record number.
+    """
+    record_count, header_length, record_length, fields = header
+
+    for column in set(columns) | set(sum([list(filter_columns) for filter_columns, values in filters + prefixes], [])):
+        if not column in fields:
+            raise RuntimeError("Column %s is not available in %s" % (column, path))
+
+    if end <= start:
+        records = np.zeros((0, record_length), dtype = np.uint8)
+    else:
+        records = np.memmap(path, dtype = np.uint8, mode = "r",
+            offset = header_length + start * record_length, shape = (end - start, record_length))
+
+    def field(name):
+        type, offset, size = fields[name]
+        return records[:, offset:offset + size]
+
+    # Select rows by comparing raw bytes
+    selection = records[:, 0] == SPACE
+
+    for filter_columns, values in filters:
+        values = np.array([str(value).encode(codec) for value in values], dtype = np.bytes_)
+        matches = np.zeros((len(records),), dtype = bool)
+
+        for name in filter_columns:
+            matches |= np.isin(_strip(field(name)), values)
+
+        selection &= matches
+
+    for filter_columns, values in prefixes:
+        values = [str(value).encode(codec) for value in values]
+        matches = np.zeros((len(records),), dtype = bool)
+
+        for name in filter_columns:
+            matrix = field(name)
+
+            for length in set([len(value) for value in values]):
+                if length <= matrix.shape[1]:
+                    prefix = np.ascontiguousarray(matrix[:, :length]).view("S%d" % length).ravel()
+                    matches |= np.isin(prefix, [value for value in values if len(value) == length])
+
+        selection &= matches
+
+    # Decode the requested columns of the selected rows
+    data = {}
+
+    for name in columns:
+        data[name] = _decode(field(name)[selection], fields[name][0], codec)
+
+    return pd.DataFrame(data, columns = columns, index = start + np.flatnonzero(selection))
+
+def _read_range(context, bounds):
+    start, end = bounds
+
+    return read_records(
+        context.data("path"), context.data("header"), start, end,
+        context.data("columns"), context.data("filters"), context.data("codec"), context.data("prefixes")
+    ), end - start
+
+def read_dbf(context, path, columns, filters = [], codec = "utf-8", chunk_size = 100000, label = None, prefixes = []):
+    """
+        Reads the requested columns of the records of a DBF file that pass the
+        filters and prefixes (see read_records). The file is split into ranges of chunk_size
+        records, which are read in parallel.
+    """
+    header = read_header(path, codec)
+    record_count = header[0]
+
+    ranges = [
+        (start, min(start + chunk_size, record_count))
+        for start in range(0, max(record_count, 1), chunk_size)
+    ]
+
+    data = dict(path = path, header = header, columns = columns, filters = filters, codec = codec, prefixes = prefixes)
+    df_ranges = []
+
+    with context.progress(label = label, total = record_count) as progress:
+        with context.parallel(data) as parallel:
+            for df_range, count in parallel.imap(_read_range, ranges):
+                df_ranges.append(df_range)
+                progress.update(count)
+
+    return pd.concat(df_ranges)
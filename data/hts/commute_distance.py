@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+import data.sampling as sampling
+
 def configure(context):
     context.config("random_seed")
     context.stage("data.hts.selected")
@@ -37,10 +39,7 @@ def get_commuting_distance(df_persons, df_trips, activity_type, random):
     cdf = np.cumsum(weights)
     cdf /= cdf[-1]
 
-    indices = [
-        np.searchsorted(cdf, r)
-        for r in random.random_sample(size = np.count_nonzero(f_missing))
-    ]
+    indices = sampling.sample_indices(random.random_sample(size = np.count_nonzero(f_missing)), cdf)
 
     df_persons.loc[f_missing, "commute_distance"] = values[indices]
 
@@ -2,7 +2,7 @@ import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from sklearn.neighbors import KDTree
-import os
+import data.columnar as columnar
 
 """
 Loads and prepares income distributions by municipality:
@@ -12,22 +12,17 @@ Loads and prepares income distributions by municipality:
 """
 
 def configure(context):
-    context.config("data_path")
+    context.stage("data.income.raw")
     context.stage("data.spatial.municipalities")
 
 def execute(context):
     # Load income distribution
-    df = pd.read_excel(
-        "%s/filosofi_2015/FILO_DISP_COM.xls" % context.config("data_path"),
-        sheet_name = "ENSEMBLE", skiprows = 5
-    )[["CODGEO"] + ["D%d15" % q if q != 5 else "Q215" for q in range(1, 10)]]
-    df.columns = ["commune_id", "q1", "q2", "q3", "q4", "q5", "q6", "q7", "q8", "q9"]
-    df["reference_median"] = df["q5"].values
-
-    # Verify spatial data for education
     df_municipalities = context.stage("data.spatial.municipalities")
     requested_communes = set(df_municipalities["commune_id"].unique())
-    df = df[df["commune_id"].isin(requested_communes)]
+
+    df = columnar.read_table("%s/municipality.hdf" % context.path("data.income.raw"),
+        filters = [(["commune_id"], requested_communes)])
+    df["reference_median"] = df["q5"].values
 
     # Find communes without data
     df["commune_id"] = df["commune_id"].astype("category")
@@ -76,9 +71,3 @@ def execute(context):
     assert len(requested_communes - set(df["commune_id"].unique())) == 0
 
     return df[["commune_id", "q1", "q2", "q3", "q4", "q5", "q6", "q7", "q8", "q9", "is_imputed", "is_missing", "reference_median"]]
-
-def validate(context):
-    if not os.path.exists("%s/filosofi_2015/FILO_DISP_COM.xls" % context.config("data_path")):
-        raise RuntimeError("Filosofi data is not available")
-
-    return os.path.getsize("%s/filosofi_2015/FILO_DISP_COM.xls" % context.config("data_path"))
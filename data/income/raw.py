@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import data.columnar as columnar
+import os
+
+"""
+This stage loads the income distributions (deciles) of all municipalities in
+France. They are stored for all of France, such that the requested regions are
+only selected downstream (see data.columnar).
+"""
+
+def configure(context):
+    context.config("data_path")
+
+def execute(context):
+    df = pd.read_excel(
+        "%s/filosofi_2015/FILO_DISP_COM.xls" % context.config("data_path"),
+        sheet_name = "ENSEMBLE", skiprows = 5
+    )[["CODGEO"] + ["D%d15" % q if q != 5 else "Q215" for q in range(1, 10)]]
+    df.columns = ["commune_id", "q1", "q2", "q3", "q4", "q5", "q6", "q7", "q8", "q9"]
+
+    columnar.write_table("%s/municipality.hdf" % context.path(), df, data_columns = ["commune_id"])
+
+def validate(context):
+    if not os.path.exists("%s/filosofi_2015/FILO_DISP_COM.xls" % context.config("data_path")):
+        raise RuntimeError("Filosofi data is not available")
+
+    return os.path.getsize("%s/filosofi_2015/FILO_DISP_COM.xls" % context.config("data_path"))
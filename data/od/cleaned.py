@@ -2,6 +2,7 @@ from tqdm import tqdm
 import pandas as pd
 import numpy as np
 import simpledbf
+import data.columnar as columnar
 
 """
 Cleans OD data to arrive at OD flows between municipalities for work
@@ -16,8 +17,16 @@ RENAME = { "COMMUNE" : "origin_id", "DCLT" : "destination_id", "IPONDI" : "weigh
 
 def execute(context):
     # Load data
-    df_work = pd.read_hdf("%s/work.hdf" % context.path("data.od.raw"))
-    df_education = pd.read_hdf("%s/education.hdf" % context.path("data.od.raw"))
+    df_codes = context.stage("data.spatial.codes")
+    requested_communes = df_codes["commune_id"].unique()
+
+    df_work = columnar.read_table("%s/work.hdf" % context.path("data.od.raw"),
+        ["COMMUNE", "ARM", "TRANS", "IPONDI", "DCLT"],
+        filters = [(["COMMUNE", "ARM"], requested_communes), (["DCLT"], requested_communes)])
+
+    df_education = columnar.read_table("%s/education.hdf" % context.path("data.od.raw"),
+        ["COMMUNE", "ARM", "IPONDI", "DCETUF"],
+        filters = [(["COMMUNE", "ARM"], requested_communes), (["DCETUF"], requested_communes)])
 
     # Renaming
     df_work = df_work.rename(RENAME, axis = 1)
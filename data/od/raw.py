@@ -1,62 +1,30 @@
-from tqdm import tqdm
+import data.dbf as dbf
+import data.columnar as columnar
 import pandas as pd
 import numpy as np
-import simpledbf
 import os
 
 """
-Loads raw OD data from French census data.
+Loads raw OD data from French census data. The flows of all communes are
+stored, such that the requested regions are only selected downstream (see
+data.columnar).
 """
 
 def configure(context):
-    context.stage("data.spatial.codes")
     context.config("data_path")
 
 def execute(context):
-    df_codes = context.stage("data.spatial.codes")
-    requested_communes = df_codes["commune_id"].unique()
-
     # First, load work
+    df_work = dbf.read_dbf(context, "%s/rp_2015/FD_MOBPRO_2015.dbf" % context.config("data_path"),
+        ["COMMUNE", "ARM", "TRANS", "IPONDI", "DCLT"], label = "Reading work flows ...")
 
-    table = simpledbf.Dbf5("%s/rp_2015/FD_MOBPRO_2015.dbf" % context.config("data_path"))
-    records = []
-
-    with context.progress(label = "Reading work flows ...", total = 7943392) as progress:
-        for df_chunk in table.to_dataframe(chunksize = 10240):
-            progress.update(len(df_chunk))
-
-            f = df_chunk["COMMUNE"].isin(requested_communes)
-            f |= df_chunk["ARM"].isin(requested_communes)
-            f &= df_chunk["DCLT"].isin(requested_communes)
-
-            df_chunk = df_chunk[f]
-            df_chunk = df_chunk[["COMMUNE", "ARM", "TRANS", "IPONDI", "DCLT"]]
-
-            if len(df_chunk) > 0:
-                records.append(df_chunk)
-
-    pd.concat(records).to_hdf("%s/work.hdf" % context.cache_path, "movements")
+    columnar.write_table("%s/work.hdf" % context.path(), df_work, data_columns = ["COMMUNE", "ARM", "DCLT"])
 
     # Second, load education
+    df_education = dbf.read_dbf(context, "%s/rp_2015/FD_MOBSCO_2015.dbf" % context.config("data_path"),
+        ["COMMUNE", "ARM", "IPONDI", "DCETUF"], label = "Reading education flows ...")
 
-    table = simpledbf.Dbf5("%s/rp_2015/FD_MOBSCO_2015.dbf" % context.config("data_path"))
-    records = []
-
-    with context.progress(label = "Reading education flows ...", total = 4782736) as progress:
-        for df_chunk in table.to_dataframe(chunksize = 10240):
-            progress.update(len(df_chunk))
-
-            f = df_chunk["COMMUNE"].isin(requested_communes)
-            f |= df_chunk["ARM"].isin(requested_communes)
-            f &= df_chunk["DCETUF"].isin(requested_communes)
-
-            df_chunk = df_chunk[f]
-            df_chunk = df_chunk[["COMMUNE", "ARM", "IPONDI", "DCETUF"]]
-
-            if len(df_chunk) > 0:
-                records.append(df_chunk)
-
-    pd.concat(records).to_hdf("%s/education.hdf" % context.cache_path, "movements")
+    columnar.write_table("%s/education.hdf" % context.path(), df_education, data_columns = ["COMMUNE", "ARM", "DCETUF"])
 
 def validate(context):
     if not os.path.exists("%s/rp_2015/FD_MOBPRO_2015.dbf" % context.config("data_path")):
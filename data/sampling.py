@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import numba
+
+"""
+Sampling kernels that are shared between stages. The distributions are given
+as a non-decreasing cumulative distribution function (cdf), normalized such
+that the last entry is 1.0. For a uniform value u, the sampled index is the
+number of cdf entries that are strictly smaller than u, which is exactly what
+a left-sided binary search returns.
+"""
+
+@numba.jit(nopython = True, parallel = True)
+def _parallel_sample_indices(uniform, cdf):
+    indices = np.empty((len(uniform),), dtype = np.int64)
+
+    for i in numba.prange(len(uniform)):
+        indices[i] = np.searchsorted(cdf, uniform[i])
+
+    return indices
+
+def sample_indices(uniform, cdf, parallel = False):
+    """
+        Samples one index per uniform value from the distribution given by cdf.
+        The result is identical to np.count_nonzero(cdf < u) for each u, but
+        takes O(log n) instead of O(n) per draw. If parallel is set, the draws
+        are distributed over threads, which only makes sense outside of
+        context.parallel, where all cores are already busy.
+    """
+    uniform = np.asarray(uniform, dtype = np.float64)
+    cdf = np.asarray(cdf, dtype = np.float64)
+
+    if parallel:
+        return _parallel_sample_indices(uniform, cdf)
+
+    return np.searchsorted(cdf, uniform)
+
+def group_rows(keys):
+    """
+        Groups the rows of a table by key (CSR-style). Returns the sorted keys,
+        the row order (stable within every group) and the offsets of the groups
+        in that order.
+    """
+    codes, values = pd.factorize(np.asarray(keys), sort = True)
+
+    # Sorting by (code, position) is stable, but much faster than a mergesort
+    order = np.argsort(codes.astype(np.int64) * len(codes) + np.arange(len(codes)))
+    offsets = np.hstack([[0], np.cumsum(np.bincount(codes, minlength = len(values)))])
+
+    return pd.Index(values), order, offsets
+
+def sample_grouped_multinomial(random, counts, weights, offsets):
+    """
+        Draws one multinomial sample for every group of rows (as given by the
+        offsets), with counts[k] trials for group k and the weights of its rows.
+        All groups are sampled at once by drawing a row for every trial and
+        counting the draws per row. Returns the number of draws per row.
+    """
+    sizes = np.diff(offsets)
+
+    if np.any((counts > 0) & (sizes == 0)):
+        raise RuntimeError("Cannot sample from a group without rows")
+
+    # Build one cdf for all groups, in which group k covers [k, k + 1]
+    groups = np.repeat(np.arange(len(sizes)), sizes)
+    cumulative = np.cumsum(weights)
+    base = np.hstack([[0.0], cumulative])[offsets[:-1]]
+    totals = np.bincount(groups, weights = weights, minlength = len(sizes))
+
+    cdf = groups + np.minimum((cumulative - base[groups]) / totals[groups], 1.0)
+    cdf[offsets[1:][sizes > 0] - 1] = np.arange(len(sizes))[sizes > 0] + 1.0
+
+    # Draw one row per trial, staying within the group
+    trial_groups = np.repeat(np.arange(len(sizes)), counts)
+    indices = sample_indices(trial_groups + random.random_sample(size = len(trial_groups)), cdf)
+    indices = np.minimum(np.maximum(indices, offsets[trial_groups]), offsets[trial_groups + 1] - 1)
+
+    return np.bincount(indices, minlength = len(weights))
@@ -0,0 +1,36 @@
+import numpy as np
+
+"""
+Helpers to derive independent random streams from the global random seed.
+
+Stages that process data in chunks should not draw one seed per chunk from a
+shared generator, because the chunks (and therefore the output) would then
+depend on the number of processes. Instead, the seed of a chunk (or of a zone,
+household, ...) is derived from the global seed and a key that identifies the
+chunk, using NumPy's SeedSequence. The resulting streams are statistically
+independent and only depend on the keys.
+
+Keys may be non-negative integers or strings, such that zone identifiers like
+commune or IRIS codes can be used directly. By convention, the first key is the
+name of the stage (e.g. "income"), so that different stages which process the
+same zones do not obtain the same streams.
+"""
+
+def _encode_key(key):
+    if isinstance(key, str):
+        # Append the length, such that "1" and "1\0" are different keys
+        return int.from_bytes(key.encode("utf-8"), "little") * 256 + min(len(key), 255)
+
+    return int(key)
+
+def derive_seed(random_seed, *keys):
+    """
+        Returns a seed for np.random.RandomState that is derived from the
+        global random seed and the given keys (non-negative integers or strings).
+    """
+    entropy = [int(random_seed)] + [_encode_key(key) for key in keys]
+    return np.random.SeedSequence(entropy).generate_state(4)
+
+def derive_random(random_seed, *keys):
+    """ Returns a RandomState that is seeded with derive_seed. """
+    return np.random.RandomState(derive_seed(random_seed, *keys))
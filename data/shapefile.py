@@ -0,0 +1,54 @@
+import os
+import numpy as np
+
+"""
+Reader for the coordinates of point shapefiles, such as the address registry of
+BD TOPO. The index file (.shx) contains the position of every record in the
+shape file (.shp), such that the coordinates of the requested records can be
+gathered from the memory-mapped file at once, instead of constructing a feature
+per record. The attributes are read separately from the DBF file (see
+data.dbf), in which the records have the same order.
+"""
+
+HEADER_LENGTH = 100
+POINT_TYPES = (1, 11, 21) # Point, PointZ and PointM start with x and y
+
+POINT = np.dtype([("type", "<i4"), ("x", "<f8"), ("y", "<f8")])
+
+def read_codec(path, default = "latin-1"):
+    """
+        Returns the encoding of the attributes of a shapefile as given by its
+        .cpg file, or the default otherwise.
+    """
+    path = "%s.cpg" % os.path.splitext(path)[0]
+
+    if not os.path.exists(path):
+        return default
+
+    with open(path) as f:
+        codec = f.read().strip()
+
+    if codec.isdigit(): # Code pages, e.g. 1252
+        codec = "cp%s" % codec
+
+    return codec
+
+def read_points(path, records):
+    """
+        Reads the x and y coordinates of the given records (by record number)
+        of a point shapefile.
+    """
+    records = np.asarray(records, dtype = np.int64)
+    base = os.path.splitext(path)[0]
+
+    # Offsets are given in 16-bit words, and every record starts with a header of 8 bytes
+    index = np.memmap("%s.shx" % base, dtype = ">i4", mode = "r", offset = HEADER_LENGTH).reshape(-1, 2)
+    offsets = index[records, 0].astype(np.int64) * 2 + 8
+
+    shapes = np.memmap("%s.shp" % base, dtype = np.uint8, mode = "r")
+    points = shapes[offsets[:, np.newaxis] + np.arange(POINT.itemsize)].view(POINT).ravel()
+
+    if not np.all(np.isin(points["type"], POINT_TYPES)):
+        raise RuntimeError("Only point geometries are supported in %s" % path)
+
+    return points["x"].copy(), points["y"].copy()
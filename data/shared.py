@@ -0,0 +1,185 @@
+import os, shutil, tempfile
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely.geometry as geo
+
+"""
+Helpers to pass large tables to the workers of context.parallel without
+pickling them and without scanning the whole table in every task.
+
+A SharedFrame stores the requested columns of a data frame as read-only
+memory-mapped NumPy arrays. Pickling a SharedFrame only transfers the file
+locations and some meta data, and all workers share the same pages of memory.
+Numeric and boolean columns are stored as they are, categorical and object
+columns as integer codes plus their categories, and point geometries as their
+x and y coordinates.
+
+Optionally, the rows are grouped by a key column. The rows of every key are
+then stored contiguously (in their original order) together with a CSR-style
+offset index, such that a worker can obtain its partition in O(1).
+"""
+
+def _is_point_column(values):
+    if values.dtype.name == "geometry":
+        return True
+
+    return values.dtype == object and len(values) > 0 and isinstance(values.iloc[0], geo.Point)
+
+class SharedFrame:
+    def __init__(self, df, columns, key = None, directory = None):
+        self.columns = list(columns)
+        self.path = tempfile.mkdtemp(prefix = "shared_frame_", dir = directory)
+
+        self.kinds = {}
+        self.categories = {}
+        self.crs = {}
+
+        self.index = None
+        self.offsets = None
+
+        order = None
+
+        if not key is None:
+            codes, values = pd.factorize(df[key].values, sort = True)
+
+            order = np.nonzero(codes >= 0)[0]
+            order = order[np.argsort(codes[order], kind = "mergesort")]
+
+            counts = np.bincount(codes[order], minlength = len(values))
+
+            self.index = { value: position for position, value in enumerate(values) }
+            self.offsets = np.hstack([[0], np.cumsum(counts)]).astype(np.int64)
+
+        for position, column in enumerate(self.columns):
+            values = df[column]
+
+            if _is_point_column(values):
+                self.kinds[column] = "geometry"
+                self.crs[column] = getattr(values, "crs", None)
+                arrays = [
+                    np.array([point.x for point in values], dtype = np.float64),
+                    np.array([point.y for point in values], dtype = np.float64)
+                ]
+
+            elif pd.api.types.is_categorical_dtype(values):
+                self.kinds[column] = "categorical"
+                self.categories[column] = values.cat.categories
+                arrays = [values.cat.codes.values]
+
+            elif values.dtype == object:
+                self.kinds[column] = "object"
+                codes, self.categories[column] = pd.factorize(values.values)
+                arrays = [codes]
+
+            else:
+                self.kinds[column] = "numeric"
+                arrays = [values.values]
+
+            for component, array in enumerate(arrays):
+                if not order is None: array = array[order]
+                np.save(self._file(position, component), np.ascontiguousarray(array))
+
+        self.size = len(df) if order is None else len(order)
+        self._arrays = {}
+
+    def _file(self, position, component):
+        return "%s/%d_%d.npy" % (self.path, position, component)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arrays"] = {}
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self._arrays = {}
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+    def keys(self):
+        """ Returns the available key values. """
+        return list(self.index.keys())
+
+    def range(self, key):
+        """ Returns the first and the last row (exclusive) of a key. """
+        position = self.index.get(key)
+
+        if position is None:
+            return 0, 0
+
+        return self.offsets[position], self.offsets[position + 1]
+
+    def _components(self, column):
+        if not column in self._arrays:
+            position = self.columns.index(column)
+            components = 2 if self.kinds[column] == "geometry" else 1
+
+            self._arrays[column] = [
+                np.load(self._file(position, component), mmap_mode = "r")
+                for component in range(components)
+            ]
+
+        return self._arrays[column]
+
+    def array(self, column, key = None, start = 0, end = None):
+        """
+            Returns a read-only view on the raw values of a column (the codes for
+            categorical and object columns, an (N, 2) coordinate array for
+            geometries).
+        """
+        if not key is None:
+            start, end = self.range(key)
+
+        components = [array[start:end] for array in self._components(column)]
+
+        if len(components) == 2:
+            return np.vstack(components).T
+
+        return components[0]
+
+    def series(self, column, key = None, start = 0, end = None):
+        """ Returns a decoded column as it was in the original data frame. """
+        if not key is None:
+            start, end = self.range(key)
+
+        kind = self.kinds[column]
+        components = [np.array(array[start:end]) for array in self._components(column)]
+
+        if kind == "geometry":
+            return gpd.GeoSeries(gpd.points_from_xy(*components), crs = self.crs[column], name = column)
+
+        elif kind == "categorical":
+            return pd.Series(pd.Categorical.from_codes(components[0], self.categories[column]), name = column)
+
+        elif kind == "object":
+            return pd.Series(np.asarray(pd.Categorical.from_codes(components[0], self.categories[column]), dtype = object), name = column)
+
+        return pd.Series(components[0], name = column)
+
+    def frame(self, key = None, columns = None, start = 0, end = None):
+        """
+            Returns a data frame with the requested columns, either for all rows,
+            the rows of one key, or a range of rows.
+        """
+        if not key is None:
+            start, end = self.range(key)
+
+        if columns is None:
+            columns = self.columns
+
+        series = [self.series(column, start = start, end = end) for column in columns]
+        df = pd.concat(series, axis = 1) if len(series) > 0 else pd.DataFrame()
+
+        geometry_columns = [column for column in columns if self.kinds[column] == "geometry"]
+
+        if len(geometry_columns) > 0:
+            df = gpd.GeoDataFrame(df, geometry = geometry_columns[0], crs = self.crs[geometry_columns[0]])
+
+        return df
@@ -1,5 +1,6 @@
 import pandas as pd
 import data.spatial.code_changes as cc
+import data.addresses as addresses
 
 """
 Clean the SIRENE enterprise census.
@@ -52,24 +53,9 @@ def execute(context):
         print(excess_communes)
         raise RuntimeError("Found excess municipalities in SIRENE data")
 
-    # Clean up street information
-    df_sirene["street_type"] = df_sirene["typeVoieEtablissement"]
-    df_sirene["street_type"] = df_sirene["street_type"].str.replace("RUE", "R")
-    df_sirene["street_type"] = df_sirene["street_type"].str.replace("QUAI", "QU")
-    df_sirene["street_type"] = df_sirene["street_type"].str.replace("PLACE", "PL")
-
-    df_sirene["street"] = df_sirene["libelleVoieEtablissement"]
-    df_sirene["street"] = df_sirene["street"].str.replace("'", " ")
-    df_sirene["street"] = df_sirene["street"].str.replace("-", " ")
-    df_sirene["street"] = df_sirene["street"].str.replace("2 ", "DEUX ")
-    df_sirene["street"] = df_sirene["street"].str.replace("4 ", "QUATRE ")
-    df_sirene["street"] = df_sirene["street"].str.replace("3 ", "TROIS ")
-    df_sirene["street"] = df_sirene["street"].str.replace(" ST ", " SAINT ")
-    df_sirene["street"] = df_sirene["street"].str.replace(r"^ST ", "SAINT ")
-    df_sirene["street"] = df_sirene["street"].str.replace(" STE ", " SAINTE ")
-    df_sirene["street"] = df_sirene["street"].str.replace(r"^STE ", "SAINTE ")
-    df_sirene["street"] = df_sirene["street"].str.replace(" PTE ", " PORTE ")
-    df_sirene["street"] = df_sirene["street"].str.replace(r"^PLACE ", "PL ")
+    # Clean up street information (with the same rules as BD TOPO, see data.addresses)
+    df_sirene["street_type"] = addresses.normalize_street_types(df_sirene["typeVoieEtablissement"])
+    df_sirene["street"] = addresses.normalize_streets(df_sirene["libelleVoieEtablissement"])
 
     df_sirene["street"] = df_sirene["street_type"] + " " + df_sirene["street"]
 
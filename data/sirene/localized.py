@@ -1,8 +1,7 @@
 import pandas as pd
-import Levenshtein
-import tqdm
 import numpy as np
 import geopandas as gpd
+import data.addresses as addresses
 
 """
 This stage matches the SIRENE enterprise database with address data. While
@@ -15,7 +14,9 @@ After applying some systematic transformations on the street names of both
 data sets, matching is possible exactly for most addresses. However, some
 vary slightly so we try to match them to the available street names in their
 respective commune by minimizing the Levenshtein distance between the street
-name in question and the available ones.
+name in question and the available ones. The candidate streets of every commune
+are indexed in a BK-tree (see data.addresses), and the communes are processed in
+parallel.
 
 Finally, some SIRENE observations must be filtered out, because they cannot be
 matched to a coordinate.
@@ -33,28 +34,59 @@ line with our IRIS system. We could also limit the time of the SIRET observation
 with their last update to one that fits with our IRIS system.
 """
 
+LEVENSHTEIN_THRESHOLD = 5
+COLUMNS = ["street", "number", "commune_id", "employees", "ape", "siret"]
+
 def configure(context):
     context.stage("data.sirene.cleaned")
     context.stage("data.bdtopo.cleaned")
     context.stage("data.spatial.municipalities")
 
+def _match_streets(context, arguments):
+    commune_id, candidate_streets, missing_streets = arguments
+    tree = addresses.build_tree(candidate_streets)
+
+    matches = []
+
+    for missing_street in missing_streets:
+        match = addresses.find_closest(tree, missing_street, LEVENSHTEIN_THRESHOLD)
+
+        if not match is None:
+            matches.append((commune_id, missing_street, match))
+
+    return matches
+
+def _locate(df_sirene, df_bdtopo, indices, status):
+    df_located = df_sirene[COLUMNS].iloc[indices >= 0].reset_index(drop = True)
+    df_located["geometry"] = df_bdtopo["geometry"].iloc[indices[indices >= 0]].values
+    df_located["status"] = status
+    return df_located
+
 def execute(context):
     df_sirene = context.stage("data.sirene.cleaned")
     df_bdtopo = context.stage("data.bdtopo.cleaned")
     context.set_info("initial_count", len(df_sirene))
 
+    df_sirene = df_sirene.drop_duplicates("siret")
+
+    # First, perform the exact matching. Second, try name matching (without
+    # commune) for the ones that could not be matched. This can happen if
+    # communes have merged or separated. We need to find the correct commune
+    # for them afterwards. Both use the same encoding of the addresses.
     print("Finding addresses by exact match with street, number and commune ...")
 
-    # First, perform the exact matching
-    df_matched = pd.merge(
-        df_sirene[["street", "number", "commune_id", "employees", "ape", "siret"]],
-        df_bdtopo[["street", "number", "commune_id", "geometry"]],
-        how = "left", on = ["street", "number", "commune_id"]
-    ).drop_duplicates("siret")
+    sirene_keys, bdtopo_keys = addresses.encode_addresses(df_sirene, df_bdtopo, ["street", "number"])
+    sirene_commune_keys, bdtopo_commune_keys = addresses.encode_addresses(df_sirene, df_bdtopo, ["commune_id"])
 
-    f_missing = df_matched["geometry"].isna()
-    df_valid = df_matched[~f_missing].copy()
-    df_valid["status"] = 0
+    commune_count = max(np.max(sirene_commune_keys, initial = 0), np.max(bdtopo_commune_keys, initial = 0)) + 1
+
+    exact_indices = addresses.find_first(
+        sirene_keys * commune_count + sirene_commune_keys,
+        bdtopo_keys * commune_count + bdtopo_commune_keys
+    )
+
+    f_missing = exact_indices < 0
+    df_valid = _locate(df_sirene, df_bdtopo, exact_indices, 0)
 
     matched_count = np.count_nonzero(~f_missing)
     print("   ... matched %d/%d (%.2f%%)." % (
@@ -62,24 +94,14 @@ def execute(context):
     ))
     context.set_info("exact_count", matched_count)
 
-    # Second, try name matching (without commune) for the ones that could not
-    # be matched. This can happen if communes have merged or separated. We
-    # need to find the correct commune for them afterwards.
-
     print("Finding addresses by exact match with street, number without commune ...")
 
-    df_missing = df_matched[f_missing].copy()
-
-    df_matched = pd.merge(
-        df_missing[["street", "number", "commune_id", "employees", "ape", "siret"]],
-        df_bdtopo[["street", "number", "geometry"]],
-        how = "left", on = ["street", "number"]
-    ).drop_duplicates("siret")
+    df_missing = df_sirene[f_missing]
+    partial_indices = addresses.find_first(sirene_keys[f_missing], bdtopo_keys)
 
-    f_missing = df_matched["geometry"].isna()
+    f_missing = partial_indices < 0
 
-    df_partial = df_matched[~f_missing].copy()
-    df_partial["status"] = 1
+    df_partial = _locate(df_missing, df_bdtopo, partial_indices, 1)
     df_partial["commune"] = "undefined"
     df_partial["commune"] = df_partial["commune"].astype("category")
 
@@ -96,57 +118,55 @@ def execute(context):
     # Third, perform matching by Levenshtein distance
     print("Finding addresses by commune and Levenshtein distance ...")
 
-    df_missing = df_matched[f_missing].copy()
-    del df_matched
+    df_missing = df_missing[f_missing][COLUMNS].copy()
+    df_missing["commune_id"] = df_missing["commune_id"].astype(str)
 
-    commune_ids = set(df_missing["commune_id"].unique())
-    LEVENSHTEIN_THRESHOLD = 5
+    df_candidates = df_bdtopo[["commune_id", "street"]].copy()
+    df_candidates["commune_id"] = df_candidates["commune_id"].astype(str)
+    df_candidates = df_candidates[df_candidates["commune_id"].isin(df_missing["commune_id"].unique())]
 
-    missing_count = 0
-    fixed_count = 0
+    candidate_streets = {
+        commune_id: sorted(df_commune["street"].unique())
+        for commune_id, df_commune in df_candidates.groupby("commune_id")
+    }
 
-    for commune_id in context.progress(commune_ids, total = len(commune_ids), label = "Fixing missing addresses by Levenshtein distance ..."):
-        df_local_bdtopo = df_bdtopo[df_bdtopo["commune_id"] == commune_id]
+    arguments = [
+        (commune_id, candidate_streets[commune_id], list(df_commune["street"].unique()))
+        for commune_id, df_commune in df_missing.groupby("commune_id")
+        if commune_id in candidate_streets
+    ]
 
-        if len(df_local_bdtopo) > 0:
-            f_commune = df_missing["commune_id"] == commune_id
-            df_local_sirene = df_missing[f_commune]
+    missing_count = sum([len(item[2]) for item in arguments])
+    matches = []
 
-            candidate_streets = set(df_local_bdtopo["street"].unique())
-            missing_streets = set(df_local_sirene["street"].unique())
-            candidate_streets = list(candidate_streets)
+    with context.parallel() as parallel:
+        for partial in context.progress(parallel.imap(_match_streets, arguments), total = len(arguments), label = "Fixing missing addresses by Levenshtein distance ..."):
+            matches += partial
 
-            missing_count += len(missing_streets)
-
-            for missing_street in missing_streets:
-                distances = np.array([Levenshtein.distance(missing_street, c) for c in candidate_streets])
-                index = np.argmin(distances)
-
-                if distances[index] <= LEVENSHTEIN_THRESHOLD:
-                    f = f_commune & (df_missing["street"] == missing_street)
-                    df_missing.loc[f, "street"] = candidate_streets[index]
-                    fixed_count += 1
+    fixed_count = len(matches)
 
     print("Fixed %d/%d (%.2f%%) missing streets by Levenshtein distance" % (
         fixed_count, missing_count, 100 * fixed_count / missing_count
     ))
     context.set_info("levenshtein_count", fixed_count)
 
-    df_fixed = pd.merge(
-        df_missing[["street", "number", "commune_id", "employees", "ape", "siret"]],
-        df_bdtopo[["street", "number", "commune_id", "geometry"]],
-        how = "left", on = ["street", "number", "commune_id"]
-    ).drop_duplicates("siret")
+    # Apply all corrections at once
+    df_matches = pd.DataFrame.from_records(matches, columns = ["commune_id", "street", "fixed_street"])
+    df_missing = pd.merge(df_missing, df_matches, on = ["commune_id", "street"], how = "left")
+    df_missing["street"] = df_missing["fixed_street"].fillna(df_missing["street"])
+    del df_missing["fixed_street"]
 
-    f_missing = df_fixed["geometry"].isna()
+    sirene_keys, bdtopo_keys = addresses.encode_addresses(df_missing, df_bdtopo, ["street", "number", "commune_id"])
+    fixed_indices = addresses.find_first(sirene_keys, bdtopo_keys)
+
+    f_missing = fixed_indices < 0
 
     matched_count = np.count_nonzero(~f_missing)
     print("... matched %d/%d (%.2f%%) among previously missing ones" % (
-        matched_count, len(df_fixed), 100 * matched_count / len(df_fixed)
+        matched_count, len(df_missing), 100 * matched_count / len(df_missing)
     ))
 
-    df_fixed = df_fixed[~f_missing].copy()
-    df_fixed["status"] = 2
+    df_fixed = _locate(df_missing, df_bdtopo, fixed_indices, 2)
 
     # Merge data sets
     df_valid = pd.concat([df_valid, df_fixed])
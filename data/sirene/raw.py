@@ -1,40 +1,163 @@
 import pandas as pd
 import os
+import io
+import zipfile
+import collections
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 """
-This stage loads the raw data from the French enterprise registry.
+This stage loads the raw data from the French enterprise registry. The national
+file is streamed in blocks of complete records, which are parsed in a thread pool
+and filtered (active enterprises in the requested departements) before they are
+accumulated, such that only the selected enterprises are kept in memory.
+
+Blocks are split at line breaks outside of quoted fields (some address fields
+contain line breaks), which are found by the parity of the quotes before them.
+All columns have a fixed type, such that the blocks are consistent.
 """
 
+COLUMNS = [
+    "siret", "codeCommuneEtablissement", "activitePrincipaleEtablissement",
+    "trancheEffectifsEtablissement", "libelleVoieEtablissement", "numeroVoieEtablissement",
+    "typeVoieEtablissement", "etatAdministratifEtablissement"
+]
+
+DTYPES = { column: str for column in COLUMNS }
+DTYPES["siret"] = int
+
+BLOCK_SIZE = 32 * 1024**2
+
 def configure(context):
     context.config("data_path")
     context.config("sirene_path", "sirene/StockEtablissement_utf8.zip")
+    context.config("sirene_threads", 4)
 
     context.stage("data.spatial.codes")
 
+def read_blocks(path, block_size = BLOCK_SIZE):
+    """
+        Decompresses the file (if it is zipped) and yields its header and then
+        blocks of complete records.
+    """
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            with archive.open(archive.namelist()[0]) as f:
+                yield from _split_blocks(f, block_size)
+    else:
+        with open(path, "rb") as f:
+            yield from _split_blocks(f, block_size)
+
+def find_end(data):
+    """
+        Returns the end of the last complete record in data, i.e. the position
+        after the last line break that is not within a quoted field, or zero.
+        As escaped quotes are doubled, a line break is outside of quoted fields
+        if the number of quotes before it is even.
+    """
+    quotes = data.count(b'"')
+    end = len(data)
+
+    while True:
+        position = data.rfind(b"\n", 0, end)
+
+        if position < 0:
+            return 0
+
+        quotes -= data.count(b'"', position, end)
+
+        if quotes % 2 == 0:
+            return position + 1
+
+        end = position
+
+def _split_blocks(f, block_size):
+    yield f.readline()
+
+    remainder = b""
+
+    while True:
+        data = f.read(block_size)
+
+        if len(data) == 0:
+            break
+
+        data = remainder + data
+        end = find_end(data)
+
+        if end > 0:
+            remainder = data[end:]
+            yield data[:end]
+        else:
+            remainder = data
+
+    if len(remainder) > 0:
+        yield remainder
+
+def filter_block(df, departements):
+    """
+        Selects the active enterprises of which the commune code starts with one
+        of the departements. The prefixes are looked up per length.
+    """
+    prefixes = collections.defaultdict(set)
+
+    for departement in departements:
+        prefixes[len(departement)].add(departement)
+
+    codes = df["codeCommuneEtablissement"]
+    f = np.zeros((len(df),), dtype = bool)
+
+    for length, values in prefixes.items():
+        f |= codes.str[:length].isin(values).values
+
+    f &= (df["etatAdministratifEtablissement"] == "A").values
+    return df[f]
+
+def _read_block(names, departements, block):
+    df = pd.read_csv(io.BytesIO(block), header = None, names = names, usecols = COLUMNS, dtype = DTYPES)
+    return filter_block(df, departements), len(df)
+
 def execute(context):
-    df_sirene = pd.read_csv("%s/%s" % (context.config("data_path"), context.config("sirene_path")), usecols = [
-            "siret", "codeCommuneEtablissement", "activitePrincipaleEtablissement",
-            "trancheEffectifsEtablissement", "libelleVoieEtablissement", "numeroVoieEtablissement",
-            "typeVoieEtablissement", "etatAdministratifEtablissement"
-        ],
-        dtype = dict(siret = int, codeCommuneEtablissement = str, trancheEffectifsEtablissement = str, typeVoieEtablissement = str)
-    )
-
-    # Filter by departement
     df_codes = context.stage("data.spatial.codes")
     requested_departements = set(df_codes["departement_id"].unique())
 
-    f = df_sirene["codeCommuneEtablissement"].isna() # Just to get a mask
+    threads = context.config("sirene_threads")
+    blocks = read_blocks("%s/%s" % (context.config("data_path"), context.config("sirene_path")))
+
+    header = next(blocks)
+    names = list(pd.read_csv(io.BytesIO(header), encoding = "utf-8-sig").columns)
+
+    # Parse blocks in parallel, but keep only a few of them in memory. The
+    # rows are numbered as they are collected (in order).
+    df_blocks = []
+    pending = collections.deque()
+    row_count = 0
+
+    def collect(future):
+        nonlocal row_count
+
+        df_block, rows = future.result()
+        df_block.index += row_count
+        df_blocks.append(df_block)
+
+        row_count += rows
+        progress.update(rows)
+
+    with context.progress(label = "Reading SIRENE ...") as progress:
+        with ThreadPoolExecutor(threads) as executor:
+            for block in blocks:
+                pending.append(executor.submit(_read_block, names, requested_departements, block))
+
+                if len(pending) >= 2 * threads:
+                    collect(pending.popleft())
 
-    for departement in requested_departements:
-        print("Finding municipalities for departement %s" % departement)
-        f |= df_sirene["codeCommuneEtablissement"].str.startswith(departement)
+            while len(pending) > 0:
+                collect(pending.popleft())
 
-    f &= ~df_sirene["codeCommuneEtablissement"].isna()
-    df_sirene = df_sirene[f]
+    if len(df_blocks) == 0:
+        return pd.DataFrame({ column: [] for column in COLUMNS })
 
-    return df_sirene
+    return pd.concat(df_blocks)
 
 def validate(context):
     if not os.path.exists("%s/%s" % (context.config("data_path"), context.config("sirene_path"))):
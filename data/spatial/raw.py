@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import data.columnar as columnar
+import os
+
+"""
+This stage loads the national tables of spatial codes (IRIS, commune,
+departement and région) and of the population per IRIS. They are stored for
+all of France, such that the requested regions are only selected downstream
+(see data.columnar).
+"""
+
+CODES_SOURCE = "codes_2017/reference_IRIS_geo2017.xls"
+POPULATION_SOURCE = "rp_2015/base-ic-evol-struct-pop-2015.xls"
+
+def configure(context):
+    context.config("data_path")
+
+def execute(context):
+    # Load IRIS registry
+    df_codes = pd.read_excel(
+        "%s/%s" % (context.config("data_path"), CODES_SOURCE),
+        skiprows = 5, sheet_name = "Emboitements_IRIS"
+    )[["CODE_IRIS", "DEPCOM", "DEP", "REG"]].rename(columns = {
+        "CODE_IRIS": "iris_id",
+        "DEPCOM": "commune_id",
+        "DEP": "departement_id",
+        "REG": "region_id"
+    })
+
+    columnar.write_table("%s/codes.hdf" % context.path(), df_codes, data_columns = ["departement_id", "region_id"])
+
+    # Load population per IRIS
+    df_population = pd.read_excel(
+        "%s/%s" % (context.config("data_path"), POPULATION_SOURCE),
+        skiprows = 5, sheet_name = "IRIS", usecols = ["IRIS", "COM", "DEP", "REG", "P15_POP"]
+    ).rename(columns = {
+        "IRIS": "iris_id", "COM": "commune_id", "DEP": "departement_id", "REG": "region_id",
+        "P15_POP": "population"
+    })
+
+    columnar.write_table("%s/population.hdf" % context.path(), df_population)
+
+def validate(context):
+    if not os.path.exists("%s/%s" % (context.config("data_path"), CODES_SOURCE)):
+        raise RuntimeError("Spatial reference codes are not available")
+
+    if not os.path.exists("%s/%s" % (context.config("data_path"), POPULATION_SOURCE)):
+        raise RuntimeError("Aggregated census data is not available")
+
+    return [
+        os.path.getsize("%s/%s" % (context.config("data_path"), CODES_SOURCE)),
+        os.path.getsize("%s/%s" % (context.config("data_path"), POPULATION_SOURCE))
+    ]
@@ -9,6 +9,7 @@ def configure(context):
     context.stage("synthesis.locations.secondary")
     context.stage("synthesis.population.spatial.home.locations")
     context.stage("synthesis.population.spatial.primary.locations")
+    context.stage("synthesis.population.sampled")
 
 HOME_FIELDS = [
     "household_id", "geometry"
@@ -35,6 +36,10 @@ def execute(context):
             df_homes = context.stage("synthesis.population.spatial.home.locations")
             df_homes = df_homes[HOME_FIELDS]
 
+            # Only keep households of the current sample (homes may cover a larger nested sample)
+            df_households = context.stage("synthesis.population.sampled")[["household_id"]]
+            df_homes = df_homes[df_homes["household_id"].isin(df_households["household_id"])]
+
             with context.progress(total = len(df_homes), label = "Writing home facilities ...") as progress:
                 for item in df_homes.itertuples(index = False):
                     geometry = item[HOME_FIELDS.index("geometry")]
@@ -1,7 +1,9 @@
 import numpy as np
 import pandas as pd
-import multiprocessing as mp
-from tqdm import tqdm
+
+import synthesis.population.sampled as sampled
+import data.seeding as seeding
+import data.sampling as sampling
 
 """
 This stage assigns a household income to each household of the synthesized
@@ -13,38 +15,59 @@ income distribution and a random income within the selected stratum is chosen.
 
 def configure(context):
     context.stage("data.income.municipality")
-    context.stage("synthesis.population.sampled")
+    context.config("sampling_method", "full")
+    context.config("nested_sampling_rate", None)
+    context.stage("synthesis.population.sampled", sampled.get_sample_config(context))
     context.stage("synthesis.population.spatial.home.zones")
 
     context.config("random_seed")
 
 MAXIMUM_INCOME_FACTOR = 1.2
+CENTILE_COLUMNS = ["q%d" % k for k in range(1, 10)]
+
+def build_centile_table(df_income):
+    """
+        Builds a (communes x 11) table of monthly income bounds per commune,
+        which delimit the ten deciles of the income distribution.
+    """
+    centiles = df_income[CENTILE_COLUMNS].values / 12
+
+    return np.hstack([
+        np.zeros((len(centiles), 1)), centiles,
+        np.max(centiles, axis = 1)[:, np.newaxis] * MAXIMUM_INCOME_FACTOR
+    ])
 
-def _sample_income(context, args):
-    commune_id, random_seed = args
-    df_households, df_income = context.data("households"), context.data("income")
+def sample_deciles(random_seed, commune_ids, codes):
+    """
+        Draws a decile and a uniform value for every household. The
+        households are grouped by commune code and every commune obtains its
+        own random stream, so that the draws of a commune do not depend on the
+        other communes in the population.
+    """
+    keys, order, offsets = sampling.group_rows(codes)
 
-    random = np.random.RandomState(random_seed)
+    indices = np.empty((len(codes),), dtype = np.int64)
+    uniform = np.empty((len(codes),))
 
-    f = df_households["commune_id"] == commune_id
-    df_selected = df_households[f]
+    # Reseeding is much cheaper than creating a new generator per commune
+    random = np.random.RandomState()
 
-    centiles = list(df_income[df_income["commune_id"] == commune_id][["q1", "q2", "q3", "q4", "q5", "q6", "q7", "q8", "q9"]].iloc[0].values / 12)
-    centiles = np.array([0] + centiles + [np.max(centiles) * MAXIMUM_INCOME_FACTOR])
+    for k, code in enumerate(keys):
+        random.seed(seeding.derive_seed(random_seed, "income", str(commune_ids[code])))
+        rows = order[offsets[k]:offsets[k + 1]]
 
-    indices = random.randint(10, size = len(df_selected))
-    lower_bounds, upper_bounds = centiles[indices], centiles[indices + 1]
+        indices[rows] = random.randint(10, size = len(rows))
+        uniform[rows] = random.random_sample(size = len(rows))
 
-    incomes = lower_bounds + random.random_sample(size = len(df_selected)) * (upper_bounds - lower_bounds)
-    return f, incomes
+    return indices, uniform
 
 def execute(context):
-    random = np.random.RandomState(context.config("random_seed"))
+    random_seed = context.config("random_seed")
 
     # Load data
     df_income = context.stage("data.income.municipality")
 
-    df_households = context.stage("synthesis.population.sampled")[[
+    df_households = context.stage("synthesis.population.sampled", sampled.get_sample_config(context))[[
         "household_id", "consumption_units"
     ]].drop_duplicates("household_id")
 
@@ -54,13 +77,21 @@ def execute(context):
 
     df_households = pd.merge(df_households, df_homes)
 
-    # Perform sampling per commune
-    with context.parallel(dict(households = df_households, income = df_income)) as parallel:
-        commune_ids = df_households["commune_id"].unique()
-        random_seeds = random.randint(10000, size = len(commune_ids))
+    # Look up the income distribution of every household
+    commune_ids = df_income["commune_id"].astype(str).values
+    codes = pd.Index(commune_ids).get_indexer(df_households["commune_id"].astype(str).values)
+
+    if np.any(codes < 0):
+        raise RuntimeError("Found households in communes without income distribution")
+
+    centiles = build_centile_table(df_income)
+
+    # Sample a decile and an income within the decile
+    indices, uniform = sample_deciles(random_seed, commune_ids, codes)
+    lower_bounds, upper_bounds = centiles[codes, indices], centiles[codes, indices + 1]
 
-        for f, incomes in context.progress(parallel.imap(_sample_income, zip(commune_ids, random_seeds)), label = "Imputing income ...", total = len(commune_ids)):
-            df_households.loc[f, "household_income"] = incomes * df_households.loc[f, "consumption_units"]
+    incomes = lower_bounds + uniform * (upper_bounds - lower_bounds)
+    df_households["household_income"] = incomes * df_households["consumption_units"].values
 
     # Cleanup
     df_households = df_households[["household_id", "household_income", "consumption_units"]]
@@ -1,11 +1,13 @@
 from tqdm import tqdm
-import itertools
 import numpy as np
 import pandas as pd
-import numba
 
+import data.sampling as sampling
+import data.shared as shared
+import data.seeding as seeding
 import data.hts.egt.cleaned
 import data.hts.entd.cleaned
+import synthesis.population.sampled as sampled
 
 import multiprocessing as mp
 
@@ -24,90 +26,125 @@ def configure(context):
     context.config("random_seed")
     context.config("matching_minimum_observations", 20)
 
-    context.stage("synthesis.population.sampled")
+    context.config("sampling_method", "full")
+    context.config("nested_sampling_rate", None)
+    context.stage("synthesis.population.sampled", sampled.get_sample_config(context))
     context.stage("synthesis.population.income")
 
     hts = context.config("hts")
     context.stage("data.hts.selected", alias = "hts")
 
-@numba.jit(nopython = True, parallel = True)
-def sample_indices(uniform, cdf, selected_indices):
-    indices = np.arange(len(uniform))
+def encode_cells(df_source, df_target, columns):
+    """
+        Encodes the matching columns into integer cell keys for every relaxation
+        level. The key at level k identifies the combination of values of the
+        first k columns. Keys are dense and follow the lexicographic order of
+        the (sorted) column values. Observations with a value that cannot be
+        encoded obtain the key -1 and never match.
+    """
+    source_keys = np.zeros((len(df_source),), dtype = np.int64)
+    target_keys = np.zeros((len(df_target),), dtype = np.int64)
 
-    for i, u in enumerate(uniform):
-        indices[i] = np.count_nonzero(cdf < u)
+    level_keys = []
 
-    return selected_indices[indices]
+    for column in columns:
+        unique_values = list(sorted(set(df_source[column].unique()) | set(df_target[column].unique())))
+
+        source_codes = pd.Categorical(df_source[column].values, categories = unique_values).codes.astype(np.int64)
+        target_codes = pd.Categorical(df_target[column].values, categories = unique_values).codes.astype(np.int64)
+
+        keys = np.hstack([
+            source_keys * len(unique_values) + source_codes,
+            target_keys * len(unique_values) + target_codes
+        ])
+
+        f_invalid = np.hstack([
+            (source_keys < 0) | (source_codes < 0),
+            (target_keys < 0) | (target_codes < 0)
+        ])
+
+        # Densify keys, so they do not grow with the product of cardinalities
+        keys[~f_invalid] = np.unique(keys[~f_invalid], return_inverse = True)[1]
+        keys[f_invalid] = -1
 
-def statistical_matching(progress, df_source, source_identifier, weight, df_target, target_identifier, columns, random_seed = 0, minimum_observations = 0):
+        source_keys, target_keys = keys[:len(df_source)], keys[len(df_source):]
+        level_keys.append((source_keys, target_keys))
+
+    return level_keys
+
+def statistical_matching(progress, df_source, source_identifier, weight, df_target, target_identifier, columns, random_seed = 0, minimum_observations = 0, uniform = None):
+    # If given, uniform contains one random value per target row (in the order
+    # of df_target), otherwise the values are drawn from random_seed
     random = np.random.RandomState(random_seed)
 
     # Reduce data frames
     df_source = df_source[[source_identifier, weight] + columns].copy()
     df_target = df_target[[target_identifier] + columns].copy()
 
+    if not uniform is None:
+        df_target["uniform"] = uniform
+
     # Sort data frames
     df_source = df_source.sort_values(by = columns)
     df_target = df_target.sort_values(by = columns)
 
-    # Find unique values for all columns
-    unique_values = {}
-
-    for column in columns:
-        unique_values[column] = list(sorted(set(df_source[column].unique()) | set(df_target[column].unique())))
+    # Encode cells for all relaxation levels
+    level_keys = encode_cells(df_source, df_target, columns)
 
-    # Generate filters for all columns and values
-    source_filters, target_filters = {}, {}
+    # Perform matching
+    weights = df_source[weight].values
+    assigned_indices = np.ones((len(df_target),), dtype = np.int64) * -1
+    unassigned_mask = np.ones((len(df_target),), dtype = bool)
+    assigned_levels = np.ones((len(df_target),), dtype = np.int64) * -1
 
-    for column, column_unique_values in unique_values.items():
-        source_filters[column] = [df_source[column].values == value for value in column_unique_values]
-        target_filters[column] = [df_target[column].values == value for value in column_unique_values]
+    if uniform is None:
+        uniform = random.random_sample(size = (len(df_target),))
+    else:
+        uniform = df_target["uniform"].values
 
-    # Define search order
-    source_filters = [source_filters[column] for column in columns]
-    target_filters = [target_filters[column] for column in columns]
+    for level in range(1, len(columns) + 1)[::-1]:
+        source_keys, target_keys = level_keys[level - 1]
+        number_of_keys = max(np.max(source_keys, initial = -1), np.max(target_keys, initial = -1)) + 1
 
-    # Perform matching
-    weights = df_source[weight].values
-    assigned_indices = np.ones((len(df_target),), dtype = np.int) * -1
-    unassigned_mask = np.ones((len(df_target),), dtype = np.bool)
-    assigned_levels = np.ones((len(df_target),), dtype = np.int) * -1
-    uniform = random.random_sample(size = (len(df_target),))
+        # Group the source by cell (stable, so the order within each cell is kept)
+        f_source = source_keys >= 0
+        source_order = np.nonzero(f_source)[0]
+        source_order = source_order[np.argsort(source_keys[f_source], kind = "mergesort")]
 
-    column_indices = [np.arange(len(unique_values[column])) for column in columns]
+        source_counts = np.bincount(source_keys[f_source], minlength = number_of_keys)
+        source_offsets = np.hstack([[0], np.cumsum(source_counts)])
 
-    for level in range(1, len(column_indices) + 1)[::-1]:
-        level_column_indices = column_indices[:level]
+        # Only consider unassigned targets in cells with sufficient observations
+        eligible_keys = source_counts >= max(minimum_observations, 1)
 
-        if np.count_nonzero(unassigned_mask) > 0:
-            for column_index in itertools.product(*level_column_indices):
-                f_source = np.logical_and.reduce([source_filters[i][k] for i, k in enumerate(column_index)])
-                f_target = np.logical_and.reduce([target_filters[i][k] for i, k in enumerate(column_index)] + [unassigned_mask])
+        target_indices = np.nonzero(unassigned_mask & (target_keys >= 0))[0]
+        target_indices = target_indices[eligible_keys[target_keys[target_indices]]]
 
-                selected_indices = np.nonzero(f_source)[0]
-                requested_samples = np.count_nonzero(f_target)
+        if len(target_indices) == 0:
+            continue
 
-                if requested_samples == 0:
-                    continue
+        target_indices = target_indices[np.argsort(target_keys[target_indices], kind = "mergesort")]
+        cell_keys, cell_starts, cell_counts = np.unique(target_keys[target_indices], return_index = True, return_counts = True)
 
-                if len(selected_indices) < minimum_observations:
-                    continue
+        # Only visit the cells which actually exist in the target
+        for key, start, count in zip(cell_keys, cell_starts, cell_counts):
+            selected_indices = source_order[source_offsets[key]:source_offsets[key + 1]]
+            cell_indices = target_indices[start:start + count]
 
-                selected_weights = weights[f_source]
-                cdf = np.cumsum(selected_weights)
-                cdf /= cdf[-1]
+            cdf = np.cumsum(weights[selected_indices])
+            cdf /= cdf[-1]
 
-                assigned_indices[f_target] = sample_indices(uniform[f_target], cdf, selected_indices)
-                assigned_levels[f_target] = level
-                unassigned_mask[f_target] = False
+            assigned_indices[cell_indices] = selected_indices[sampling.sample_indices(uniform[cell_indices], cdf)]
+            assigned_levels[cell_indices] = level
+            unassigned_mask[cell_indices] = False
 
-                progress.update(np.count_nonzero(f_target))
+            progress.update(int(count))
 
     # Randomly assign unmatched observations
     cdf = np.cumsum(weights)
     cdf /= cdf[-1]
 
-    assigned_indices[unassigned_mask] = sample_indices(uniform[unassigned_mask], cdf, np.arange(len(weights)))
+    assigned_indices[unassigned_mask] = sampling.sample_indices(uniform[unassigned_mask], cdf)
     assigned_levels[unassigned_mask] = 0
 
     progress.update(np.count_nonzero(unassigned_mask))
@@ -123,7 +160,7 @@ def statistical_matching(progress, df_source, source_identifier, weight, df_targ
 
 def _run_parallel_statistical_matching(context, args):
     # Pass arguments
-    df_target, random_seed = args
+    start, end = args
 
     # Pass data
     df_source = context.data("df_source")
@@ -133,23 +170,32 @@ def _run_parallel_statistical_matching(context, args):
     columns = context.data("columns")
     minimum_observations = context.data("minimum_observations")
 
-    return statistical_matching(context.progress, df_source, source_identifier, weight, df_target, target_identifier, columns, random_seed, minimum_observations)
+    df_target = context.data("df_target").frame(start = start, end = end)
+
+    return statistical_matching(
+        context.progress, df_source, source_identifier, weight, df_target, target_identifier, columns,
+        minimum_observations = minimum_observations, uniform = df_target["uniform"].values)
 
 def parallel_statistical_matching(context, df_source, source_identifier, weight, df_target, target_identifier, columns, minimum_observations = 0):
     random_seed = context.config("random_seed")
     processes = context.config("processes")
 
-    random = np.random.RandomState(random_seed)
-    chunks = np.array_split(df_target, processes)
+    chunk_sizes = [len(chunk) for chunk in np.array_split(np.arange(len(df_target)), processes)]
+    chunk_offsets = np.cumsum([0] + chunk_sizes)
+
+    # Draw the random values for all targets at once, such that the result does
+    # not depend on how the targets are split among the processes
+    df_target = df_target[[target_identifier] + columns].copy()
+    df_target["uniform"] = seeding.derive_random(random_seed, "matching").random_sample(size = (len(df_target),))
 
     with context.progress(label = "Statistical matching ...", total = len(df_target)):
-        with context.parallel({
-            "df_source": df_source, "source_identifier": source_identifier, "weight": weight,
-            "target_identifier": target_identifier, "columns": columns,
-            "minimum_observations": minimum_observations
-        }) as parallel:
-                random_seeds = random.randint(10000, size = len(chunks))
-                results = parallel.map(_run_parallel_statistical_matching, zip(chunks, random_seeds))
+        with shared.SharedFrame(df_target, [target_identifier] + columns + ["uniform"], directory = context.path()) as df_shared_target:
+            with context.parallel({
+                "df_source": df_source, "source_identifier": source_identifier, "weight": weight,
+                "target_identifier": target_identifier, "columns": columns,
+                "minimum_observations": minimum_observations, "df_target": df_shared_target
+            }) as parallel:
+                results = parallel.map(_run_parallel_statistical_matching, zip(chunk_offsets[:-1], chunk_offsets[1:]))
 
                 levels = np.hstack([r[1] for r in results])
                 df_target = pd.concat([r[0] for r in results])
@@ -163,7 +209,7 @@ def execute(context):
     df_source_households, df_source_persons, df_source_trips = context.stage("hts")
     df_source = pd.merge(df_source_persons, df_source_households)
 
-    df_target = context.stage("synthesis.population.sampled")
+    df_target = context.stage("synthesis.population.sampled", sampled.get_sample_config(context))
 
     # Define matching attributes
     AGE_BOUNDARIES = [14, 29, 44, 59, 74, 1000]
@@ -5,6 +5,29 @@ import pandas as pd
 This stage has the census data as input and samples households according to the
 household weights given by INSEE. The resulting sample size can be controlled
 through the 'sampling_rate' configuration option.
+
+Three sampling methods are available through the 'sampling_method' option:
+- "full" (default): All census households are replicated according to their
+  stochastically rounded weight, which yields the 100% population. Then, every
+  replicated household is selected with probability 'sampling_rate'.
+- "binomial": The number of selected replicas of each census household is drawn
+  directly from a binomial distribution with the rounded weight as the number of
+  trials. Only the selected replicas are materialized, so memory scales with the
+  sample size. The result follows the same distribution as "full", but is drawn
+  from a different random stream, unless 'sampling_rate' is 1.0.
+- "nested": One uniform value is drawn per replicated household, exactly as in
+  "full", and the replicas below 'sampling_rate' are selected. Only the selected
+  replicas are materialized, but the result is identical to "full". Hence, for
+  the same seed, a sample with a lower rate is an exact subset of one with a
+  higher rate.
+
+In all cases, household and person IDs refer to the (virtual) 100% population,
+i.e. the same replica of a census household obtains the same IDs.
+
+If 'nested_sampling_rate' is given in "nested" mode, the stages that request
+their sample via get_sample_config (home zones, income and matching) work on the
+sample at that rate and can be reused for all lower values of 'sampling_rate'.
+Their consumers only keep the persons and households of the actual sample.
 """
 
 def configure(context):
@@ -12,23 +35,22 @@ def configure(context):
 
     context.config("random_seed")
     context.config("sampling_rate")
+    context.config("sampling_method", "full")
+    context.config("nested_sampling_rate", None)
 
-def execute(context):
-    df_census = context.stage("data.census.filtered").sort_values(by = "household_id").copy()
-
-    sampling_rate = context.config("sampling_rate")
-    random = np.random.RandomState(context.config("random_seed"))
+def get_sample_config(context):
+    """
+        Returns the configuration with which a stage should request this stage
+        to be reusable across sampling rates. The calling stage must request the
+        'sampling_method' and 'nested_sampling_rate' options.
+    """
+    if context.config("sampling_method") == "nested" and not context.config("nested_sampling_rate") is None:
+        return dict(sampling_rate = context.config("nested_sampling_rate"))
 
-    # Perform stochastic rounding for the population (and scale weights)
-    df_rounding = df_census[["household_id", "weight", "household_size"]].drop_duplicates("household_id")
-    df_rounding["multiplicator"] = np.floor(df_rounding["weight"])
-    df_rounding["multiplicator"] += random.random_sample(len(df_rounding)) <= (df_rounding["weight"] - df_rounding["multiplicator"])
-    df_rounding["multiplicator"] = df_rounding["multiplicator"].astype(np.int)
+    return {}
 
+def sample_full(df_census, household_multiplicators, household_sizes, sampling_rate, random):
     # Multiply households (use same multiplicator for all household members)
-    household_multiplicators = df_rounding["multiplicator"].values
-    household_sizes = df_rounding["household_size"].values
-
     person_muliplicators = np.repeat(household_multiplicators, household_sizes)
     df_census = df_census.iloc[np.repeat(np.arange(len(df_census)), person_muliplicators)]
 
@@ -45,7 +67,85 @@ def execute(context):
     # Select sample from 100% population
     selector = random.random_sample(household_count) < sampling_rate
     selector = np.repeat(selector, household_sizes)
-    df_census = df_census[selector]
+    return df_census[selector]
+
+def materialize_replicas(df_census, household_multiplicators, household_sizes, replica_households, replica_numbers):
+    # Offsets of the census households in the census, and of their first replica
+    # in the (virtual) 100% population
+    row_offsets = np.hstack([[0], np.cumsum(household_sizes)[:-1]])
+    household_offsets = np.hstack([[0], np.cumsum(household_multiplicators)[:-1]])
+    person_offsets = np.hstack([[0], np.cumsum(household_multiplicators * household_sizes)[:-1]])
+
+    # Expand replicas into persons
+    replica_sizes = household_sizes[replica_households]
+    person_replicas = np.repeat(np.arange(len(replica_households)), replica_sizes)
+    person_numbers = np.arange(len(person_replicas)) - np.repeat(np.cumsum(replica_sizes) - replica_sizes, replica_sizes)
+    person_households = replica_households[person_replicas]
+
+    df_census = df_census.iloc[row_offsets[person_households] + person_numbers].copy()
+
+    # Create new household and person IDs
+    df_census["census_person_id"] = df_census["person_id"]
+    df_census["census_household_id"] = df_census["household_id"]
+
+    df_census["person_id"] = person_offsets[person_households] + replica_numbers[person_replicas] * household_sizes[person_households] + person_numbers
+    df_census["household_id"] = household_offsets[person_households] + replica_numbers[person_replicas]
+
+    return df_census
+
+def sample_binomial(df_census, household_multiplicators, household_sizes, sampling_rate, random):
+    # Draw the number of selected replicas per census household
+    household_counts = random.binomial(household_multiplicators, sampling_rate)
+
+    # Replicas are exchangeable, so we select the first ones of each household
+    replica_households = np.repeat(np.arange(len(household_counts)), household_counts)
+    replica_numbers = np.arange(len(replica_households)) - np.repeat(np.cumsum(household_counts) - household_counts, household_counts)
+
+    return materialize_replicas(df_census, household_multiplicators, household_sizes, replica_households, replica_numbers)
+
+def sample_nested(df_census, household_multiplicators, household_sizes, sampling_rate, random):
+    # Draw one uniform value per replica (same random stream as in sample_full)
+    household_count = np.sum(household_multiplicators)
+    selected_replicas = np.nonzero(random.random_sample(household_count) < sampling_rate)[0]
+
+    # Find census household and replica number of the selected replicas
+    household_offsets = np.cumsum(household_multiplicators)
+    replica_households = np.searchsorted(household_offsets, selected_replicas, side = "right")
+    replica_numbers = selected_replicas - (household_offsets - household_multiplicators)[replica_households]
+
+    return materialize_replicas(df_census, household_multiplicators, household_sizes, replica_households, replica_numbers)
+
+SAMPLING_METHODS = dict(full = sample_full, binomial = sample_binomial, nested = sample_nested)
+
+def execute(context):
+    df_census = context.stage("data.census.filtered").sort_values(by = "household_id").copy()
+
+    sampling_rate = context.config("sampling_rate")
+    sampling_method = context.config("sampling_method")
+    random = np.random.RandomState(context.config("random_seed"))
+
+    if not sampling_method in SAMPLING_METHODS:
+        raise RuntimeError("Unknown sampling method: %s" % sampling_method)
+
+    nested_sampling_rate = context.config("nested_sampling_rate")
+
+    if not nested_sampling_rate is None:
+        if not sampling_method == "nested":
+            raise RuntimeError("The nested sampling rate can only be used with sampling_method: nested")
+
+        if sampling_rate > nested_sampling_rate:
+            raise RuntimeError("The sampling rate must not exceed the nested sampling rate")
+
+    # Perform stochastic rounding for the population (and scale weights)
+    df_rounding = df_census[["household_id", "weight", "household_size"]].drop_duplicates("household_id")
+    df_rounding["multiplicator"] = np.floor(df_rounding["weight"])
+    df_rounding["multiplicator"] += random.random_sample(len(df_rounding)) <= (df_rounding["weight"] - df_rounding["multiplicator"])
+    df_rounding["multiplicator"] = df_rounding["multiplicator"].astype(np.int)
+
+    household_multiplicators = df_rounding["multiplicator"].values
+    household_sizes = df_rounding["household_size"].values
+
+    df_census = SAMPLING_METHODS[sampling_method](df_census, household_multiplicators, household_sizes, sampling_rate, random)
 
     del df_census["weight"]
     return df_census
@@ -1,52 +1,46 @@
-import data.spatial.utils as spatial_utils
+import data.seeding as seeding
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 
+"""
+This stage samples a home location (address) for every household uniformly
+among the addresses of its IRIS. The addresses are grouped per IRIS once
+(CSR-style), such that all households are sampled with one vectorized draw.
+"""
+
 def configure(context):
     context.stage("synthesis.population.spatial.home.zones")
     context.stage("synthesis.locations.home")
 
     context.config("random_seed")
 
-def _sample_locations(context, args):
-    iris_id, random_seed = args
-    df_locations = context.data("df_locations")
-    df_homes = context.data("df_homes")
-
-    random = np.random.RandomState(random_seed)
-
-    df_homes = df_homes[df_homes["iris_id"] == iris_id].copy()
-    df_locations = df_locations[df_locations["iris_id"] == iris_id].copy()
-
-    home_count = len(df_homes)
-    location_count = len(df_locations)
-
-    assert location_count > 0
-    assert home_count > 0
-
-    indices = random.randint(location_count, size = home_count)
-    df_homes["geometry"] = df_locations.iloc[indices]["geometry"].values
-
-    context.progress.update()
-    return df_homes
-
 def execute(context):
-    random = np.random.RandomState(context.config("random_seed"))
+    random = seeding.derive_random(context.config("random_seed"), "home")
 
     df_homes = context.stage("synthesis.population.spatial.home.zones")
     df_locations = context.stage("synthesis.locations.home")
 
-    # Sample locations for home
+    # Group addresses per IRIS
+    location_codes, iris_ids = pd.factorize(np.asarray(df_locations["iris_id"]), sort = True)
 
-    unique_iris_ids = set(df_homes["iris_id"].unique())
+    location_order = np.argsort(location_codes)
+    location_counts = np.bincount(location_codes, minlength = len(iris_ids))
+    location_offsets = np.hstack([[0], np.cumsum(location_counts)])
 
-    with context.progress(label = "Sampling home locations ...", total = len(unique_iris_ids)) as progress:
-        with context.parallel(dict(
-            df_locations = df_locations, df_homes = df_homes
-        )) as parallel:
-            seeds = random.randint(10000, size = len(unique_iris_ids))
-            df_homes = pd.concat(parallel.map(_sample_locations, zip(unique_iris_ids, seeds)))
+    # Find the addresses of every household
+    home_codes = pd.Index(iris_ids).get_indexer(np.asarray(df_homes["iris_id"]))
 
-    df_homes = gpd.GeoDataFrame(df_homes, crs = "EPSG:2154")
-    return df_homes[["household_id", "commune_id", "geometry"]]
+    if np.any(home_codes < 0):
+        raise RuntimeError("Found households in IRIS without home locations")
+
+    # Sample locations for home
+    counts = location_counts[home_codes]
+    indices = np.minimum(np.floor(random.random_sample(size = len(df_homes)) * counts).astype(np.int64), counts - 1)
+    indices = location_order[location_offsets[home_codes] + indices]
+
+    return gpd.GeoDataFrame(dict(
+        household_id = df_homes["household_id"].values,
+        commune_id = df_homes["commune_id"].values,
+        geometry = df_locations["geometry"].values[indices]
+    ), crs = "EPSG:2154")
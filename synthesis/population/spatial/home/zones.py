@@ -1,6 +1,9 @@
 import numpy as np
 import pandas as pd
 
+import synthesis.population.sampled as sampled
+import data.sampling as sampling
+
 """
 This stage samples home zones for all synthesized households. From the census
 data we have several special cases that we need to cover:
@@ -13,7 +16,9 @@ has less than 200 inhabitants to the second case.
 """
 
 def configure(context):
-    context.stage("synthesis.population.sampled")
+    context.config("sampling_method", "full")
+    context.config("nested_sampling_rate", None)
+    context.stage("synthesis.population.sampled", sampled.get_sample_config(context))
 
     context.stage("data.spatial.municipalities")
     context.stage("data.spatial.iris")
@@ -21,15 +26,65 @@ def configure(context):
 
     context.config("random_seed")
 
+def sample_replacement_zones(random, candidate_keys, candidate_ids, weights, target_keys):
+    """
+        Samples a replacement zone for every target. The candidates are grouped
+        by key (e.g. their departement) and every target draws from the group
+        of its own key, proportional to the weights. All groups are sampled in
+        one pass, and the targets of a group obtain the drawn zones in order.
+    """
+    keys, order, offsets = sampling.group_rows(candidate_keys)
+    codes = keys.get_indexer(target_keys)
+
+    if np.any(codes < 0):
+        raise RuntimeError("Found zones without candidates for replacement: %s" % set(np.asarray(target_keys)[codes < 0]))
+
+    counts = np.bincount(codes, minlength = len(keys))
+    selected_counts = sampling.sample_grouped_multinomial(random, counts, weights[order], offsets)
+
+    result = np.empty((len(codes),), dtype = object)
+    result[np.argsort(codes, kind = "mergesort")] = np.repeat(np.asarray(candidate_ids)[order], selected_counts)
+
+    return result
+
+def fix_missing_communes(random, df_households, df_municipalities, f_has_commune):
+    # We select from the communes without IRIS in the same departement
+    df_candidates = df_municipalities[~df_municipalities["has_iris"]]
+
+    commune_ids = df_households["commune_id"].values.copy()
+    commune_ids[~f_has_commune] = sample_replacement_zones(random,
+        df_candidates["departement_id"].astype(str).values, df_candidates.index.values,
+        df_candidates["population"].values.astype(float),
+        df_households["departement_id"].values[~f_has_commune].astype(str))
+
+    df_households["commune_id"] = commune_ids
+
+def fix_missing_iris(random, df_households, df_iris, f_has_commune, f_has_iris):
+    # We select from the IRIS with <200 inhabitants in the same commune
+    df_candidates = df_iris[df_iris["population"] <= 200]
+
+    weights = df_candidates["population"].values.astype(float)
+    totals = df_candidates.groupby("commune_id")["population"].transform("sum").values
+    weights[totals == 0.0] = 1.0
+
+    f = f_has_commune & ~f_has_iris
+
+    iris_ids = df_households["iris_id"].values.copy()
+    iris_ids[f] = sample_replacement_zones(random,
+        df_candidates["commune_id"].astype(str).values, df_candidates.index.values, weights,
+        df_households["commune_id"].values[f].astype(str))
+
+    df_households["iris_id"] = iris_ids
+
 def execute(context):
     random = np.random.RandomState(context.config("random_seed"))
 
-    df_households = context.stage("synthesis.population.sampled").drop_duplicates("household_id")[[
+    df_households = context.stage("synthesis.population.sampled", sampled.get_sample_config(context)).drop_duplicates("household_id")[[
         "household_id", "commune_id", "iris_id", "departement_id"
     ]].copy().set_index("household_id")
 
-    f_has_commune = df_households["commune_id"] != "undefined"
-    f_has_iris = df_households["iris_id"] != "undefined"
+    f_has_commune = (df_households["commune_id"] != "undefined").values
+    f_has_iris = (df_households["iris_id"] != "undefined").values
 
     # Fix missing communes (we select from those without IRIS)
     df_municipalities = context.stage("data.spatial.municipalities").set_index("commune_id")
@@ -40,24 +95,7 @@ def execute(context):
         set(df_municipalities.index.unique()) - set(df_households["commune_id"].cat.categories),
         inplace = True)
 
-    departements = df_households[~f_has_commune]["departement_id"].unique()
-
-    for departement_id in context.progress(departements, label = "Fixing missing communes ..."):
-        df_candidates = df_municipalities[
-            ~df_municipalities["has_iris"] &
-            (df_municipalities["departement_id"].astype(str) == departement_id)]
-
-        df_target = df_households[
-            ~f_has_commune &
-            (df_households["departement_id"] == departement_id)].copy()
-
-        weights = df_candidates["population"].values.astype(float)
-        weights /= np.sum(weights)
-
-        indices = np.repeat(np.arange(weights.shape[0]), random.multinomial(len(df_target), weights))
-        df_target["commune_id"] = df_candidates.reset_index()["commune_id"].iloc[indices].values
-
-        df_households.loc[df_target.index, "commune_id"] = df_target["commune_id"]
+    fix_missing_communes(random, df_households, df_municipalities, f_has_commune)
 
     # Fix missing IRIS (we select from those with <200 inhabitants)
     df_iris = context.stage("data.spatial.iris").set_index("iris_id")
@@ -68,25 +106,7 @@ def execute(context):
         set(df_iris.index.unique()) - set(df_households["iris_id"].cat.categories),
         inplace = True)
 
-    communes = df_households[~f_has_iris & f_has_commune]["commune_id"].unique()
-
-    for commune_id in context.progress(communes, label = "Fixing missing IRIS ..."):
-        df_candidates = df_iris[
-            (df_iris["population"] <= 200) &
-            (df_iris["commune_id"].astype(str) == commune_id)]
-
-        df_target = df_households[
-            f_has_commune & ~f_has_iris &
-            (df_households["commune_id"] == commune_id)].copy()
-
-        weights = df_candidates["population"].values.astype(float)
-        if (weights == 0.0).all(): weights += 1.0
-        weights /= np.sum(weights)
-
-        indices = np.repeat(np.arange(weights.shape[0]), random.multinomial(len(df_target), weights))
-        df_target["iris_id"] = df_candidates.reset_index()["iris_id"].iloc[indices].values
-
-        df_households.loc[df_target.index, "iris_id"] = df_target["iris_id"]
+    fix_missing_iris(random, df_households, df_iris, f_has_commune, f_has_iris)
 
     # Check that everybody has a commune now
     assert np.count_nonzero(df_households["commune_id"] == "undefined") == 0
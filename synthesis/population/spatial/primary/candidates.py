@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
 
+import data.seeding as seeding
+import data.sampling as sampling
+
 def configure(context):
     context.stage("data.od.weighted")
 
@@ -13,53 +16,56 @@ def configure(context):
 
     context.config("random_seed")
 
-def sample_destination_municipalities(context, arguments):
-    # Load data
-    origin_id, count, random_seed = arguments
-    df_od = context.data("df_od")
+def sample_destination_municipalities(random, df_demand, df_od):
+    # Encode OD weights per origin
+    origin_ids, od_order, od_offsets = sampling.group_rows(df_od["origin_id"])
+
+    counts = np.zeros((len(origin_ids),), dtype = np.int64)
+    positions = origin_ids.get_indexer(np.asarray(df_demand["commune_id"]))
 
-    # Prepare state
-    random = np.random.RandomState(random_seed)
-    df_od = df_od[df_od["origin_id"] == origin_id].copy()
+    if np.any(positions < 0):
+        raise RuntimeError("Found origins without OD weights")
 
-    # Sample destinations
-    df_od["count"] = random.multinomial(count, df_od["weight"].values)
-    df_od = df_od[df_od["count"] > 0]
+    counts[positions] = df_demand["count"].values
 
-    context.progress.update()
-    return df_od[["origin_id", "destination_id", "count"]]
+    # Sample flows for all origins at once
+    flow_counts = sampling.sample_grouped_multinomial(random, counts, df_od["weight"].values[od_order], od_offsets)
+    f = flow_counts > 0
 
-def sample_locations(context, arguments):
-    # Load data
-    destination_id, random_seed = arguments
-    df_locations, df_flow = context.data("df_locations"), context.data("df_flow")
+    return pd.DataFrame(dict(
+        origin_id = np.asarray(df_od["origin_id"])[od_order][f],
+        destination_id = np.asarray(df_od["destination_id"])[od_order][f],
+        count = flow_counts[f]
+    ))
 
-    # Prepare state
-    random = np.random.RandomState(random_seed)
-    df_locations = df_locations[df_locations["commune_id"] == destination_id]
+def sample_locations(random, df_flow, df_locations):
+    # Encode flows per destination
+    destination_ids, flow_order, flow_offsets = sampling.group_rows(df_flow["destination_id"])
+    flow_counts = df_flow["count"].values[flow_order]
+    flow_groups = np.repeat(np.arange(len(destination_ids)), np.diff(flow_offsets))
 
-    # Determine demand
-    df_flow = df_flow[df_flow["destination_id"] == destination_id]
-    count = df_flow["count"].sum()
+    # Encode locations per municipality
+    commune_ids, location_order, location_offsets = sampling.group_rows(df_locations["commune_id"])
+    weights = df_locations["weight"].values[location_order] if "weight" in df_locations else np.ones((len(df_locations),))
 
-    # Sample destinations
-    weight = np.ones((len(df_locations),)) / len(df_locations)
+    counts = np.zeros((len(commune_ids),), dtype = np.int64)
+    positions = commune_ids.get_indexer(destination_ids)
 
-    if "weight" in df_locations:
-        weight = df_locations["weight"].values / df_locations["weight"].sum()
+    if np.any(positions < 0):
+        raise RuntimeError("Found destinations without locations")
 
-    location_counts = random.multinomial(count, weight)
-    location_ids = df_locations["location_id"].values
-    location_ids = np.repeat(location_ids, location_counts)
+    counts[positions] = np.bincount(flow_groups, weights = flow_counts, minlength = len(destination_ids)).astype(np.int64)
 
-    # Construct a data set for all commutes to this zone
-    origin_id = np.repeat(df_flow["origin_id"].values, df_flow["count"].values)
+    # Sample locations for all destinations at once
+    location_counts = sampling.sample_grouped_multinomial(random, counts, weights, location_offsets)
 
-    df_result = pd.DataFrame.from_records(dict(
-        origin_id = origin_id,
-        location_id = location_ids
+    # Both sides are sorted by the destination, so the commutes of every
+    # destination are paired with the locations sampled for it
+    df_result = pd.DataFrame(dict(
+        origin_id = np.repeat(df_flow["origin_id"].values[flow_order], flow_counts),
+        destination_id = np.repeat(df_flow["destination_id"].values[flow_order], flow_counts),
+        location_id = np.repeat(np.asarray(df_locations["location_id"])[location_order], location_counts)
     ))
-    df_result["destination_id"] = destination_id
 
     return df_result
 
@@ -68,31 +74,19 @@ def process(context, purpose, random, df_persons, df_od, df_locations):
 
     # Sample commute flows based on population
     df_demand = df_persons.groupby("commune_id").size().reset_index(name = "count")
-    df_demand["random_seed"] = random.randint(0, int(1e6), len(df_demand))
-    df_demand = df_demand[["commune_id", "count", "random_seed"]]
+    df_demand = df_demand[["commune_id", "count"]]
     df_demand = df_demand[df_demand["count"] > 0]
 
-    df_flow = []
-
     with context.progress(label = "Sampling %s municipalities" % purpose, total = len(df_demand)) as progress:
-        with context.parallel(dict(df_od = df_od)) as parallel:
-            for df_partial in parallel.imap_unordered(sample_destination_municipalities, df_demand.itertuples(index = False, name = None)):
-                df_flow.append(df_partial)
-
-    df_flow = pd.concat(df_flow)
+        df_flow = sample_destination_municipalities(random, df_demand, df_od)
+        progress.update(len(df_demand))
 
     # Sample destinations based on the obtained flows
     unique_ids = df_flow["destination_id"].unique()
-    random_seeds = random.randint(0, int(1e6), len(unique_ids))
-
-    df_result = []
-
-    with context.progress(label = "Sampling %s destinations" % purpose, total = len(df_demand)) as progress:
-        with context.parallel(dict(df_locations = df_locations, df_flow = df_flow)) as parallel:
-            for df_partial in parallel.imap_unordered(sample_locations, zip(unique_ids, random_seeds)):
-                df_result.append(df_partial)
 
-    df_result = pd.concat(df_result)
+    with context.progress(label = "Sampling %s destinations" % purpose, total = len(unique_ids)) as progress:
+        df_result = sample_locations(random, df_flow, df_locations)
+        progress.update(len(unique_ids))
 
     return df_result[["origin_id", "destination_id", "location_id"]]
 
@@ -116,7 +110,8 @@ def execute(context):
     df_work_od, df_education_od = context.stage("data.od.weighted")
 
     # Sampling
-    random = np.random.RandomState(context.config("random_seed"))
+    random_seed = context.config("random_seed")
+    random = seeding.derive_random(random_seed, "candidates")
 
     df_locations = context.stage("synthesis.locations.work")
     df_locations["weight"] = df_locations["employees"]
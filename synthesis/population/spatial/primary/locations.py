@@ -1,6 +1,10 @@
+import time
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import numba
+
+import data.shared as shared
 
 def configure(context):
     context.stage("synthesis.population.spatial.primary.candidates")
@@ -9,6 +13,8 @@ def configure(context):
     context.stage("synthesis.locations.work")
     context.stage("synthesis.locations.education")
 
+    context.config("primary_location_ordering", "distance")
+
 def define_distance_ordering(df_persons, df_candidates, progress):
     indices = []
 
@@ -35,44 +41,443 @@ def define_distance_ordering(df_persons, df_candidates, progress):
 
     return indices
 
+def build_tree(coordinates, leaf_size = 16):
+    """
+        Builds a KD-tree over the given coordinates. Returns the permutation of
+        the points, and for every node its range in the permutation, its
+        children (or -1 for leaves), its parent and its bounding box.
+    """
+    order = np.arange(len(coordinates))
+    starts, ends, lefts, rights, parents, bounds = [], [], [], [], [], []
+
+    def build(start, end, parent):
+        node = len(starts)
+
+        starts.append(start)
+        ends.append(end)
+        lefts.append(-1)
+        rights.append(-1)
+        parents.append(parent)
+
+        points = coordinates[order[start:end]]
+        bounds.append(np.hstack([np.min(points, axis = 0), np.max(points, axis = 0)]))
+
+        if end - start > leaf_size:
+            # Split at the median of the wider dimension
+            axis = np.argmax(bounds[node][2:] - bounds[node][:2])
+            middle = (start + end) // 2
+
+            partition = np.argpartition(points[:, axis], middle - start)
+            order[start:end] = order[start:end][partition]
+
+            lefts[node] = build(start, middle, node)
+            rights[node] = build(middle, end, node)
+
+        return node
+
+    build(0, len(coordinates), -1)
+
+    return order, (
+        np.array(starts, dtype = np.int64), np.array(ends, dtype = np.int64),
+        np.array(lefts, dtype = np.int64), np.array(rights, dtype = np.int64),
+        np.array(parents, dtype = np.int64), np.array(bounds, dtype = np.float64)
+    )
+
+@numba.njit
+def _lower_bound(bounds, x, y, commute_distance):
+    # Lower bound for the cost of any point in the box. Every operation is
+    # monotonic, so the bound also holds after rounding.
+    dx = max(bounds[0] - x, 0.0, x - bounds[2])
+    dy = max(bounds[1] - y, 0.0, y - bounds[3])
+    minimum_distance = np.sqrt(dx * dx + dy * dy)
+
+    dx = max(abs(x - bounds[0]), abs(x - bounds[2]))
+    dy = max(abs(y - bounds[1]), abs(y - bounds[3]))
+    maximum_distance = np.sqrt(dx * dx + dy * dy)
+
+    if commute_distance < minimum_distance:
+        return minimum_distance - commute_distance
+
+    if commute_distance > maximum_distance:
+        return commute_distance - maximum_distance
+
+    return 0.0
+
+@numba.njit
+def _define_indexed_ordering(home_coordinates, commute_distances, coordinates, order, starts, ends, lefts, rights, parents, bounds):
+    candidate_count = len(order)
+
+    # Find the leaf of every slot of the permutation
+    leaves = np.zeros((candidate_count,), dtype = np.int64)
+
+    for node in range(len(starts)):
+        if lefts[node] < 0:
+            leaves[starts[node]:ends[node]] = node
+
+    slots = np.empty((candidate_count,), dtype = np.int64)
+    slots[order] = np.arange(candidate_count)
+
+    available = np.ones((candidate_count,), dtype = np.bool_)
+    counts = ends - starts
+    first_available = 0
+
+    stack_nodes = np.empty((2 * len(starts),), dtype = np.int64)
+    stack_bounds = np.empty((2 * len(starts),), dtype = np.float64)
+
+    indices = np.empty((len(commute_distances),), dtype = np.int64)
+
+    for k in range(len(commute_distances)):
+        x, y = home_coordinates[k, 0], home_coordinates[k, 1]
+        commute_distance = commute_distances[k]
+
+        best_cost = np.inf
+        best_index = candidate_count
+
+        if not (np.isnan(x) or np.isnan(y) or np.isnan(commute_distance)):
+            # Branch and bound, visiting the closer child first
+            stack_nodes[0] = 0
+            stack_bounds[0] = _lower_bound(bounds[0], x, y, commute_distance)
+            size = 1
+
+            while size > 0:
+                size -= 1
+                node = stack_nodes[size]
+
+                if counts[node] == 0 or stack_bounds[size] > best_cost:
+                    continue
+
+                if lefts[node] < 0:
+                    for slot in range(starts[node], ends[node]):
+                        if available[slot]:
+                            dx = coordinates[slot, 0] - x
+                            dy = coordinates[slot, 1] - y
+                            cost = abs(np.sqrt(dx * dx + dy * dy) - commute_distance)
+
+                            # Ties are resolved by the lowest index, as in np.argmin
+                            if cost < best_cost or (cost == best_cost and order[slot] < best_index):
+                                best_cost = cost
+                                best_index = order[slot]
+
+                else:
+                    left_bound = _lower_bound(bounds[lefts[node]], x, y, commute_distance)
+                    right_bound = _lower_bound(bounds[rights[node]], x, y, commute_distance)
+
+                    if left_bound <= right_bound:
+                        stack_nodes[size], stack_bounds[size] = rights[node], right_bound
+                        stack_nodes[size + 1], stack_bounds[size + 1] = lefts[node], left_bound
+                    else:
+                        stack_nodes[size], stack_bounds[size] = lefts[node], left_bound
+                        stack_nodes[size + 1], stack_bounds[size + 1] = rights[node], right_bound
+
+                    size += 2
+
+        if best_index == candidate_count:
+            # Without a finite cost, np.argmin selects the first available candidate
+            while not available[slots[first_available]]:
+                first_available += 1
+
+            best_index = first_available
+
+        indices[k] = best_index
+
+        # Remove the selected candidate from the tree
+        slot = slots[best_index]
+        available[slot] = False
+
+        node = leaves[slot]
+
+        while node >= 0:
+            counts[node] -= 1
+            node = parents[node]
+
+    return indices
+
+def prepare_indexed_ordering(df_persons, df_candidates):
+    commute_coordinates = np.vstack([
+        df_candidates["geometry"].x.values,
+        df_candidates["geometry"].y.values
+    ]).T.astype(np.float64)
+
+    home_coordinates = np.array([
+        coordinate.coords[0] for coordinate in df_persons["home_location"]
+    ], dtype = np.float64).reshape(-1, 2)
+
+    order, tree = build_tree(commute_coordinates)
+
+    return (
+        home_coordinates, df_persons["commute_distance"].values.astype(np.float64),
+        commute_coordinates[order], order
+    ) + tree
+
+def define_indexed_ordering(df_persons, df_candidates, progress):
+    """
+        Produces the same ordering as define_distance_ordering, but finds the
+        best remaining candidate of every person in a KD-tree of the candidates
+        instead of comparing it with all of them.
+    """
+    indices = _define_indexed_ordering(*prepare_indexed_ordering(df_persons, df_candidates))
+
+    assert len(set(indices)) == len(df_candidates)
+    progress.update(len(df_persons))
+
+    return indices
+
+@numba.njit
+def _find_best_candidates(home_coordinates, commute_distances, coordinates, order, starts, ends, lefts, rights, parents, bounds, count):
+    # Finds the candidates with the lowest cost for every person (-1 if there
+    # are fewer candidates or the cost is undefined)
+    indices = -np.ones((len(commute_distances), count), dtype = np.int64)
+    costs = np.full((len(commute_distances), count), np.inf)
+
+    stack_nodes = np.empty((2 * len(starts),), dtype = np.int64)
+    stack_bounds = np.empty((2 * len(starts),), dtype = np.float64)
+
+    for k in range(len(commute_distances)):
+        x, y = home_coordinates[k, 0], home_coordinates[k, 1]
+        commute_distance = commute_distances[k]
+
+        if np.isnan(x) or np.isnan(y) or np.isnan(commute_distance):
+            continue
+
+        stack_nodes[0] = 0
+        stack_bounds[0] = _lower_bound(bounds[0], x, y, commute_distance)
+        size = 1
+
+        while size > 0:
+            size -= 1
+            node = stack_nodes[size]
+
+            if stack_bounds[size] > costs[k, count - 1]:
+                continue
+
+            if lefts[node] < 0:
+                for slot in range(starts[node], ends[node]):
+                    dx = coordinates[slot, 0] - x
+                    dy = coordinates[slot, 1] - y
+                    cost = abs(np.sqrt(dx * dx + dy * dy) - commute_distance)
+
+                    if cost < costs[k, count - 1]:
+                        # Insert into the sorted list of the best candidates
+                        position = count - 1
+
+                        while position > 0 and costs[k, position - 1] > cost:
+                            costs[k, position] = costs[k, position - 1]
+                            indices[k, position] = indices[k, position - 1]
+                            position -= 1
+
+                        costs[k, position] = cost
+                        indices[k, position] = order[slot]
+
+            else:
+                left_bound = _lower_bound(bounds[lefts[node]], x, y, commute_distance)
+                right_bound = _lower_bound(bounds[rights[node]], x, y, commute_distance)
+
+                if left_bound <= right_bound:
+                    stack_nodes[size], stack_bounds[size] = rights[node], right_bound
+                    stack_nodes[size + 1], stack_bounds[size + 1] = lefts[node], left_bound
+                else:
+                    stack_nodes[size], stack_bounds[size] = lefts[node], left_bound
+                    stack_nodes[size + 1], stack_bounds[size + 1] = rights[node], right_bound
+
+                size += 2
+
+    return indices, costs
+
+@numba.njit
+def _solve_auction(offsets, targets, costs, minimum_epsilon, scaling):
+    # Forward auction with epsilon scaling for the sparse assignment problem
+    # that minimizes the total cost. The result is within len(offsets) *
+    # minimum_epsilon of the optimum, given that a perfect matching exists.
+    person_count = len(offsets) - 1
+
+    prices = np.zeros((person_count,))
+    owners = -np.ones((person_count,), dtype = np.int64)
+    assignment = -np.ones((person_count,), dtype = np.int64)
+    queue = np.empty((person_count,), dtype = np.int64)
+
+    maximum_cost = 0.0
+
+    for e in range(len(costs)):
+        maximum_cost = max(maximum_cost, costs[e])
+
+    epsilon = max(maximum_cost / scaling, minimum_epsilon)
+
+    while True:
+        owners[:] = -1
+        assignment[:] = -1
+
+        for k in range(person_count):
+            queue[k] = person_count - 1 - k
+
+        size = person_count
+
+        while size > 0:
+            size -= 1
+            k = queue[size]
+
+            # Find the best and the second best object
+            best_target = -1
+            best_value = -np.inf
+            second_value = -np.inf
+
+            for e in range(offsets[k], offsets[k + 1]):
+                value = -costs[e] - prices[targets[e]]
+
+                if value > best_value:
+                    second_value = best_value
+                    best_value = value
+                    best_target = targets[e]
+
+                elif value > second_value:
+                    second_value = value
+
+            if second_value == -np.inf:
+                # Only one option, so the bid is only limited by the cost range
+                second_value = best_value - maximum_cost - epsilon
+
+            prices[best_target] += best_value - second_value + epsilon
+
+            if owners[best_target] >= 0:
+                assignment[owners[best_target]] = -1
+                queue[size] = owners[best_target]
+                size += 1
+
+            owners[best_target] = k
+            assignment[k] = best_target
+
+        if epsilon <= minimum_epsilon:
+            return assignment
+
+        epsilon = max(epsilon / scaling, minimum_epsilon)
+
+@numba.njit
+def _build_assignment_problem(best_indices, best_costs, greedy_indices, home_coordinates, commute_distances, coordinates, slots):
+    person_count, count = best_indices.shape
+
+    offsets = np.zeros((person_count + 1,), dtype = np.int64)
+    targets = np.empty((person_count * (count + 1),), dtype = np.int64)
+    costs = np.empty((person_count * (count + 1),))
+
+    for k in range(person_count):
+        offset = offsets[k]
+        has_greedy = False
+
+        for i in range(count):
+            if best_indices[k, i] >= 0:
+                targets[offset] = best_indices[k, i]
+                costs[offset] = best_costs[k, i]
+                has_greedy |= best_indices[k, i] == greedy_indices[k]
+                offset += 1
+
+        # The greedy choice guarantees that a perfect matching exists
+        if not has_greedy:
+            slot = slots[greedy_indices[k]]
+            dx = coordinates[slot, 0] - home_coordinates[k, 0]
+            dy = coordinates[slot, 1] - home_coordinates[k, 1]
+            cost = abs(np.sqrt(dx * dx + dy * dy) - commute_distances[k])
+
+            targets[offset] = greedy_indices[k]
+            costs[offset] = 0.0 if np.isnan(cost) else cost
+            offset += 1
+
+        offsets[k + 1] = offset
+
+    return offsets, targets[:offsets[-1]], costs[:offsets[-1]]
+
+ASSIGNMENT_CANDIDATES = 16
+ASSIGNMENT_EPSILON = 0.01
+ASSIGNMENT_SCALING = 5.0
+
+def define_assignment_ordering(df_persons, df_candidates, progress):
+    """
+        Assigns the candidates such that the total deviation between the
+        distance from home and the commute distance is minimal. Every person
+        only considers the ASSIGNMENT_CANDIDATES best candidates plus the one
+        chosen by the greedy ordering, which keeps the memory bounded and
+        guarantees a solution that is at least as good as the greedy one (up
+        to ASSIGNMENT_EPSILON per person).
+    """
+    arguments = prepare_indexed_ordering(df_persons, df_candidates)
+    home_coordinates, commute_distances, coordinates, order = arguments[:4]
+
+    greedy_indices = _define_indexed_ordering(*arguments)
+    best_indices, best_costs = _find_best_candidates(*arguments, min(ASSIGNMENT_CANDIDATES, len(df_candidates)))
+
+    slots = np.empty((len(order),), dtype = np.int64)
+    slots[order] = np.arange(len(order))
+
+    offsets, targets, costs = _build_assignment_problem(
+        best_indices, best_costs, greedy_indices, home_coordinates, commute_distances, coordinates, slots)
+
+    indices = _solve_auction(offsets, targets, costs, ASSIGNMENT_EPSILON, ASSIGNMENT_SCALING)
+
+    assert len(set(indices)) == len(df_candidates)
+    progress.update(len(df_persons))
+
+    return indices
+
 def define_random_ordering(df_persons, df_candidates, progress):
     progress.update(len(df_candidates))
     return np.arange(len(df_candidates))
 
-define_ordering = define_distance_ordering
+ORDERINGS = dict(
+    distance = define_distance_ordering,
+    indexed = define_indexed_ordering,
+    assignment = define_assignment_ordering,
+    random = define_random_ordering
+)
 
 def process_municipality(context, origin_id):
     # Load data
     df_candidates, df_persons = context.data("df_candidates"), context.data("df_persons")
 
     # Find relevant records
-    df_persons = df_persons[df_persons["commune_id"] == origin_id][[
-        "person_id", "home_location", "commute_distance"
-    ]].copy()
-    df_candidates = df_candidates[df_candidates["origin_id"] == origin_id]
+    df_persons = df_persons.frame(origin_id)
+    df_candidates = df_candidates.frame(origin_id)
 
     # From previous step, this should be equal!
     assert len(df_persons) == len(df_candidates)
 
-    indices = define_ordering(df_persons, df_candidates, context.progress)
+    indices = ORDERINGS[context.data("ordering")](df_persons, df_candidates, context.progress)
     df_candidates = df_candidates.iloc[indices]
 
     df_candidates["person_id"] = df_persons["person_id"].values
     df_candidates = df_candidates.rename(columns = dict(destination_id = "commune_id"))
 
-    return df_candidates[["person_id", "commune_id", "location_id", "geometry"]]
+    # Deviation between the distance from home and the commute distance
+    home_coordinates = context.data("df_persons").array("home_location", origin_id)
+    commute_coordinates = context.data("df_candidates").array("geometry", origin_id)[indices]
+    distances = np.sqrt(np.sum((commute_coordinates - home_coordinates)**2, axis = 1))
+    df_candidates["deviation"] = np.abs(distances - df_persons["commute_distance"].values)
+
+    return df_candidates[["person_id", "commune_id", "location_id", "geometry", "deviation"]]
 
 def process(context, purpose, df_persons, df_candidates):
+    ordering = context.config("primary_location_ordering")
+
+    if not ordering in ORDERINGS:
+        raise RuntimeError("Unknown primary location ordering: %s" % ordering)
+
     unique_ids = df_candidates["origin_id"].unique()
 
     df_result = []
+    start_time = time.time()
 
     with context.progress(label = "Distributing %s destinations" % purpose, total = len(df_persons)) as progress:
-        with context.parallel(dict(df_persons = df_persons, df_candidates = df_candidates)) as parallel:
-            for df_partial in parallel.imap_unordered(process_municipality, unique_ids):
-                df_result.append(df_partial)
+        with shared.SharedFrame(df_persons, ["person_id", "home_location", "commute_distance"], key = "commune_id", directory = context.path()) as df_shared_persons:
+            with shared.SharedFrame(df_candidates, ["destination_id", "location_id", "geometry"], key = "origin_id", directory = context.path()) as df_shared_candidates:
+                with context.parallel(dict(df_persons = df_shared_persons, df_candidates = df_shared_candidates, ordering = ordering)) as parallel:
+                    for df_partial in parallel.imap(process_municipality, unique_ids):
+                        df_result.append(df_partial)
+
+    df_result = pd.concat(df_result)
+
+    # Report the deviation from the commute distances to compare the orderings
+    print("Distributed %s destinations with '%s' ordering in %.2fs, mean deviation from commute distance: %.2f m" % (
+        purpose, ordering, time.time() - start_time, np.nanmean(df_result["deviation"].values)
+    ))
 
-    return pd.concat(df_result)
+    return df_result[["person_id", "commune_id", "location_id", "geometry"]]
 
 def execute(context):
     data = context.stage("synthesis.population.spatial.primary.candidates")
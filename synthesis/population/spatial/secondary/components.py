@@ -1,40 +1,113 @@
 import synthesis.population.spatial.secondary.rda as rda
+import synthesis.population.spatial.secondary.rda_numba as rda_numba
 import sklearn.neighbors
+import scipy.spatial
 import numpy as np
 
+import data.sampling as sampling
+
 class CustomDistanceSampler(rda.FeasibleDistanceSampler):
-    def __init__(self, random, distributions, maximum_iterations = 1000):
-        rda.FeasibleDistanceSampler.__init__(self, random = random, maximum_iterations = maximum_iterations)
+    def __init__(self, random, distributions, maximum_iterations = 1000, draws = 1):
+        rda.FeasibleDistanceSampler.__init__(self, random = random, maximum_iterations = maximum_iterations, draws = draws)
 
         self.random = random
         self.distributions = distributions
 
-    def sample_distances(self, problem):
-        distances = np.zeros((len(problem["modes"])))
+        # Flatten all distributions into one array of cdfs and values
+        self.cdfs, self.values, self.offsets = [], [], {}
+        offset = 0
+
+        for mode, mode_distribution in distributions.items():
+            starts, ends = [], []
+
+            for distribution in mode_distribution["distributions"]:
+                self.cdfs.append(distribution["cdf"])
+                self.values.append(distribution["values"])
+
+                starts.append(offset)
+                offset += len(distribution["cdf"])
+                ends.append(offset)
+
+            self.offsets[mode] = (np.array(starts, dtype = np.int64), np.array(ends, dtype = np.int64))
+
+        self.cdfs = np.hstack(self.cdfs).astype(np.float64)
+        self.values = np.hstack(self.values).astype(np.float64)
+
+    def find_ranges(self, problem):
+        """
+            Returns the start and end (in the flattened cdfs and values) of the
+            distance distribution of each trip of the problem.
+        """
+        starts = np.zeros((len(problem["modes"]),), dtype = np.int64)
+        ends = np.zeros((len(problem["modes"]),), dtype = np.int64)
 
         for index, (mode, travel_time) in enumerate(zip(problem["modes"], problem["travel_times"])):
-            mode_distribution = self.distributions[mode]
+            bound_index = np.searchsorted(self.distributions[mode]["bounds"], travel_time)
+            starts[index] = self.offsets[mode][0][bound_index]
+            ends[index] = self.offsets[mode][1][bound_index]
 
-            bound_index = np.count_nonzero(travel_time > mode_distribution["bounds"])
-            mode_distribution = mode_distribution["distributions"][bound_index]
+        return starts, ends
 
-            distances[index] = mode_distribution["values"][
-                np.count_nonzero(self.random.random_sample() > mode_distribution["cdf"])
-            ]
+    def get_ranges(self, problem):
+        if "distance_ranges" in problem:
+            return problem["distance_ranges"]
+
+        return self.find_ranges(problem)
+
+    def sample(self, problem):
+        # The distribution of each trip stays the same for all draws of a
+        # problem, so the ranges are found once and passed on with a copy of it
+        problem = dict(problem, distance_ranges = self.find_ranges(problem))
+        return rda.FeasibleDistanceSampler.sample(self, problem)
+
+    def sample_distances(self, problem):
+        return self.sample_distance_matrix(problem, 1)[0]
+
+    def sample_distance_matrix(self, problem, count):
+        uniform = self.random.random_sample((count, len(problem["modes"])))
+        distances = np.zeros(uniform.shape)
+
+        for index, (start, end) in enumerate(zip(*self.get_ranges(problem))):
+            distances[:, index] = self.values[start + sampling.sample_indices(uniform[:, index], self.cdfs[start:end])]
 
         return distances
 
+class NumbaDistanceSampler(CustomDistanceSampler):
+    calculate_feasibility = staticmethod(rda_numba.calculate_feasibility)
+    calculate_feasibilities = staticmethod(rda_numba.calculate_feasibilities)
+
+    def sample_distance_matrix(self, problem, count):
+        uniform = self.random.random_sample((count, len(problem["modes"])))
+        return rda_numba.sample_distance_matrix(uniform, self.cdfs, self.values, *self.get_ranges(problem))
+
 class CandidateIndex:
-    def __init__(self, data):
+    BACKENDS = ("sklearn", "ckdtree")
+
+    def __init__(self, data, backend = "sklearn"):
+        if not backend in self.BACKENDS:
+            raise RuntimeError("Unknown spatial index backend: %s" % backend)
+
         self.data = data
         self.indices = {}
+        self.backend = backend
 
         for purpose, data in self.data.items():
             print("Constructing spatial index for %s ..." % purpose)
-            self.indices[purpose] = sklearn.neighbors.KDTree(data["locations"])
+
+            if backend == "ckdtree":
+                self.indices[purpose] = scipy.spatial.cKDTree(data["locations"])
+            else:
+                self.indices[purpose] = sklearn.neighbors.KDTree(data["locations"])
+
+    def query_indices(self, purpose, locations):
+        """ Returns the index of the closest candidate for each row of locations. """
+        if self.backend == "ckdtree":
+            return self.indices[purpose].query(locations)[1]
+
+        return self.indices[purpose].query(locations, return_distance = False)[:,0]
 
     def query(self, purpose, location):
-        index = self.indices[purpose].query(location.reshape(1, -1), return_distance = False)[0][0]
+        index = self.query_indices(purpose, location.reshape(1, -1))[0]
         identifier = self.data[purpose]["identifiers"][index]
         location = self.data[purpose]["locations"][index]
         return identifier, location
@@ -50,30 +123,58 @@ class CustomDiscretizationSolver(rda.DiscretizationSolver):
         self.index = index
 
     def solve(self, problem, locations):
-        discretized_locations = []
-        discretized_identifiers = []
+        return self.solve_batch([problem], [locations])[0]
+
+    def solve_batch(self, problems, locations):
+        """
+            Discretizes the relaxed locations of multiple problems with one
+            query per purpose and scatters the results back to the problems.
+        """
+        purposes = np.array([purpose for problem in problems for purpose in problem["purposes"]])
+        locations = np.vstack(locations).reshape(-1, 2)
 
-        for location, purpose in zip(locations, problem["purposes"]):
-            identifier, location = self.index.query(purpose, location.reshape(1, -1))
+        assert len(purposes) == len(locations)
 
-            discretized_identifiers.append(identifier)
-            discretized_locations.append(location)
+        identifiers = np.empty((len(purposes),), dtype = object)
+        discretized_locations = np.empty((len(purposes), 2))
 
-        assert len(discretized_locations) == problem["size"]
+        for purpose in np.unique(purposes):
+            f = purposes == purpose
+            indices = self.index.query_indices(purpose, locations[f])
 
-        return dict(
-            valid = True, locations = np.vstack(discretized_locations), identifiers = discretized_identifiers
-        )
+            identifiers[f] = self.index.data[purpose]["identifiers"][indices]
+            discretized_locations[f] = self.index.data[purpose]["locations"][indices]
+
+        results = []
+        offset = 0
+
+        for problem in problems:
+            size = problem["size"]
+
+            results.append(dict(
+                valid = True,
+                locations = discretized_locations[offset:offset + size],
+                identifiers = list(identifiers[offset:offset + size])
+            ))
+
+            offset += size
+
+        return results
 
 class CustomFreeChainSolver(rda.RelaxationSolver):
+    sample_tail = staticmethod(rda.sample_tail)
+
     def __init__(self, random, index):
         self.random = random
         self.index = index
 
     def solve(self, problem, distances):
         identifier, anchor = self.index.sample(problem["purposes"][0], self.random)
-        locations = rda.sample_tail(self.random, anchor, distances)
+        locations = self.sample_tail(self.random, anchor, distances)
         locations = np.vstack((anchor, locations))
 
         assert len(locations) == len(distances) + 1
         return dict(valid = True, locations = locations)
+
+class NumbaFreeChainSolver(CustomFreeChainSolver):
+    sample_tail = staticmethod(rda_numba.sample_tail)
@@ -1,10 +1,13 @@
+import time
 import numpy as np
 import pandas as pd
 import multiprocessing as mp
 import shapely.geometry as geo
 import geopandas as gpd
 
-from synthesis.population.spatial.secondary.problems import find_assignment_problems
+import data.seeding as seeding
+
+from synthesis.population.spatial.secondary.problems import find_assignment_problems, get_assignment_problems
 
 def configure(context):
     context.stage("synthesis.population.trips")
@@ -20,6 +23,11 @@ def configure(context):
     context.config("processes")
 
     context.config("secloc_maximum_iterations", np.inf)
+    context.config("secloc_batch_size", 1)
+    context.config("secloc_index_backend", "sklearn")
+    context.config("secloc_engine", "python")
+    context.config("secloc_distance_draws", 1)
+    context.config("secloc_chunk_size", 1000)
 
 def prepare_locations(context):
     # Load persons and their primary locations
@@ -70,7 +78,9 @@ def resample_distributions(distributions, factors):
             distribution["cdf"] = resample_cdf(distribution["cdf"], factors[mode])
 
 from synthesis.population.spatial.secondary.rda import AssignmentSolver, DiscretizationErrorObjective, GravityChainSolver, AngularTailSolver, GeneralRelaxationSolver
+from synthesis.population.spatial.secondary.rda_numba import NumbaGravityChainSolver, NumbaAngularTailSolver
 from synthesis.population.spatial.secondary.components import CustomDistanceSampler, CustomDiscretizationSolver, CandidateIndex, CustomFreeChainSolver
+from synthesis.population.spatial.secondary.components import NumbaDistanceSampler, NumbaFreeChainSolver
 
 def execute(context):
     # Load trips and primary locations
@@ -87,116 +97,165 @@ def execute(context):
         car = 0.0, car_passenger = 0.1, pt = 0.5, bike = 0.0, walk = -0.5
     ))
 
-    # Segment into subsamples
-    processes = context.config("processes")
+    # Create problems
+    problems = find_assignment_problems(df_trips, df_primary)
+    number_of_persons = len(df_trips["person_id"].unique())
+
+    # Split problems into chunks of persons, which are distributed dynamically
+    # to the processes. The random seed of a chunk is derived from its first
+    # person, so the result does not depend on the number of processes.
+    random_seed = context.config("random_seed")
+    chunk_size = context.config("secloc_chunk_size")
 
-    unique_person_ids = df_trips["person_id"].unique()
-    number_of_persons = len(unique_person_ids)
-    unique_person_ids = np.array_split(unique_person_ids, processes)
+    person_ids = problems["person_id"]
+    person_starts = np.nonzero(np.hstack([[True], person_ids[1:] != person_ids[:-1]]))[0]
 
-    random = np.random.RandomState(context.config("random_seed"))
-    random_seeds = random.randint(10000, size = processes)
+    boundaries = list(person_starts[::chunk_size]) if len(person_ids) > 0 else [0]
+    boundaries.append(len(person_ids))
 
-    # Create batch problems for parallelization
-    batches = []
+    chunks = []
 
-    for index in range(processes):
-        batches.append((
-            df_trips[df_trips["person_id"].isin(unique_person_ids[index])],
-            df_primary[df_primary["person_id"].isin(unique_person_ids[index])],
-            random_seeds[index]
-        ))
+    for index in range(len(boundaries) - 1):
+        start, end = boundaries[index], boundaries[index + 1]
+        chunks.append((index, start, end, seeding.derive_seed(random_seed, "secondary", person_ids[start] if start < end else 0)))
+
+    # Set up spatial index for discretization
+    candidate_index = CandidateIndex(destinations, backend = context.config("secloc_index_backend"))
 
     # Run algorithm in parallel
+    processes = context.config("processes")
+
     with context.progress(label = "Assigning secondary locations to persons", total = number_of_persons):
         with context.parallel(processes = processes, data = dict(
             distance_distributions = distance_distributions,
-            destinations = destinations
+            candidate_index = candidate_index,
+            problems = problems
         )) as parallel:
-            df_locations, df_convergence = [], []
+            results = [None] * len(chunks)
 
-            for df_locations_item, df_convergence_item in parallel.imap_unordered(process, batches):
-                df_locations.append(df_locations_item)
-                df_convergence.append(df_convergence_item)
+            for index, df_locations_item, df_convergence_item, runtime in parallel.imap_unordered(process, chunks):
+                results[index] = (df_locations_item, df_convergence_item, runtime)
 
-    df_locations = pd.concat(df_locations).sort_values(by = ["person_id", "activity_index"])
-    df_convergence = pd.concat(df_convergence)
+    df_locations = pd.concat([result[0] for result in results]).sort_values(by = ["person_id", "activity_index"])
+    df_convergence = pd.concat([result[1] for result in results])
+
+    # Report timing per chunk to make imbalance visible
+    runtimes = np.array([result[2] for result in results])
+    slowest = np.argmax(runtimes)
+
+    print("Processed %d chunks of up to %d persons with %d processes" % (len(chunks), chunk_size, processes))
+    print("  Runtime per chunk: min %.2fs, mean %.2fs, max %.2fs (total %.2fs)" % (
+        np.min(runtimes), np.mean(runtimes), np.max(runtimes), np.sum(runtimes)))
+
+    if len(person_ids) > 0:
+        print("  Slowest chunk: %d (persons %d to %d)" % (
+            slowest, person_ids[chunks[slowest][1]], person_ids[chunks[slowest][2] - 1]))
 
     print("Success rate:", df_convergence["valid"].mean())
 
     return df_locations, df_convergence
 
-def process(context, arguments):
-  df_trips, df_primary, random_seed = arguments
+def batch_problems(problems, batch_size):
+    # Problems are solved in batches, see AssignmentSolver.solve_batch
+    batch = []
+
+    for problem in problems:
+        batch.append(problem)
 
-  # Set up RNG
-  random = np.random.RandomState(context.config("random_seed"))
-  maximum_iterations = context.config("secloc_maximum_iterations")
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
 
-  # Set up discretization solver
-  destinations = context.data("destinations")
-  candidate_index = CandidateIndex(destinations)
-  discretization_solver = CustomDiscretizationSolver(candidate_index)
+    if len(batch) > 0:
+        yield batch
 
-  # Set up distance sampler
-  distance_distributions = context.data("distance_distributions")
-  distance_sampler = CustomDistanceSampler(
+ENGINES = dict(
+    python = (CustomDistanceSampler, GravityChainSolver, AngularTailSolver, CustomFreeChainSolver),
+    numba = (NumbaDistanceSampler, NumbaGravityChainSolver, NumbaAngularTailSolver, NumbaFreeChainSolver)
+)
+
+def create_assignment_solver(random, distance_distributions, candidate_index, maximum_iterations, engine = "python", distance_draws = 1):
+    if not engine in ENGINES:
+        raise RuntimeError("Unknown secondary location engine: %s" % engine)
+
+    distance_sampler_class, chain_solver_class, tail_solver_class, free_solver_class = ENGINES[engine]
+
+    # Set up discretization solver
+    discretization_solver = CustomDiscretizationSolver(candidate_index)
+
+    # Set up distance sampler
+    distance_sampler = distance_sampler_class(
         maximum_iterations = min(1000, maximum_iterations),
         random = random,
-        distributions = distance_distributions)
+        distributions = distance_distributions,
+        draws = distance_draws)
 
-  # Set up relaxation solver; currently, we do not consider tail problems.
-  chain_solver = GravityChainSolver(
-    random = random, eps = 10.0, lateral_deviation = 10.0, alpha = 0.1,
-    maximum_iterations = min(1000, maximum_iterations)
+    # Set up relaxation solver; currently, we do not consider tail problems.
+    chain_solver = chain_solver_class(
+        random = random, eps = 10.0, lateral_deviation = 10.0, alpha = 0.1,
+        maximum_iterations = min(1000, maximum_iterations)
     )
 
-  tail_solver = AngularTailSolver(random = random)
-  free_solver = CustomFreeChainSolver(random, candidate_index)
+    tail_solver = tail_solver_class(random = random)
+    free_solver = free_solver_class(random, candidate_index)
 
-  relaxation_solver = GeneralRelaxationSolver(chain_solver, tail_solver, free_solver)
+    relaxation_solver = GeneralRelaxationSolver(chain_solver, tail_solver, free_solver)
 
-  # Set up assignment solver
-  thresholds = dict(
-    car = 200.0, car_passenger = 200.0, pt = 200.0,
-    bike = 100.0, walk = 100.0
-  )
+    # Set up assignment solver
+    thresholds = dict(
+        car = 200.0, car_passenger = 200.0, pt = 200.0,
+        bike = 100.0, walk = 100.0
+    )
 
-  assignment_objective = DiscretizationErrorObjective(thresholds = thresholds)
-  assignment_solver = AssignmentSolver(
-      distance_sampler = distance_sampler,
-      relaxation_solver = relaxation_solver,
-      discretization_solver = discretization_solver,
-      objective = assignment_objective,
-      maximum_iterations = min(20, maximum_iterations)
-      )
+    assignment_objective = DiscretizationErrorObjective(thresholds = thresholds)
 
-  df_locations = []
-  df_convergence = []
+    return AssignmentSolver(
+        distance_sampler = distance_sampler,
+        relaxation_solver = relaxation_solver,
+        discretization_solver = discretization_solver,
+        objective = assignment_objective,
+        maximum_iterations = min(20, maximum_iterations)
+    )
+
+def process(context, arguments):
+    chunk_index, start, end, random_seed = arguments
+    start_time = time.time()
+
+    # Set up RNG
+    random = np.random.RandomState(random_seed)
+    maximum_iterations = context.config("secloc_maximum_iterations")
+    batch_size = context.config("secloc_batch_size")
+
+    assignment_solver = create_assignment_solver(
+        random, context.data("distance_distributions"), context.data("candidate_index"),
+        maximum_iterations, context.config("secloc_engine"), context.config("secloc_distance_draws")
+    )
 
-  last_person_id = None
+    df_locations = []
+    df_convergence = []
 
-  for problem in find_assignment_problems(df_trips, df_primary):
-      result = assignment_solver.solve(problem)
+    last_person_id = None
 
-      starting_activity_index = problem["activity_index"]
+    for problems in batch_problems(get_assignment_problems(context.data("problems"), start, end), batch_size):
+        for problem, result in zip(problems, assignment_solver.solve_batch(problems)):
+            starting_activity_index = problem["activity_index"]
 
-      for index, (identifier, location) in enumerate(zip(result["discretization"]["identifiers"], result["discretization"]["locations"])):
-          df_locations.append((
-              problem["person_id"], starting_activity_index + index, identifier, geo.Point(location)
-          ))
+            for index, (identifier, location) in enumerate(zip(result["discretization"]["identifiers"], result["discretization"]["locations"])):
+                df_locations.append((
+                    problem["person_id"], starting_activity_index + index, identifier, geo.Point(location)
+                ))
 
-      df_convergence.append((
-          result["valid"], problem["size"]
-      ))
+            df_convergence.append((
+                result["valid"], problem["size"]
+            ))
 
-      if problem["person_id"] != last_person_id:
-          last_person_id = problem["person_id"]
-          context.progress.update()
+            if problem["person_id"] != last_person_id:
+                last_person_id = problem["person_id"]
+                context.progress.update()
 
-  df_locations = pd.DataFrame.from_records(df_locations, columns = ["person_id", "activity_index", "location_id", "geometry"])
-  df_locations = gpd.GeoDataFrame(df_locations, crs = "EPSG:2154")
-  assert not df_locations["geometry"].isna().any()
+    df_locations = pd.DataFrame.from_records(df_locations, columns = ["person_id", "activity_index", "location_id", "geometry"])
+    df_locations = gpd.GeoDataFrame(df_locations, crs = "EPSG:2154")
+    assert not df_locations["geometry"].isna().any()
 
-  df_convergence = pd.DataFrame.from_records(df_convergence, columns = ["valid", "size"])
-  return df_locations, df_convergence
+    df_convergence = pd.DataFrame.from_records(df_convergence, columns = ["valid", "size"])
+    return chunk_index, df_locations, df_convergence, time.time() - start_time
@@ -1,93 +1,168 @@
 import numpy as np
 import pandas as pd
 
-FIELDS = ["person_id", "trip_index", "preceding_purpose", "following_purpose", "mode", "travel_time"]
 FIXED_PURPOSES = ["home", "work", "education"]
 
-def find_bare_assignment_problems(df):
-    problem = None
+def find_assignment_problems(df, df_locations):
+    """
+        Builds the assignment problems of all persons in one pass. A problem is
+        a chain of trips with variable activities between two fixed ones, or a
+        tail (if the chain starts or ends with a variable activity).
+
+        The trips must be sorted by person and trip index, and df_locations
+        (with the home, work and education locations) by person.
+
+        The result is a table of arrays:
+          - Per problem: person_id, trip_index (of the first trip),
+            activity_index (of the first variable activity), size (number of
+            variable activities), origin and destination coordinates (NaN if
+            the chain is open), and offsets into the trip and activity arrays
+          - Per trip: mode (codes) and travel_time
+          - Per variable activity: purpose (codes)
+          - The categories of the mode and purpose codes
+    """
+    person_ids = df["person_id"].values
+    trip_indices = df["trip_index"].values
 
-    for row in df[FIELDS].itertuples(index = False):
-        person_id, trip_index, preceding_purpose, following_purpose, mode, travel_time = row
+    purposes = np.unique(np.hstack([
+        df["preceding_purpose"].astype(str).values, df["following_purpose"].astype(str).values
+    ]))
 
-        if not problem is None and person_id != problem["person_id"]:
-            # We switch person, but we're still tracking a problem. This is a tail!
-            yield problem
-            problem = None
+    preceding_purposes = pd.Categorical(df["preceding_purpose"].astype(str), categories = purposes).codes
+    following_purposes = pd.Categorical(df["following_purpose"].astype(str), categories = purposes).codes
 
-        if problem is None:
-            # Start a new problem
-            problem = dict(
-                person_id = person_id, trip_index = trip_index, purposes = [preceding_purpose],
-                modes = [], travel_times = []
-            )
+    fixed = np.isin(purposes, FIXED_PURPOSES)
+    preceding_fixed = fixed[preceding_purposes]
+    following_fixed = fixed[following_purposes]
 
-        problem["purposes"].append(following_purpose)
-        problem["modes"].append(mode)
-        problem["travel_times"].append(travel_time)
+    # A problem ends with a fixed activity or with the last trip of a person
+    trip_count = len(df)
 
-        if problem["purposes"][-1] in FIXED_PURPOSES:
-            # The current chain (or initial tail) ends with a fixed activity.
-            yield problem
-            problem = None
+    last_trip = np.ones((trip_count,), dtype = bool)
+    last_trip[:-1] = person_ids[1:] != person_ids[:-1]
 
-    if not problem is None:
-        yield problem
+    problem_end = following_fixed | last_trip
 
-LOCATION_FIELDS = ["person_id", "home", "work", "education"]
+    problem_start = np.ones((trip_count,), dtype = bool)
+    problem_start[1:] = problem_end[:-1]
 
-def find_assignment_problems(df, df_locations):
-    """
-        Enriches assignment problems with:
-          - Locations of the fixed activities
-          - Size of the problem
-          - Reduces purposes to the variable ones
-    """
-    location_iterator = df_locations[LOCATION_FIELDS].itertuples(index = False)
-    current_location = None
+    starts = np.nonzero(problem_start)[0]
+    ends = np.nonzero(problem_end)[0]
+    trip_problems = np.cumsum(problem_start) - 1
+
+    # Variable activities are the non-fixed following activities of all trips
+    # and the non-fixed preceding activity of the first trip of a problem
+    following_trips = np.nonzero(~following_fixed)[0]
+    preceding_trips = starts[~preceding_fixed[starts]]
+
+    activity_keys = np.hstack([2 * preceding_trips, 2 * following_trips + 1])
+    activity_problems = np.hstack([trip_problems[preceding_trips], trip_problems[following_trips]])
+    activity_purposes = np.hstack([preceding_purposes[preceding_trips], following_purposes[following_trips]])
+
+    sorter = np.argsort(activity_keys, kind = "mergesort")
+    activity_problems = activity_problems[sorter]
+    activity_purposes = activity_purposes[sorter]
 
-    for problem in find_bare_assignment_problems(df):
-        origin_purpose = problem["purposes"][0]
-        destination_purpose = problem["purposes"][-1]
+    sizes = np.bincount(activity_problems, minlength = len(starts))
 
-        # Reduce purposes
-        if origin_purpose in FIXED_PURPOSES and destination_purpose in FIXED_PURPOSES:
-            problem["purposes"] = problem["purposes"][1:-1]
+    # Skip problems without variable activities
+    selection = sizes > 0
+    activity_purposes = activity_purposes[selection[activity_problems]]
 
-        elif origin_purpose in FIXED_PURPOSES:
-            problem["purposes"] = problem["purposes"][1:]
+    starts, ends, sizes = starts[selection], ends[selection], sizes[selection]
+    has_origin = preceding_fixed[starts]
+    has_destination = following_fixed[ends]
 
-        elif destination_purpose in FIXED_PURPOSES:
-            problem["purposes"] = problem["purposes"][:-1]
+    # Find fixed locations (only converting the required points)
+    location_person_ids = df_locations["person_id"].values
+    location_columns = [df_locations[purpose].values for purpose in FIXED_PURPOSES]
 
-        else:
-            pass # Neither chain nor tail
+    location_rows = np.searchsorted(location_person_ids, person_ids[starts])
 
-        # Define size
-        problem["size"] = len(problem["purposes"])
+    found = location_rows < len(location_person_ids)
+    found[found] = location_person_ids[location_rows[found]] == person_ids[starts][found]
+    location_rows[~found] = -1
 
-        if problem["size"] == 0:
-            continue # We can skip if there are no variable activities
+    if np.any(location_rows < 0):
+        raise RuntimeError("No fixed locations found for person %d" % person_ids[starts][location_rows < 0][0])
 
-        # Advance location iterator until we arrive at the current problem's person
-        while current_location is None or current_location[0] != problem["person_id"]:
-            current_location = next(location_iterator)
+    fixed_indices = np.full((len(purposes),), -1, dtype = np.int64)
+    fixed_indices[fixed] = [FIXED_PURPOSES.index(purpose) for purpose in purposes[fixed]]
 
-        # Define origin and destination locations if they have fixed purposes
-        problem["origin"] = None
-        problem["destination"] = None
+    origin_keys = location_rows * len(FIXED_PURPOSES) + fixed_indices[preceding_purposes[starts]]
+    destination_keys = location_rows * len(FIXED_PURPOSES) + fixed_indices[following_purposes[ends]]
 
-        if origin_purpose in FIXED_PURPOSES:
-            problem["origin"] = current_location[LOCATION_FIELDS.index(origin_purpose)] # Shapely POINT
-            problem["origin"] = np.array([[problem["origin"].x, problem["origin"].y]])
+    keys, inverse = np.unique(np.hstack([
+        origin_keys[has_origin], destination_keys[has_destination]
+    ]), return_inverse = True)
 
-        if destination_purpose in FIXED_PURPOSES:
-            problem["destination"] = current_location[LOCATION_FIELDS.index(destination_purpose)] # Shapely POINT
-            problem["destination"] = np.array([[problem["destination"].x, problem["destination"].y]])
+    points = [location_columns[key % len(FIXED_PURPOSES)][key // len(FIXED_PURPOSES)] for key in keys]
 
-        if problem["origin"] is None:
-            problem["activity_index"] = problem["trip_index"]
-        else:
-            problem["activity_index"] = problem["trip_index"] + 1
+    for key, point in zip(keys, points):
+        if not hasattr(point, "coords") or point.is_empty:
+            raise RuntimeError("No %s location found for person %d" % (
+                FIXED_PURPOSES[key % len(FIXED_PURPOSES)], location_person_ids[key // len(FIXED_PURPOSES)]
+            ))
 
-        yield problem
+    coordinates = np.array([point.coords[0] for point in points], dtype = np.float64).reshape(-1, 2)
+
+    origins = np.full((len(starts), 2), np.nan)
+    origins[has_origin] = coordinates[inverse[:np.count_nonzero(has_origin)]]
+
+    destinations = np.full((len(starts), 2), np.nan)
+    destinations[has_destination] = coordinates[inverse[np.count_nonzero(has_origin):]]
+
+    # Trips and activities of the selected problems
+    trip_counts = ends - starts + 1
+    trip_selection = np.repeat(starts, trip_counts) + np.arange(np.sum(trip_counts)) - np.repeat(np.cumsum(trip_counts) - trip_counts, trip_counts)
+
+    mode_codes, modes = pd.factorize(df["mode"].astype(str).values[trip_selection], sort = True)
+
+    return dict(
+        person_id = person_ids[starts],
+        trip_index = trip_indices[starts],
+        activity_index = trip_indices[starts] + has_origin,
+        size = sizes,
+        has_origin = has_origin, origin = origins,
+        has_destination = has_destination, destination = destinations,
+        trip_offsets = np.hstack([[0], np.cumsum(trip_counts)]),
+        activity_offsets = np.hstack([[0], np.cumsum(sizes)]),
+        mode = mode_codes, travel_time = df["travel_time"].values[trip_selection],
+        purpose = activity_purposes,
+        modes = np.asarray(modes, dtype = object), purposes = purposes.astype(object)
+    )
+
+def get_assignment_problems(table, start = 0, end = None):
+    """
+        Yields the problems in the given range of a problem table in the
+        form that is used by the solvers.
+    """
+    if end is None:
+        end = len(table["person_id"])
+
+    trip_offsets = table["trip_offsets"][start:end + 1]
+    activity_offsets = table["activity_offsets"][start:end + 1]
+
+    modes = table["modes"][table["mode"][trip_offsets[0]:trip_offsets[-1]]].tolist()
+    travel_times = table["travel_time"][trip_offsets[0]:trip_offsets[-1]].tolist()
+    purposes = table["purposes"][table["purpose"][activity_offsets[0]:activity_offsets[-1]]].tolist()
+
+    trip_offsets = (trip_offsets - trip_offsets[0]).tolist()
+    activity_offsets = (activity_offsets - activity_offsets[0]).tolist()
+
+    for index in range(end - start):
+        trip_start, trip_end = trip_offsets[index], trip_offsets[index + 1]
+        activity_start, activity_end = activity_offsets[index], activity_offsets[index + 1]
+        problem_index = start + index
+
+        yield dict(
+            person_id = table["person_id"][problem_index],
+            trip_index = table["trip_index"][problem_index],
+            activity_index = table["activity_index"][problem_index],
+            size = table["size"][problem_index],
+            purposes = purposes[activity_start:activity_end],
+            modes = modes[trip_start:trip_end],
+            travel_times = travel_times[trip_start:trip_end],
+            origin = table["origin"][problem_index:problem_index + 1].copy() if table["has_origin"][problem_index] else None,
+            destination = table["destination"][problem_index:problem_index + 1].copy() if table["has_destination"][problem_index] else None
+        )
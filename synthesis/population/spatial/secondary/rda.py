@@ -16,14 +16,32 @@ def calculate_feasibility(distances, direct_distance, consider_total_distance =
 
     return float(max(delta, 0))
 
+def calculate_feasibilities(distances, direct_distance, consider_total_distance = True):
+    """ Vectorized version of calculate_feasibility for a matrix with one distance chain per row. """
+    total_distance = np.sum(distances, axis = 1)
+
+    remaining_distance = total_distance[:, np.newaxis] - distances
+    delta = np.max(distances - direct_distance - remaining_distance, axis = 1)
+
+    if consider_total_distance:
+        delta = np.maximum(delta, direct_distance - total_distance)
+
+    return np.maximum(delta, 0.0)
+
 class DiscretizationSolver:
     def solve(self, problem, locations):
         raise NotImplementedError()
 
+    def solve_batch(self, problems, locations):
+        return [self.solve(problem, problem_locations) for problem, problem_locations in zip(problems, locations)]
+
 class RelaxationSolver:
     def solve(self, problem, distances):
         raise NotImplementedError()
 
+    def solve_batch(self, problems, distances):
+        return [self.solve(problem, problem_distances) for problem, problem_distances in zip(problems, distances)]
+
 class DistanceSampler:
     def sample(self, problem):
         raise NotImplementedError()
@@ -65,6 +83,53 @@ class AssignmentSolver:
 
         return best_result
 
+    def solve_batch(self, problems):
+        """
+            Solves multiple problems together. In every assignment iteration,
+            distances are sampled for all problems that have not been solved
+            yet, and the relaxation and discretization are performed for all of
+            them at once. Each problem follows the same procedure as in solve,
+            but the random draws of the problems are interleaved. Hence, the
+            results are statistically equivalent to solving the problems one
+            by one, and identical if only one problem is passed.
+        """
+        best_results = [None] * len(problems)
+        active = list(range(len(problems)))
+
+        for assignment_iteration in range(self.maximum_iterations):
+            if len(active) == 0:
+                break
+
+            active_problems = [problems[index] for index in active]
+
+            distance_results = [self.distance_sampler.sample(problem) for problem in active_problems]
+            relaxation_results = self.relaxation_solver.solve_batch(active_problems, [result["distances"] for result in distance_results])
+            discretization_results = self.discretization_solver.solve_batch(active_problems, [result["locations"] for result in relaxation_results])
+
+            remaining = []
+
+            for index, problem, distance_result, relaxation_result, discretization_result in zip(active, active_problems, distance_results, relaxation_results, discretization_results):
+                assignment_result = self.objective.evaluate(problem, distance_result, relaxation_result, discretization_result)
+
+                best_result = best_results[index]
+
+                if best_result is None or assignment_result["objective"] < best_result["objective"]:
+                    best_result = assignment_result
+
+                    assignment_result["distance"] = distance_result
+                    assignment_result["relaxation"] = relaxation_result
+                    assignment_result["discretization"] = discretization_result
+                    assignment_result["iterations"] = assignment_iteration
+
+                    best_results[index] = best_result
+
+                if not best_result["valid"]:
+                    remaining.append(index)
+
+            active = remaining
+
+        return best_results
+
 class GeneralRelaxationSolver(RelaxationSolver):
     def __init__(self, chain_solver, tail_solver = None, free_solver = None):
         self.chain_solver = chain_solver
@@ -81,6 +146,27 @@ class GeneralRelaxationSolver(RelaxationSolver):
         else:
             return self.chain_solver.solve(problem, distances)
 
+    def solve_batch(self, problems, distances):
+        # Tails and free chains are solved directly, while chains are only
+        # prepared, such that the random draws happen in the same order as in
+        # sequential calls to solve. Afterwards, all chains are relaxed at once.
+        results = [None] * len(problems)
+        chains = []
+
+        for index, (problem, problem_distances) in enumerate(zip(problems, distances)):
+            if problem["origin"] is None or problem["destination"] is None:
+                results[index] = self.solve(problem, problem_distances)
+            else:
+                results[index], locations = self.chain_solver.prepare(problem, problem_distances)
+
+                if results[index] is None:
+                    chains.append((index, locations, problem_distances))
+
+        for index, result in zip([chain[0] for chain in chains], self.chain_solver.relax([(chain[1], chain[2]) for chain in chains])):
+            results[index] = result
+
+        return results
+
 def sample_tail(random, anchor, distances):
     angles = random.random_sample(len(distances)) * 2.0 * np.pi
     offsets = np.vstack([np.cos(angles), np.sin(angles)]).T * distances[:, np.newaxis]
@@ -93,6 +179,8 @@ def sample_tail(random, anchor, distances):
     return np.vstack(locations[1:])
 
 class AngularTailSolver(RelaxationSolver):
+    sample_tail = staticmethod(sample_tail)
+
     def __init__(self, random):
         self.random = random
 
@@ -110,13 +198,85 @@ class AngularTailSolver(RelaxationSolver):
         else:
             raise RuntimeError("Invalid chain for AngularTailSolver")
 
-        locations = sample_tail(self.random, anchor, distances)
+        locations = self.sample_tail(self.random, anchor, distances)
         if reverse: locations = locations[::-1,:]
 
         assert len(locations) == len(distances)
         return dict(valid = True, locations = locations)
 
+def relax_chains(locations, distances, alpha, eps, maximum_iterations):
+    """
+        Runs the gravity simulation for N chains of the same size at once.
+        The locations have shape (N, S + 2, 2), including the fixed origin
+        and destination, and the distances have shape (N, S + 1). Chains that
+        have converged are removed from the active set, so every chain sees
+        exactly the same arithmetic as if it was relaxed on its own.
+
+        Returns the final locations, a convergence flag per chain and the
+        iteration at which each chain has stopped.
+    """
+    locations = np.array(locations, dtype = np.float64)
+    distances = np.asarray(distances, dtype = np.float64)
+
+    chain_count, point_count = locations.shape[0], locations.shape[1] - 2
+
+    valid = np.zeros((chain_count,), dtype = bool)
+    iterations = np.full((chain_count,), maximum_iterations - 1, dtype = np.int64)
+
+    origin_weights = np.ones((point_count, 2))
+    origin_weights[0,:] = 2.0
+
+    destination_weights = np.ones((point_count, 2))
+    destination_weights[-1,:] = 2.0
+
+    active = np.arange(chain_count)
+    active_locations = locations
+    active_distances = distances
+
+    for k in range(maximum_iterations):
+        directions = active_locations[:, :-1] - active_locations[:, 1:]
+        lengths = np.sqrt(np.add.reduce(directions * directions, axis = 2)) # Same as la.norm, but faster
+
+        offset = active_distances - lengths
+        lengths[lengths < 1.0] = 1.0
+        directions /= lengths[:, :, np.newaxis]
+
+        converged = np.all(np.abs(offset) < eps, axis = 1)
+
+        if converged.any(): # Write back converged chains and remove them from the active set
+            locations[active[converged]] = active_locations[converged]
+            valid[active[converged]] = True
+            iterations[active[converged]] = k
+
+            remaining = ~converged
+            active = active[remaining]
+
+            if len(active) == 0:
+                break
+
+            active_locations = active_locations[remaining]
+            active_distances = active_distances[remaining]
+            directions = directions[remaining]
+            offset = offset[remaining]
+
+        # Apply adjustment to locations
+        adjustment = 0.5 * alpha * offset[:, 1:, np.newaxis] * directions[:, 1:] * destination_weights
+        adjustment -= 0.5 * alpha * offset[:, :-1, np.newaxis] * directions[:, :-1] * origin_weights
+
+        active_locations[:, 1:-1] += adjustment
+
+        if not np.isfinite(active_locations).all():
+            raise RuntimeError("NaN/Inf value encountered during gravity simulation")
+
+    if len(active) > 0:
+        locations[active] = active_locations
+
+    return locations, valid, iterations
+
 class GravityChainSolver:
+    check_feasibility = staticmethod(check_feasibility)
+    relax_chains = staticmethod(relax_chains)
+
     def __init__(self, random, alpha = 0.3, eps = 1.0, maximum_iterations = 1000, lateral_deviation = None):
         self.alpha = 0.3
         self.eps = 1e-2
@@ -173,7 +333,12 @@ class GravityChainSolver:
                 valid = True, locations = location.reshape(-1, 2), iterations = None
             )
 
-    def solve(self, problem, distances):
+    def prepare(self, problem, distances):
+        """
+            Performs all random draws for one chain. Returns either a final
+            result (for short cuts and infeasible chains) or the initial state
+            of the gravity simulation.
+        """
         origin, destination = problem["origin"], problem["destination"]
 
         if origin is None or destination is None:
@@ -196,7 +361,7 @@ class GravityChainSolver:
 
         # If we have only one variable point, take a short cut
         if problem["size"] == 1:
-             return self.solve_two_points(problem, origin, destination, distances, direction, direct_distance)
+             return self.solve_two_points(problem, origin, destination, distances, direction, direct_distance), None
 
         # Prepare initial locations
         if np.sum(distances) < 1e-12:
@@ -207,60 +372,94 @@ class GravityChainSolver:
         locations = origin + direction * shares[:, np.newaxis] * direct_distance
         locations = np.vstack([origin, locations, destination])
 
-        if not check_feasibility(distances, direct_distance):
+        if not self.check_feasibility(distances, direct_distance):
             return dict( # We still return some locations although they may not be perfect
                 valid = False, locations = locations[1:-1], iterations = None
-            )
+            ), None
 
         # Add lateral devations
         lateral_deviation = self.lateral_deviation if not self.lateral_deviation is None else max(direct_distance, 1.0)
         locations[1:-1] += normal * 2.0 * (self.random.normal(size = len(distances) - 1)[:, np.newaxis] - 0.5) * lateral_deviation
 
-        # Prepare gravity simulation
-        valid = False
+        return None, locations
 
-        origin_weights = np.ones((len(distances) - 1, 2))
-        origin_weights[0,:] = 2.0
-
-        destination_weights = np.ones((len(distances) - 1, 2))
-        destination_weights[-1,:] = 2.0
-
-        # Run gravity simulation
-        for k in range(self.maximum_iterations):
-            directions = locations[:-1] - locations[1:]
-            lengths = la.norm(directions, axis = 1)
-
-            offset = distances - lengths
-            lengths[lengths < 1.0] = 1.0
-            directions /= lengths[:, np.newaxis]
-
-            if np.all(np.abs(offset) < self.eps): # Check if we have converged
-                valid = True
-                break
-
-            # Apply adjustment to locations
-            adjustment = np.zeros((len(distances) - 1, 2))
-            adjustment -= 0.5 * self.alpha * offset[:-1, np.newaxis] * directions[:-1] * origin_weights
-            adjustment += 0.5 * self.alpha * offset[1:, np.newaxis] * directions[1:] * destination_weights
-
-            locations[1:-1] += adjustment
+    def solve(self, problem, distances):
+        return self.solve_batch([problem], [distances])[0]
+
+    def solve_batch(self, problems, distances):
+        """
+            Solves multiple chains. The random draws are performed per chain
+            in the given order, and the chains are then relaxed together. The
+            results are identical to calling solve for each chain in sequence.
+        """
+        results = [None] * len(problems)
+        chains = []
+
+        for index, (problem, problem_distances) in enumerate(zip(problems, distances)):
+            results[index], locations = self.prepare(problem, problem_distances)
+
+            if results[index] is None:
+                chains.append((index, locations, problem_distances))
+
+        for index, result in zip([chain[0] for chain in chains], self.relax([(chain[1], chain[2]) for chain in chains])):
+            results[index] = result
+
+        return results
+
+    def relax(self, chains):
+        """
+            Runs the gravity simulation for a list of prepared chains, given as
+            tuples of initial locations and distances. Chains with the same
+            number of variable locations are stacked and relaxed together.
+        """
+        results = [None] * len(chains)
+        groups = {}
+
+        for index, (locations, distances) in enumerate(chains):
+            groups.setdefault(len(distances), []).append(index)
+
+        for indices in groups.values():
+            locations, valid, iterations = self.relax_chains(
+                np.stack([chains[index][0] for index in indices]),
+                np.stack([chains[index][1] for index in indices]),
+                self.alpha, self.eps, self.maximum_iterations
+            )
 
-            if np.isnan(locations).any() or np.isinf(locations).any():
-                raise RuntimeError("NaN/Inf value encountered during gravity simulation")
+            for k, index in enumerate(indices):
+                results[index] = dict(
+                    valid = bool(valid[k]), locations = locations[k, 1:-1], iterations = int(iterations[k])
+                )
 
-        return dict(
-            valid = valid, locations = locations[1:-1], iterations = k
-        )
+        return results
 
 class FeasibleDistanceSampler(DistanceSampler):
-    def __init__(self, random, maximum_iterations = 1000):
+    """
+        Samples distance chains until a feasible one is found. In each attempt,
+        'draws' candidate chains are sampled at once and checked together. The
+        candidates of an attempt are sampled from consecutive random numbers
+        (row by row), i.e. the same random numbers that 'draws' consecutive
+        calls to sample_distances would use, and the first feasible (or least
+        infeasible) candidate is selected. Hence, the selected chain does not
+        depend on 'draws', but the random numbers of the remaining candidates
+        of the last attempt are consumed, which affects all subsequent draws.
+    """
+
+    calculate_feasibility = staticmethod(calculate_feasibility)
+    calculate_feasibilities = staticmethod(calculate_feasibilities)
+
+    def __init__(self, random, maximum_iterations = 1000, draws = 1):
         self.maximum_iterations = maximum_iterations
         self.random = random
+        self.draws = draws
 
     def sample_distances(self, problem):
         # Return distance chains per row
         raise NotImplementedError()
 
+    def sample_distance_matrix(self, problem, count):
+        # Return a matrix with one distance chain per row
+        return np.vstack([self.sample_distances(problem) for k in range(count)])
+
     def sample(self, problem):
         origin, destination = problem["origin"], problem["destination"]
 
@@ -286,12 +485,15 @@ class FeasibleDistanceSampler(DistanceSampler):
             return dict(valid = True, distances = distances, iterations = None)
 
         # This is the general case
+        if self.draws > 1:
+            return self.sample_batch(problem, direct_distance)
+
         best_distances = None
         best_delta = None
 
         for k in range(self.maximum_iterations):
             distances = self.sample_distances(problem)
-            delta = calculate_feasibility(distances, direct_distance)
+            delta = self.calculate_feasibility(distances, direct_distance)
 
             if best_delta is None or delta < best_delta:
                 best_delta = delta
@@ -306,6 +508,37 @@ class FeasibleDistanceSampler(DistanceSampler):
             iterations = k
         )
 
+    def sample_batch(self, problem, direct_distance):
+        best_distances = None
+        best_delta = None
+
+        offset = 0
+        iterations = self.maximum_iterations - 1
+
+        while offset < self.maximum_iterations:
+            count = int(min(self.draws, self.maximum_iterations - offset))
+
+            candidates = self.sample_distance_matrix(problem, count)
+            deltas = self.calculate_feasibilities(candidates, direct_distance)
+
+            index = np.argmin(deltas) # First candidate with the smallest delta
+
+            if best_delta is None or deltas[index] < best_delta:
+                best_delta = deltas[index]
+                best_distances = candidates[index]
+
+                if best_delta == 0.0:
+                    iterations = offset + index
+                    break
+
+            offset += count
+
+        return dict(
+            valid = best_delta == 0.0,
+            distances = best_distances,
+            iterations = iterations
+        )
+
 class DiscretizationErrorObjective(AssignmentObjective):
     def __init__(self, thresholds):
         self.thresholds = thresholds
@@ -0,0 +1,233 @@
+import numpy as np
+import numba
+
+import synthesis.population.spatial.secondary.rda as rda
+
+"""
+Compiled (numba, nopython) versions of the small numerical kernels of the
+relaxation-discretization algorithm in rda, selected by 'secloc_engine: numba'.
+
+All random numbers are still drawn from the RandomState of the solvers, in the
+same order and amount as in the Python implementation, and the kernels perform
+the same floating point operations in the same order. Hence, both engines are
+interchangeable and produce the same locations for the same seed.
+"""
+
+@numba.njit
+def _sum(values):
+    # Summation in the same order as NumPy's pairwise summation, such that the
+    # kernels round exactly like np.sum
+    count = len(values)
+
+    if count < 8:
+        result = 0.0
+
+        for i in range(count):
+            result += values[i]
+
+        return result
+
+    elif count <= 128:
+        partial = values[:8].copy()
+        end = count - count % 8
+
+        for i in range(8, end, 8):
+            for j in range(8):
+                partial[j] += values[i + j]
+
+        result = ((partial[0] + partial[1]) + (partial[2] + partial[3])) + ((partial[4] + partial[5]) + (partial[6] + partial[7]))
+
+        for i in range(end, count):
+            result += values[i]
+
+        return result
+
+    else:
+        middle = count // 2
+        middle -= middle % 8
+        return _sum(values[:middle]) + _sum(values[middle:])
+
+@numba.njit
+def _calculate_feasibility(distances, direct_distance, consider_total_distance):
+    total_distance = _sum(distances)
+    delta = -np.inf
+
+    for i in range(len(distances)):
+        delta = max(delta, distances[i] - direct_distance - (total_distance - distances[i]))
+
+    if consider_total_distance:
+        delta = max(delta, direct_distance - total_distance)
+
+    return max(delta, 0.0)
+
+def calculate_feasibility(distances, direct_distance, consider_total_distance = True):
+    return _calculate_feasibility(distances, float(direct_distance), consider_total_distance)
+
+def check_feasibility(distances, direct_distance, consider_total_distance = True):
+    return calculate_feasibility(distances, direct_distance, consider_total_distance) == 0.0
+
+@numba.njit
+def _calculate_feasibilities(distances, direct_distance, consider_total_distance):
+    deltas = np.empty((distances.shape[0],))
+
+    for k in range(distances.shape[0]):
+        deltas[k] = _calculate_feasibility(distances[k], direct_distance, consider_total_distance)
+
+    return deltas
+
+def calculate_feasibilities(distances, direct_distance, consider_total_distance = True):
+    return _calculate_feasibilities(distances, float(direct_distance), consider_total_distance)
+
+@numba.njit
+def _sample_tail(anchor, angles, distances):
+    locations = np.empty((len(distances), 2))
+    x, y = anchor[0], anchor[1]
+
+    for k in range(len(distances)):
+        x += np.cos(angles[k]) * distances[k]
+        y += np.sin(angles[k]) * distances[k]
+
+        locations[k, 0] = x
+        locations[k, 1] = y
+
+    return locations
+
+def sample_tail(random, anchor, distances):
+    angles = random.random_sample(len(distances)) * 2.0 * np.pi
+    return _sample_tail(np.asarray(anchor, dtype = np.float64).reshape(-1), angles, np.asarray(distances, dtype = np.float64))
+
+@numba.njit
+def _relax_chain(locations, distances, alpha, eps, maximum_iterations):
+    # Returns the convergence state (1 = converged, 0 = not converged,
+    # -1 = NaN/Inf) and the last iteration
+    point_count = len(distances) - 1
+
+    directions = np.empty((point_count + 1, 2))
+    lengths = np.empty((point_count + 1,))
+    offset = np.empty((point_count + 1,))
+
+    for k in range(maximum_iterations):
+        converged = True
+
+        for i in range(point_count + 1):
+            directions[i, 0] = locations[i, 0] - locations[i + 1, 0]
+            directions[i, 1] = locations[i, 1] - locations[i + 1, 1]
+            lengths[i] = np.sqrt(directions[i, 0] * directions[i, 0] + directions[i, 1] * directions[i, 1])
+
+            offset[i] = distances[i] - lengths[i]
+            if lengths[i] < 1.0: lengths[i] = 1.0
+
+            directions[i, 0] /= lengths[i]
+            directions[i, 1] /= lengths[i]
+
+            converged &= np.abs(offset[i]) < eps
+
+        if converged:
+            return 1, k
+
+        finite = True
+
+        for i in range(point_count):
+            origin_weight = 2.0 if i == 0 else 1.0
+            destination_weight = 2.0 if i == point_count - 1 else 1.0
+
+            for d in range(2):
+                adjustment = 0.5 * alpha * offset[i + 1] * directions[i + 1, d] * destination_weight
+                adjustment -= 0.5 * alpha * offset[i] * directions[i, d] * origin_weight
+
+                locations[i + 1, d] += adjustment
+                finite &= np.isfinite(locations[i + 1, d])
+
+        if not finite:
+            return -1, k
+
+    return 0, maximum_iterations - 1
+
+@numba.njit
+def _relax_chains(locations, distances, alpha, eps, maximum_iterations):
+    states = np.empty((len(locations),), dtype = np.int64)
+    iterations = np.empty((len(locations),), dtype = np.int64)
+
+    for n in range(len(locations)):
+        states[n], iterations[n] = _relax_chain(locations[n], distances[n], alpha, eps, maximum_iterations)
+
+    return states, iterations
+
+def relax_chains(locations, distances, alpha, eps, maximum_iterations):
+    """ Compiled version of rda.relax_chains. """
+    locations = np.array(locations, dtype = np.float64)
+    distances = np.ascontiguousarray(distances, dtype = np.float64)
+
+    states, iterations = _relax_chains(locations, distances, float(alpha), float(eps), int(maximum_iterations))
+
+    if np.any(states < 0):
+        raise RuntimeError("NaN/Inf value encountered during gravity simulation")
+
+    return locations, states == 1, iterations
+
+@numba.njit
+def _solve_two_points(origin, direction, distances, direct_distance, r):
+    total_distance = distances[0] + distances[1]
+
+    if direct_distance == 0.0:
+        return origin + direction * distances[0], distances[0] == distances[1]
+
+    elif direct_distance > total_distance or direct_distance < np.abs(distances[0] - distances[1]):
+        ratio = 1.0
+
+        if distances[0] > 0.0 or distances[1] > 0.0:
+            ratio = distances[0] / total_distance
+
+        length = direct_distance if direct_distance > total_distance else max(distances[0], distances[1])
+        return origin + direction * ratio * length, False
+
+    else:
+        A = 0.5 * ( distances[0]**2 - distances[1]**2 + direct_distance**2 ) / direct_distance
+        H = np.sqrt(max(0.0, distances[0]**2 - A**2))
+
+        center = origin + direction * A
+        offset = direction * H
+        sign = 1.0 if r < 0.5 else -1.0
+
+        location = np.empty((2,))
+        location[0] = center[0] + sign * offset[1]
+        location[1] = center[1] + sign * -offset[0]
+
+        return location, True
+
+class NumbaGravityChainSolver(rda.GravityChainSolver):
+    check_feasibility = staticmethod(check_feasibility)
+    relax_chains = staticmethod(relax_chains)
+
+    def solve_two_points(self, problem, origin, destination, distances, direction, direct_distance):
+        # A random number is only needed (and drawn) if a solution exists
+        r = 0.0
+
+        if direct_distance != 0.0 and direct_distance <= distances[0] + distances[1] and direct_distance >= np.abs(distances[0] - distances[1]):
+            r = self.random.random_sample()
+
+        location, valid = _solve_two_points(
+            origin.reshape(-1).astype(np.float64), direction.reshape(-1).astype(np.float64),
+            np.asarray(distances, dtype = np.float64), float(direct_distance), r
+        )
+
+        return dict(
+            valid = bool(valid), locations = location.reshape(-1, 2), iterations = None
+        )
+
+class NumbaAngularTailSolver(rda.AngularTailSolver):
+    sample_tail = staticmethod(sample_tail)
+
+@numba.njit
+def sample_distance_matrix(uniform, cdfs, values, starts, ends):
+    """
+        Samples one distance chain per row of uniform values, given the ranges
+        of the distribution of each trip in the flattened cdfs and values.
+    """
+    distances = np.empty(uniform.shape)
+
+    for k in range(uniform.shape[0]):
+        for i in range(uniform.shape[1]):
+            distances[k, i] = values[starts[i] + np.searchsorted(cdfs[starts[i]:ends[i]], uniform[k, i])]
+
+    return distances
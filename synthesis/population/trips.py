@@ -9,6 +9,7 @@ This stage duplicates trips and attaches them to the synthetic population.
 
 def configure(context):
     context.stage("synthesis.population.matched")
+    context.stage("synthesis.population.sampled")
     context.config("random_seed")
 
     hts = context.config("hts")
@@ -44,6 +45,10 @@ def execute(context):
     df_trips["departure_time"] = np.round(df_trips["departure_time"])
     df_trips["arrival_time"] = np.round(df_trips["arrival_time"])
 
+    # Only keep persons of the current sample (matching may cover a larger nested sample)
+    df_persons = context.stage("synthesis.population.sampled")[["person_id"]]
+    df_trips = df_trips[df_trips["person_id"].isin(df_persons["person_id"])]
+
     assert (df_trips["departure_time"] >= 0.0).all()
     assert (df_trips["arrival_time"] >= 0.0).all()
 
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import Levenshtein
+
+import data.addresses as addresses
+
+def test_find_closest():
+    random = np.random.RandomState(0)
+    letters = np.array(list("ABCDE "))
+
+    candidates = sorted(set(["".join(letters[random.randint(len(letters), size = random.randint(1, 12))]) for k in range(300)]))
+    queries = ["".join(letters[random.randint(len(letters), size = random.randint(1, 12))]) for k in range(300)]
+
+    tree = addresses.build_tree(candidates)
+
+    for query in queries + candidates[:10]:
+        distances = np.array([Levenshtein.distance(query, candidate) for candidate in candidates])
+        index = np.argmin(distances)
+        expected = candidates[index] if distances[index] <= 2 else None
+
+        assert addresses.find_closest(tree, query, 2) == expected
+
+    assert addresses.find_closest(addresses.build_tree([]), "A", 2) is None
+
+def test_find_first():
+    df_left = pd.DataFrame(dict(street = ["R A", "R B", "R A", "R C"], number = [1, 2, 2, 1]))
+    df_right = pd.DataFrame(dict(street = ["R A", "R B", "R A", "R A"], number = [2.0, 2.0, 1.0, 2.0]))
+
+    left_keys, right_keys = addresses.encode_addresses(df_left, df_right, ["street", "number"])
+    assert list(addresses.find_first(left_keys, right_keys)) == [2, 1, 0, -1]
+
+def test_normalize_streets():
+    df = pd.Series(["R ST-MARTIN", "PLACE STE ANNE", "ST JEAN 2 EGLISES", "R DE LA PTE D'ITALIE", "R 3-FRERES", None, "R ST ST"], index = [5, 4, 3, 2, 1, 0, 6])
+    df_normalized = addresses.normalize_streets(df)
+
+    assert list(df_normalized.index) == [5, 4, 3, 2, 1, 0, 6]
+    assert list(df_normalized.iloc[:5]) == ["R SAINT MARTIN", "PL SAINTE ANNE", "SAINT JEAN DEUX EGLISES", "R DE LA PORTE D ITALIE", "R TROIS FRERES"]
+    assert df_normalized.iloc[5] is np.nan
+    assert df_normalized.iloc[6] == "R SAINT ST"
+
+    assert list(addresses.normalize_street_types(pd.Series(["RUE", "QUAI", "AV"]))) == ["R", "QU", "AV"]
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+import data.census.cleaned as cleaned
+
+def create_census(nummi):
+    persons = len(nummi)
+
+    df = pd.DataFrame(dict(
+        CANTVILLE = ["0101"] * persons, NUMMI = nummi, AGED = ["030"] * persons,
+        COUPLE = ["1"] * persons, CS1 = ["3"] * persons, DEPT = ["75"] * persons,
+        ETUD = ["2"] * persons, ILETUD = ["Z"] * persons, ILT = ["1"] * persons,
+        IPONDI = [1.0] * persons, IRIS = ["751010101"] * persons, REGION = ["11"] * persons,
+        SEXE = ["1"] * persons, TACT = ["11"] * persons, TRANS = ["4"] * persons,
+        VOIT = ["1"] * persons, DEROU = ["0"] * persons
+    ))
+
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype("category")
+
+    return df
+
+def test_household_ids():
+    df = cleaned.clean_attributes(create_census(["0000001", "Z", "0000002", "0000001", "Z"]))
+    df = df.sort_values("person_id")
+
+    assert list(df["household_id"]) == [0, 2, 1, 0, 3]
+    assert list(df["household_size"]) == [2, 1, 1, 2, 1]
+
+    # Only persons outside of households
+    df = cleaned.clean_attributes(create_census(["Z", "Z"]))
+    assert list(df.sort_values("person_id")["household_id"]) == [0, 1]
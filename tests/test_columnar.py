@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+import data.columnar as columnar
+
+def test_read_table(tmpdir):
+    path = str(tmpdir.join("table.hdf"))
+
+    df = pd.DataFrame(dict(
+        commune_id = ["75056", "77001", "75056", "93001", np.nan],
+        departement_id = ["75", "77", "75", "93", "93"],
+        weight = [1.5, 2.0, 3.5, 4.0, 5.0],
+        count = [1, 2, 3, 4, 5]
+    ), index = [10, 11, 12, 13, 14])
+
+    columnar.write_table(path, df, data_columns = ["commune_id", "departement_id"])
+
+    # All columns are returned with their original values
+    pd.testing.assert_frame_equal(df, columnar.read_table(path))
+
+    # Projection and filters
+    df_read = columnar.read_table(path, ["commune_id", "weight"], filters = [
+        (["departement_id"], ["75", "93"]), (["commune_id"], ["75056", "93001"])
+    ])
+
+    pd.testing.assert_frame_equal(df.loc[[10, 12, 13], ["commune_id", "weight"]], df_read)
+
+    # Filters on several columns and with many values
+    df_read = columnar.read_table(path, ["weight"], filters = [
+        (["commune_id", "departement_id"], ["77", "93001"] + ["%05d" % index for index in range(100)])
+    ])
+
+    pd.testing.assert_frame_equal(df.loc[[11, 13], ["weight"]], df_read)
+
+    # No selected rows
+    assert len(columnar.read_table(path, ["weight"], filters = [(["departement_id"], ["01"])])) == 0
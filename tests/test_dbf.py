@@ -0,0 +1,68 @@
+import pysal
+import simpledbf
+import numpy as np
+import pandas as pd
+
+import data.dbf as dbf
+
+def write_table(path):
+    random = np.random.RandomState(0)
+    observations = 1000
+
+    db = pysal.open(path, "w")
+    db.header = ["DEPT", "COMMUNE", "CATEGORY", "IPONDI", "COUNT"]
+    db.field_spec = [("C", 3, 0), ("C", 5, 0), ("C", 4, 0), ("N", 10, 7), ("N", 4, 0)]
+
+    for index in range(observations):
+        db.write([
+            str(random.randint(75, 80)), "%05d" % random.randint(100),
+            ["", "A", "BB", " CC"][random.randint(4)],
+            random.random_sample() * 10.0, random.randint(1000)
+        ])
+
+    db.close()
+
+    # Mark one record as deleted
+    record_count, header_length, record_length, fields = dbf.read_header(path)
+
+    with open(path, "r+b") as f:
+        f.seek(header_length + 10 * record_length)
+        f.write(b"*")
+
+def test_read_records(tmpdir):
+    path = str(tmpdir.join("table.dbf"))
+    write_table(path)
+
+    header = dbf.read_header(path)
+    columns = ["COMMUNE", "CATEGORY", "IPONDI", "COUNT"]
+
+    df_reference = simpledbf.Dbf5(path).to_dataframe()
+    df_reference.index = np.delete(np.arange(header[0]), 10)
+
+    # All records
+    df_records = dbf.read_records(path, header, 0, header[0], columns)
+    assert header[0] == 1000 and len(df_records) == 999
+    pd.testing.assert_frame_equal(df_reference[columns], df_records, check_index_type = False)
+
+    # Filtered records in two ranges
+    filters = [(["DEPT"], ["75", "77"]), (["COMMUNE", "CATEGORY"], ["00010", "00020", "BB"])]
+
+    f = df_reference["DEPT"].isin(["75", "77"])
+    f &= df_reference["COMMUNE"].isin(["00010", "00020"]) | (df_reference["CATEGORY"] == "BB")
+
+    df_records = pd.concat([
+        dbf.read_records(path, header, 0, 500, columns, filters),
+        dbf.read_records(path, header, 500, header[0], columns, filters)
+    ])
+
+    assert np.count_nonzero(f) > 0
+    pd.testing.assert_frame_equal(df_reference[f][columns], df_records, check_index_type = False)
+
+    # Prefixes of different lengths
+    prefixes = [(["COMMUNE"], ["0001", "0005", "00099"])]
+    f = df_reference["COMMUNE"].str.startswith("0001") | df_reference["COMMUNE"].str.startswith("0005") | (df_reference["COMMUNE"] == "00099")
+
+    df_records = dbf.read_records(path, header, 0, header[0], columns, prefixes = prefixes)
+
+    assert np.count_nonzero(f) > 0
+    pd.testing.assert_frame_equal(df_reference[f][columns], df_records, check_index_type = False)
@@ -23,18 +23,19 @@ def test_determinism(tmpdir):
     data_path = str(tmpdir.mkdir("data"))
     testdata.create(data_path)
 
-    for index in range(2):
-        _test_determinism(index, data_path, tmpdir)
+    # The output must neither change between runs nor with the number of processes
+    for index, processes in enumerate([1, 2, 4]):
+        _test_determinism(index, processes, data_path, tmpdir)
 
-def _test_determinism(index, data_path, tmpdir):
-    print("Running index %d" % index)
+def _test_determinism(index, processes, data_path, tmpdir):
+    print("Running index %d with %d processes" % (index, processes))
 
     cache_path = str(tmpdir.mkdir("cache_%d" % index))
     output_path = str(tmpdir.mkdir("output_%d" % index))
     config = dict(
         data_path = data_path, output_path = output_path,
         regions = [10, 11], sampling_rate = 1.0, hts = "entd",
-        random_seed = 1000, processes = 1,
+        random_seed = 1000, processes = processes,
         secloc_maximum_iterations = 10,
         maven_skip_tests = True
     )
@@ -47,16 +48,20 @@ def _test_determinism(index, data_path, tmpdir):
     synpp.run(stages, config, working_directory = cache_path)
 
     REFERENCE_HASHES = {
-        "activities.csv":                   "dcf8e08e9f238c90bff0298048251dac",
-        "persons.csv":                      "ed87e2b6dfd2a9914d5fc7b2bf6d52d3",
-        "households.csv":                   "882ce7dc1a44403d12c5aa10709c0d5b",
+        "activities.csv":                   "f4d16850980dbb7a34165e4b8101dcde",
+        "persons.csv":                      "41aa8b1452e45ccbde5a37dad536ecd8",
+        "households.csv":                   "058fc543d884f67e50151a4a68fb85f4",
         #"ile_de_france_population.xml.gz":  "e1407f918cb92166ebf46ad769d8d085",
         "ile_de_france_network.xml.gz":     "594f427690bb5a7fad001fc2d5e31497",
-        "ile_de_france_households.xml.gz":  "cdbd6ed5b175328861f237dc58dee1ff",
+        "ile_de_france_households.xml.gz":  "d7cd03871fe25b617a4ac6bffb7fb30a",
         #"ile_de_france_facilities.xml.gz":  "5ad41afff9ae5c470082510b943e6778",
         "ile_de_france_config.xml":         "4f44821d6162dad1928a75e5c0b14f68"
     }
 
+    # The MATSim config contains the number of threads
+    if processes != 1:
+        del REFERENCE_HASHES["ile_de_france_config.xml"]
+
     # activities.gpkg, trips.gpkg, meta.json,
     # ile_de_france_transit_schedule.xml.gz, ile_de_france_transit_vehicles.xml.gz
 
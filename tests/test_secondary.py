@@ -0,0 +1,89 @@
+import synpp
+from . import testdata
+
+def run_secondary_locations(data_path, cache_path, engine):
+    config = dict(
+        data_path = data_path, regions = [10, 11], sampling_rate = 1.0, hts = "entd",
+        random_seed = 1000, processes = 1,
+        secloc_maximum_iterations = 10,
+        secloc_engine = engine
+    )
+
+    stages = [
+        dict(descriptor = "synthesis.population.spatial.secondary.locations")
+    ]
+
+    return synpp.run(stages, config, working_directory = cache_path)[0]
+
+def test_numba_engine(tmpdir):
+    data_path = str(tmpdir.mkdir("data"))
+    testdata.create(data_path)
+
+    # Both runs share the cache, so they work on the same upstream data
+    cache_path = str(tmpdir.mkdir("cache"))
+
+    df_python, df_python_convergence = run_secondary_locations(data_path, cache_path, "python")
+    df_numba, df_numba_convergence = run_secondary_locations(data_path, cache_path, "numba")
+
+    assert len(df_python) > 0
+    assert list(df_python["person_id"]) == list(df_numba["person_id"])
+    assert list(df_python["activity_index"]) == list(df_numba["activity_index"])
+    assert list(df_python["location_id"]) == list(df_numba["location_id"])
+    assert list(df_python["geometry"].x) == list(df_numba["geometry"].x)
+    assert list(df_python["geometry"].y) == list(df_numba["geometry"].y)
+
+    assert list(df_python_convergence["valid"]) == list(df_numba_convergence["valid"])
+
+def test_distance_sampler_ranges():
+    import numpy as np
+    from synthesis.population.spatial.secondary.components import CustomDistanceSampler, NumbaDistanceSampler
+
+    # Short travel times give distances of 1 or 2, long ones of 10 or 20
+    distributions = dict(car = dict(bounds = np.array([10.0, np.inf]), distributions = [
+        dict(cdf = np.array([0.5, 1.0]), values = np.array([1.0, 2.0])),
+        dict(cdf = np.array([0.5, 1.0]), values = np.array([10.0, 20.0]))
+    ]))
+
+    short_problem = dict(modes = ["car", "car"], travel_times = [5.0, 5.0], origin = None, destination = None, size = 1)
+    long_problem = dict(modes = ["car", "car"], travel_times = [50.0, 50.0], origin = None, destination = None, size = 1)
+
+    for sampler_class in (CustomDistanceSampler, NumbaDistanceSampler):
+        # A fresh sampler
+        sampler = sampler_class(np.random.RandomState(0), distributions)
+        assert set(sampler.sample_distance_matrix(short_problem, 10).flatten()) <= { 1.0, 2.0 }
+
+        # After sampling another problem
+        assert set(sampler.sample(long_problem)["distances"]) <= { 10.0, 20.0 }
+        assert set(sampler.sample_distance_matrix(short_problem, 10).flatten()) <= { 1.0, 2.0 }
+        assert set(sampler.sample_distances(long_problem)) <= { 10.0, 20.0 }
+
+def test_missing_fixed_locations():
+    import pytest
+    import pandas as pd
+    import shapely.geometry as geo
+    from synthesis.population.spatial.secondary.problems import find_assignment_problems
+
+    df_trips = pd.DataFrame(dict(
+        person_id = [1, 1, 2, 2], trip_index = [0, 1, 0, 1],
+        preceding_purpose = ["home", "shop", "home", "leisure"],
+        following_purpose = ["shop", "work", "leisure", "home"],
+        mode = ["car"] * 4, travel_time = [600.0] * 4
+    ))
+
+    df_locations = pd.DataFrame(dict(
+        person_id = [1, 2], home = [geo.Point(0, 0), geo.Point(1, 1)],
+        work = [geo.Point(2, 2), None], education = [None, None]
+    ))
+
+    problems = find_assignment_problems(df_trips, df_locations)
+    assert list(problems["destination"][0]) == [2.0, 2.0]
+
+    # A fixed location is missing
+    df_locations.loc[0, "work"] = None
+
+    with pytest.raises(RuntimeError, match = "No work location found for person 1"):
+        find_assignment_problems(df_trips, df_locations)
+
+    # A person is missing
+    with pytest.raises(RuntimeError, match = "No fixed locations found for person 2"):
+        find_assignment_problems(df_trips, df_locations.iloc[:1])
@@ -0,0 +1,19 @@
+import numpy as np
+import geopandas as gpd
+
+import data.shapefile as shapefile
+
+def test_read_points(tmpdir):
+    path = str(tmpdir.join("points.shp"))
+    random = np.random.RandomState(0)
+
+    x = random.random_sample(size = 100) * 1e6
+    y = random.random_sample(size = 100) * 1e6
+
+    gpd.GeoDataFrame(dict(value = np.arange(100)), geometry = gpd.points_from_xy(x, y), crs = "EPSG:2154").to_file(path)
+
+    records = [99, 0, 10, 10, 57]
+    x_read, y_read = shapefile.read_points(path, records)
+
+    assert np.all(x_read == x[records])
+    assert np.all(y_read == y[records])
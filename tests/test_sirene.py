@@ -0,0 +1,44 @@
+import io
+import zipfile
+import numpy as np
+import pandas as pd
+
+import data.sirene.raw as raw
+
+def test_read_blocks(tmpdir):
+    path = str(tmpdir.join("sirene.zip"))
+
+    df = pd.DataFrame(dict(
+        siret = range(10),
+        codeCommuneEtablissement = ["75056", "2A004", "97101", "77001", "93001"] * 2,
+        libelleVoieEtablissement = ["DE LA GARE", "DU \"MOULIN\"\nBAT A", "DE PARIS", "\n", "DES LILAS, \"B\""] * 2,
+        numeroVoieEtablissement = [1, np.nan, 3, 4, np.nan] * 2,
+        etatAdministratifEtablissement = ["A", "A", "A", "F", "A"] * 2
+    ))
+
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("sirene.csv", df.to_csv(index = False))
+
+    # Small blocks, such that records and quoted fields are split between reads
+    for block_size in (1, 7, 16, 1000):
+        blocks = raw.read_blocks(path, block_size = block_size)
+        names = list(pd.read_csv(io.BytesIO(next(blocks))).columns)
+
+        df_blocks = [
+            pd.read_csv(io.BytesIO(block), header = None, names = names, dtype = raw.DTYPES)
+            for block in blocks
+        ]
+
+        df_read = pd.concat(df_blocks, ignore_index = True)
+        df_read["numeroVoieEtablissement"] = pd.to_numeric(df_read["numeroVoieEtablissement"])
+
+        pd.testing.assert_frame_equal(df, df_read)
+        assert all([df_block["numeroVoieEtablissement"].dtype == object for df_block in df_blocks])
+
+    df_filtered = raw.filter_block(df, { "75", "2A", "971", "77" })
+    assert list(df_filtered["siret"]) == [0, 1, 2, 5, 6, 7]
+
+def test_find_end():
+    assert raw.find_end(b'1,"A\nB"\n2,"C') == 8
+    assert raw.find_end(b'1,"A\nB') == 0
+    assert raw.find_end(b'1,"A""\nB"\n') == 10